@@ -0,0 +1,317 @@
+"""
+benchmark.py
+
+Benchmark harness for the ingestion pipeline.
+
+- Generates synthetic Fashion Retail CSVs that match the sources.yml schema
+  (10k / 1M / 10M / 50M rows, or any size), with configurable dirty data:
+    * bad casts (unparseable ids / amounts / dates)
+    * rule violations (negative amounts, ratings > 5, unknown payment methods)
+    * duplicate business keys
+- Times every stage (read, cast, rules, clean) per size and, with --db,
+  the full run_source() (rejects + upsert) against the database in DB_URL
+  (point it at a local / throwaway Postgres, never production)
+- Appends one JSON line per size to bench/results.jsonl tagged with the
+  git commit, so runs can be compared across commits (--compare)
+
+Usage:
+    python -m src.benchmark --sizes 10k 1m
+    python -m src.benchmark --sizes 1m --db --duplicate-rate 0.05
+    python -m src.benchmark --compare
+"""
+
+import argparse
+import json
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.config import load_sources_config
+from src.metrics import RunMetrics
+from src.pipeline import transform_chunk
+from src.reader import read_csv_chunks
+
+RESULTS_PATH = Path(__file__).parent.parent / "bench" / "results.jsonl"
+
+PRESET_SIZES = {
+    "10k": 10_000,
+    "1m": 1_000_000,
+    "10m": 10_000_000,
+    "50m": 50_000_000,
+}
+
+# Same item vocabulary as data/Fashion_Retail_Sales.csv
+ITEMS = [
+    "Backpack", "Belt", "Blazer", "Blouse", "Boots", "Bowtie", "Camisole", "Cardigan",
+    "Coat", "Dress", "Flannel Shirt", "Flip-Flops", "Gloves", "Handbag", "Hat", "Hoodie",
+    "Jacket", "Jeans", "Jumpsuit", "Kimono", "Leggings", "Loafers", "Onesie", "Overalls",
+    "Pajamas", "Pants", "Polo Shirt", "Poncho", "Raincoat", "Romper", "Sandals", "Scarf",
+    "Shorts", "Skirt", "Slippers", "Sneakers", "Socks", "Sun Hat", "Sunglasses", "Sweater",
+    "Swimsuit", "T-shirt", "Tank Top", "Tie", "Trench Coat", "Trousers", "Tunic", "Umbrella",
+    "Vest", "Wallet",
+]
+PAYMENT_METHODS = ["Credit Card", "Cash"]
+
+# Rows generated / written per step so 50M-row files never sit in memory
+GENERATE_CHUNK_ROWS = 1_000_000
+
+
+def generate_fashion_sales(
+    n_rows: int,
+    seed: int = 0,
+    bad_cast_rate: float = 0.01,
+    rule_violation_rate: float = 0.01,
+    duplicate_rate: float = 0.01,
+    null_rate: float = 0.0,
+    id_offset: int = 0,
+) -> pd.DataFrame:
+    """
+    One synthetic batch with the raw CSV header names
+    (Customer Reference ID, Item Purchased, ...).
+    Each *_rate is the fraction of rows that get that kind of dirt.
+    """
+    rng = np.random.default_rng(seed)
+
+    customer_ids = (id_offset + rng.integers(0, max(n_rows // 4, 1), n_rows)).astype(object)
+    items = np.asarray(ITEMS, dtype=object)[rng.integers(0, len(ITEMS), n_rows)]
+    amounts = np.round(rng.gamma(2.0, 80.0, n_rows) + 10.0, 2).astype(object)
+    dates = (
+        pd.Timestamp("2022-10-01") + pd.to_timedelta(rng.integers(0, 365, n_rows), unit="D")
+    ).strftime("%Y-%m-%d").to_numpy(dtype=object)
+    ratings = np.round(rng.uniform(1.0, 5.0, n_rows), 1).astype(object)
+    payments = np.asarray(PAYMENT_METHODS, dtype=object)[rng.integers(0, 2, n_rows)]
+
+    def pick(rate):
+        return np.flatnonzero(rng.random(n_rows) < rate)
+
+    # Values that cast fine but break the business rules
+    bad = pick(rule_violation_rate)
+    kind = rng.integers(0, 3, len(bad))
+    amounts[bad[kind == 0]] = -amounts[bad[kind == 0]].astype(float)
+    ratings[bad[kind == 1]] = 7.0
+    payments[bad[kind == 2]] = "Debit"
+
+    # Unparseable values in each castable column
+    bad = pick(bad_cast_rate)
+    kind = rng.integers(0, 3, len(bad))
+    customer_ids[bad[kind == 0]] = "N/A"
+    amounts[bad[kind == 1]] = "abc"
+    dates[bad[kind == 2]] = "not_a_date"
+
+    # Missing ratings (the real file has ~10% of them)
+    ratings[pick(null_rate)] = None
+
+    # Re-use the business key of an earlier row
+    dup = pick(duplicate_rate)
+    dup = dup[dup > 0]
+    src = (rng.random(len(dup)) * dup).astype(int)
+    customer_ids[dup] = customer_ids[src]
+    items[dup] = items[src]
+    dates[dup] = dates[src]
+
+    return pd.DataFrame(
+        {
+            "Customer Reference ID": customer_ids,
+            "Item Purchased": items,
+            "Purchase Amount (USD)": amounts,
+            "Date Purchase": dates,
+            "Review Rating": ratings,
+            "Payment Method": payments,
+        }
+    )
+
+
+def write_synthetic_csv(path, n_rows: int, seed: int = 0, **rates) -> Path:
+    """Write n_rows synthetic rows to path, GENERATE_CHUNK_ROWS at a time."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    written = 0
+    step = 0
+    while written < n_rows:
+        n = min(GENERATE_CHUNK_ROWS, n_rows - written)
+        df = generate_fashion_sales(n, seed=seed + step, id_offset=written, **rates)
+        df.to_csv(path, mode="w" if step == 0 else "a", header=step == 0, index=False)
+        written += n
+        step += 1
+    return path
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).parent,
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_stages(path, source: dict, batch_size: int) -> dict:
+    """Read + transform the file chunk by chunk (no DB) and return the stage metrics."""
+    metrics = RunMetrics(source["name"])
+    chunks = metrics.timed_iter(
+        "read",
+        read_csv_chunks(str(path), chunksize=batch_size),
+        bytes_of=lambda chunk: chunk.memory_usage(index=False).sum(),
+    )
+    for df in chunks:
+        transform_chunk(df, source["schema"], rules=source.get("rules"), metrics=metrics)
+    return metrics.as_record()["stages"]
+
+
+def benchmark_full_run(path, cfg: dict, source: dict) -> dict:
+    """
+    Full run_source() (rejects + upsert included) against the DB in DB_URL.
+    Synthetic rows stay out of the Parquet cache ml_analysis reads and out
+    of the running stats / sketch tables (per-source overrides).
+    """
+    from src.main import run_source
+
+    bench_source = {
+        **source,
+        "name": f"bench_{source['name']}",
+        "path": str(path),
+        "incremental": False,
+        "parquet_cache": False,
+        "running_stats": False,
+    }
+    summary = run_source({"cfg": cfg, "source": bench_source})
+    return {
+        "runtime_seconds": round(summary["runtime_seconds"], 3),
+        "loaded_to_db": summary["loaded_to_db"],
+        "rejected_rows": summary["rejected_rows"],
+        "stages": summary["metrics"]["stages"],
+    }
+
+
+def run_benchmark(
+    sizes: list[int],
+    with_db: bool = False,
+    results_path=RESULTS_PATH,
+    seed: int = 0,
+    **rates,
+) -> list[dict]:
+    """Generate, time and record one result per size."""
+    cfg = load_sources_config()
+    source = cfg["sources"][0]
+    batch_size = int(cfg.get("defaults", {}).get("batch_size", 5000))
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_rows in sizes:
+            path = Path(tmp_dir) / f"fashion_sales_{n_rows}.csv"
+            gen_start = time.perf_counter()
+            write_synthetic_csv(path, n_rows, seed=seed, **rates)
+            gen_seconds = time.perf_counter() - gen_start
+
+            result = {
+                "commit": _git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "rows": n_rows,
+                "file_bytes": path.stat().st_size,
+                "batch_size": batch_size,
+                "rates": rates,
+                "generate_seconds": round(gen_seconds, 3),
+                "stages": benchmark_stages(path, source, batch_size),
+            }
+            if with_db:
+                result["full_run"] = benchmark_full_run(path, cfg, source)
+
+            results.append(result)
+            _append_result(result, results_path)
+            print(_format_result(result))
+
+    return results
+
+
+def _append_result(result: dict, results_path) -> None:
+    results_path = Path(results_path)
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(results_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result, default=str) + "\n")
+
+
+def _format_result(result: dict) -> str:
+    parts = [f"[{result['commit']}] {result['rows']:>11,} rows"]
+    for name, stage in result["stages"].items():
+        parts.append(f"{name} {stage['wall_seconds']:.2f}s")
+    if "full_run" in result:
+        parts.append(f"full run {result['full_run']['runtime_seconds']:.2f}s")
+    return " | ".join(parts)
+
+
+def compare_results(results_path=RESULTS_PATH) -> list[dict]:
+    """
+    For each size: latest result vs the latest result from a different commit.
+    Returns rows of {"rows", "stage", "baseline", "current", "ratio"} (ratio > 1 = slower).
+    """
+    results_path = Path(results_path)
+    if not results_path.exists():
+        return []
+    with open(results_path, "r", encoding="utf-8") as f:
+        results = [json.loads(line) for line in f if line.strip()]
+
+    comparisons = []
+    for n_rows in sorted({r["rows"] for r in results}):
+        runs = [r for r in results if r["rows"] == n_rows]
+        current = runs[-1]
+        baseline = next((r for r in reversed(runs[:-1]) if r.get("commit") != current.get("commit")), None)
+        if baseline is None:
+            continue
+        for stage, rec in current["stages"].items():
+            base = baseline["stages"].get(stage)
+            if not base or not base["wall_seconds"]:
+                continue
+            comparisons.append(
+                {
+                    "rows": n_rows,
+                    "stage": stage,
+                    "baseline": f"{baseline['commit']} {base['wall_seconds']:.3f}s",
+                    "current": f"{current['commit']} {rec['wall_seconds']:.3f}s",
+                    "ratio": round(rec["wall_seconds"] / base["wall_seconds"], 2),
+                }
+            )
+    return comparisons
+
+
+def _parse_size(text: str) -> int:
+    return PRESET_SIZES.get(text.lower()) or int(text.replace("_", ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fashion sales ingestion pipeline.")
+    parser.add_argument("--sizes", nargs="+", default=["10k"], help="10k, 1m, 10m, 50m or a row count")
+    parser.add_argument("--db", action="store_true", help="also time the full run_source() against DB_URL")
+    parser.add_argument("--bad-cast-rate", type=float, default=0.01)
+    parser.add_argument("--rule-violation-rate", type=float, default=0.01)
+    parser.add_argument("--duplicate-rate", type=float, default=0.01)
+    parser.add_argument("--null-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--results", default=str(RESULTS_PATH))
+    parser.add_argument("--compare", action="store_true", help="compare the latest results against the previous commit")
+    args = parser.parse_args()
+
+    if args.compare:
+        for row in compare_results(args.results):
+            print(f"{row['rows']:>11,} rows | {row['stage']:<12} | {row['baseline']} -> {row['current']} | x{row['ratio']}")
+        return
+
+    run_benchmark(
+        [_parse_size(s) for s in args.sizes],
+        with_db=args.db,
+        results_path=args.results,
+        seed=args.seed,
+        bad_cast_rate=args.bad_cast_rate,
+        rule_violation_rate=args.rule_violation_rate,
+        duplicate_rate=args.duplicate_rate,
+        null_rate=args.null_rate,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+cache.py
+
+Parquet cache of the cleaned (silver) rows, shared by the ETL and ml_analysis.
+
+Layout, one directory per target table:
+
+    cache/stg_fashion_sales/
+        _manifest.json                       partition -> status / rows / updated_at
+        purchase_month=2023-01/part-<seq>.parquet
+        purchase_month=2023-02/...
+
+- The load stage appends every cleaned batch it upserts (DB column names plus a
+  `_load_seq` column that grows with every write), split by purchase month
+- The same key can sit in several files; readers keep the row with the
+  highest _load_seq, i.e. the one the DB ended up with
+- A partition is marked "invalid" before its rows go to the DB (begin_batch)
+  and "valid" once both the DB write and the cache write succeeded
+  (commit_batch), so a crash in between leaves it invalid and readers
+  refresh just that month from the DB
+- compact_partitions() rewrites touched partitions as one deduplicated file
+  (run at the end of every source load) so file counts stay small
+- Readers get column projection and predicate pushdown (pyarrow filters,
+  e.g. [("purchase_month", ">=", "2023-06")] prunes whole directories)
+- Every manifest read-modify-write and every compaction / refresh holds an
+  exclusive flock on <cache_dir>/.lock, so parallel sources (max_workers > 1,
+  one process each) and writer threads cannot lose each other's updates
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): threads of one process are still serialized
+    fcntl = None
+
+import pandas as pd
+from sqlalchemy import text
+
+from src.logs.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_CACHE_ROOT = Path(__file__).parent.parent / "cache"
+
+PARTITION_COL = "purchase_month"
+DATE_COL = "date_purchase"
+SEQ_COL = "_load_seq"
+MANIFEST_NAME = "_manifest.json"
+LOCK_NAME = ".lock"
+
+_fallback_lock = threading.Lock()
+
+# Primary key of stg_fashion_sales (same as load_fashion_sales_upsert)
+PK_COLS = ["customer_reference_id", "item_purchased", "date_purchase"]
+
+
+def cache_dir_for(table_name: str, root=None) -> Path:
+    return Path(root or DEFAULT_CACHE_ROOT) / table_name
+
+
+def _partition_dir(cache_dir, month: str) -> Path:
+    return Path(cache_dir) / f"{PARTITION_COL}={month}"
+
+
+@contextmanager
+def _cache_lock(cache_dir):
+    """
+    Exclusive lock on one cache directory, across processes and threads
+    (each caller opens its own descriptor, so flock also excludes threads).
+    Not re-entrant: locked sections must not call each other.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    if fcntl is None:
+        with _fallback_lock:
+            yield
+        return
+    with open(cache_dir / LOCK_NAME, "a", encoding="utf-8") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_manifest(cache_dir) -> dict:
+    """The cache manifest, or an empty one if the cache was never written."""
+    path = Path(cache_dir) / MANIFEST_NAME
+    if not path.exists():
+        return {"partitions": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(cache_dir, manifest: dict) -> None:
+    """
+    Atomic write (temp file + rename), same as state.save_state. Callers
+    hold _cache_lock around their load_manifest / save_manifest pair.
+    """
+    path = Path(cache_dir) / MANIFEST_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def mark_partitions(cache_dir, months, status: str, rows_added: dict | None = None) -> None:
+    """
+    Set the status ("valid" / "invalid") of the given months in the manifest.
+    rows_added: optional {month: n} added to each month's row count.
+    """
+    months = sorted(set(months))
+    if not months:
+        return
+    with _cache_lock(cache_dir):
+        manifest = load_manifest(cache_dir)
+        _set_status(manifest, months, status, rows_added)
+        save_manifest(cache_dir, manifest)
+
+
+def _set_status(manifest: dict, months, status: str, rows_added: dict | None = None) -> None:
+    now = time.strftime("%Y-%m-%dT%H:%M:%S")
+    for month in months:
+        entry = manifest["partitions"].setdefault(month, {"rows": 0})
+        entry["status"] = status
+        entry["updated_at"] = now
+        entry["rows"] = entry.get("rows", 0) + int((rows_added or {}).get(month, 0))
+
+
+def partition_months(df: pd.DataFrame) -> pd.Series:
+    """"YYYY-MM" partition value of every row (from date_purchase)."""
+    return pd.to_datetime(df[DATE_COL]).dt.strftime("%Y-%m")
+
+
+def _to_arrow(df: pd.DataFrame):
+    """
+    DataFrame -> Arrow table with one file schema whatever the pandas dtypes
+    (categorical / string[pyarrow] / object strings all become plain string),
+    so ETL batches and DB refreshes can be read back as one dataset.
+    """
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    fields = []
+    for field in table.schema:
+        type_ = field.type
+        if pa.types.is_dictionary(type_):
+            type_ = type_.value_type
+        if pa.types.is_large_string(type_):
+            type_ = pa.string()
+        fields.append(pa.field(field.name, type_))
+    return table.cast(pa.schema(fields))
+
+
+def write_partitions(df: pd.DataFrame, cache_dir, load_seq: int | None = None) -> list[str]:
+    """
+    Append df (DB column names) to the cache, one file per month it touches.
+    Returns the months written. Does not touch the manifest.
+    """
+    import pyarrow.parquet as pq
+
+    if df.empty:
+        return []
+    load_seq = load_seq if load_seq is not None else time.time_ns()
+    # DB reads can hand back datetime.date objects; the ETL has timestamps
+    df = df.assign(**{SEQ_COL: load_seq, DATE_COL: pd.to_datetime(df[DATE_COL])})
+    months = partition_months(df)
+
+    written = []
+    for month, part in df.groupby(months.to_numpy(), sort=True):
+        part_dir = _partition_dir(cache_dir, month)
+        part_dir.mkdir(parents=True, exist_ok=True)
+        pq.write_table(_to_arrow(part), part_dir / f"part-{load_seq}.parquet")
+        written.append(month)
+    return written
+
+
+def begin_batch(df: pd.DataFrame, cache_dir) -> dict:
+    """
+    Call BEFORE writing a cleaned batch (DB column names) to the DB: marks its
+    months invalid. Returns {month: rows} to hand to commit_batch().
+    """
+    counts = partition_months(df).value_counts().to_dict() if not df.empty else {}
+    mark_partitions(cache_dir, counts, "invalid")
+    return counts
+
+
+def commit_batch(df: pd.DataFrame, cache_dir, counts: dict) -> None:
+    """Call AFTER the DB write succeeded: append the batch and mark its months valid."""
+    # One locked step, so a compaction never reads a file still being written
+    with _cache_lock(cache_dir):
+        write_partitions(df, cache_dir)
+        manifest = load_manifest(cache_dir)
+        _set_status(manifest, sorted(counts), "valid", rows_added=counts)
+        save_manifest(cache_dir, manifest)
+
+
+def _dedup_latest(df: pd.DataFrame) -> pd.DataFrame:
+    """Keep the row with the highest _load_seq per primary key."""
+    if df.empty or not set(PK_COLS) <= set(df.columns):
+        return df
+    df = df.sort_values(SEQ_COL, kind="stable")
+    return df[~df.duplicated(subset=PK_COLS, keep="last")]
+
+
+def read_cache(cache_dir, columns=None, filters=None) -> pd.DataFrame:
+    """
+    Read the cached rows with projection and pushdown.
+    - columns: DB columns to return (None = all)
+    - filters: pyarrow / DNF filters, e.g. [("purchase_month", "=", "2023-06")]
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    cache_dir = Path(cache_dir)
+    if not any(cache_dir.glob(f"{PARTITION_COL}=*/*.parquet")):
+        return pd.DataFrame(columns=columns)
+
+    read_cols = None
+    if columns is not None:
+        # key + sequence are needed to resolve duplicates, dropped again below
+        read_cols = list(dict.fromkeys([*columns, *PK_COLS, SEQ_COL]))
+    table = pq.read_table(
+        cache_dir,
+        columns=read_cols,
+        filters=filters,
+        partitioning=ds.partitioning(pa.schema([(PARTITION_COL, pa.string())]), flavor="hive"),
+    )
+    df = _dedup_latest(table.to_pandas())
+    # like SELECT *: only the table's columns (no sequence / partition column)
+    df = df.drop(columns=[SEQ_COL, PARTITION_COL]) if columns is None else df[list(columns)]
+    return df.reset_index(drop=True)
+
+
+def refresh_partitions(cache_dir, months, engine, table_name: str) -> int:
+    """
+    Rebuild the given months from the DB (one SELECT per month, only that
+    month's rows) and mark them valid. Returns the rows fetched.
+    """
+    fetched = 0
+    for month in sorted(set(months)):
+        start = pd.Timestamp(f"{month}-01")
+        end = start + pd.offsets.MonthBegin(1)
+        query = text(f'SELECT * FROM "{table_name}" WHERE {DATE_COL} >= :start AND {DATE_COL} < :end')
+        df = pd.read_sql(query, engine, params={"start": start.to_pydatetime(), "end": end.to_pydatetime()})
+
+        # The DB read above runs unlocked; swapping the files and the manifest entry does not
+        with _cache_lock(cache_dir):
+            shutil.rmtree(_partition_dir(cache_dir, month), ignore_errors=True)
+            write_partitions(df, cache_dir)
+
+            manifest = load_manifest(cache_dir)
+            manifest["partitions"].setdefault(month, {})["rows"] = 0
+            _set_status(manifest, [month], "valid", rows_added={month: len(df)})
+            save_manifest(cache_dir, manifest)
+        fetched += len(df)
+        logger.info(f"   Cache partition {month} refreshed from {table_name}: {len(df)} rows")
+    return fetched
+
+
+def bootstrap_cache(df: pd.DataFrame, cache_dir) -> None:
+    """
+    (Re)build the whole cache from a full table read. Until this has run once
+    the cache may miss rows loaded before it was enabled, so readers treat an
+    unseeded cache as unusable.
+    """
+    with _cache_lock(cache_dir):
+        for part_dir in Path(cache_dir).glob(f"{PARTITION_COL}=*"):
+            shutil.rmtree(part_dir)
+
+        write_partitions(df, cache_dir)
+        counts = partition_months(df).value_counts().to_dict() if not df.empty else {}
+        manifest = {"partitions": {}}
+        _set_status(manifest, counts, "valid", rows_added=counts)
+        manifest["seeded_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        save_manifest(cache_dir, manifest)
+
+
+def compact_partitions(cache_dir, months=None) -> None:
+    """
+    Rewrite each (valid) month as ONE deduplicated file.
+    months=None compacts every partition.
+    """
+    import pyarrow.parquet as pq
+
+    # Locked throughout: a manifest update from another writer in between would be overwritten
+    with _cache_lock(cache_dir):
+        manifest = load_manifest(cache_dir)
+        months = manifest["partitions"] if months is None else months
+        for month in sorted(set(months)):
+            if manifest["partitions"].get(month, {}).get("status") != "valid":
+                continue  # invalid months get rebuilt from the DB instead
+            part_dir = _partition_dir(cache_dir, month)
+            files = sorted(part_dir.glob("*.parquet"))
+            if len(files) <= 1:
+                continue
+
+            # partitioning=None: the month is in the directory name, not in the files
+            df = _dedup_latest(pq.read_table(files, partitioning=None).to_pandas())
+            seq = int(df[SEQ_COL].max())
+            tmp_path = part_dir / f".compact-{seq}.parquet"
+            pq.write_table(_to_arrow(df), tmp_path)
+            for path in files:
+                path.unlink()
+            os.replace(tmp_path, part_dir / f"part-{seq}.parquet")
+
+            manifest["partitions"][month]["rows"] = len(df)
+        save_manifest(cache_dir, manifest)
@@ -1,55 +1,114 @@
+import numpy as np
 import pandas as pd
 
+from src.dedup import KeyIndex, dedup_last_wins
+from src.validate import string_dtype_for
 
-def clean_fashion_sales(df: pd.DataFrame) -> pd.DataFrame:
+# Business key of a sale: the same customer-item-date only appears once per file
+BUSINESS_KEY = ["customer reference id", "item purchased", "date purchase"]
+
+# Payment method spellings we fold into the canonical values
+PAYMENT_METHOD_MAP = {
+    "Cash": "Cash",
+    "Credit Card": "Credit Card",
+    "Creditcard": "Credit Card",
+}
+
+
+def _normalize_categorical(series: pd.Series, normalize) -> pd.Series:
     """
-    Apply cleaning and standardization to the Fashion Retail dataset.
+    Apply a string normalization to the category dictionary only (once per
+    distinct value instead of once per row), then merge categories that
+    became equal (e.g. "cash" and "Cash ") by remapping the codes.
+    """
+    categories = pd.Series(series.cat.categories)
+    new_values = normalize(categories.astype(string_dtype_for(categories)))
 
-    - Strip whitespace from string-like columns
-    - Normalize payment method values
-    - Title-case item names
-    - Drop duplicate rows based on a business key so UPSERT is safe
+    new_categories = pd.Index(new_values.dropna().unique())
+    remap = np.append(new_categories.get_indexer(new_values), -1)  # -1 stays missing
+    codes = remap[series.cat.codes.to_numpy()]
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories=new_categories),
+        index=series.index,
+        name=series.name,
+    )
+
+
+def _normalize_strings(series: pd.Series, normalize) -> pd.Series:
+    """Run `normalize` on a string column (or on the dictionary of a categorical one)."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return _normalize_categorical(series, normalize)
+    return normalize(series.astype(string_dtype_for(series)))
+
+
+def _title_case(values: pd.Series) -> pd.Series:
+    return values.str.strip().str.title()
+
+
+def _payment_method(values: pd.Series) -> pd.Series:
+    # Optional strict mapping (unmapped values are kept as they are)
+    return values.str.strip().str.title().replace(PAYMENT_METHOD_MAP)
+
+
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
     """
-    df = df.copy()
+    Cleaning / standardization IN PLACE (no copy of the frame).
+    Every string column is stripped exactly once:
+    - payment method: strip + title-case + mapping
+    - item purchased: strip + title-case
+    - any other string-like column: strip
+    Categorical columns are normalized on their categories, not per row.
+    """
+    special_cols = {"payment method", "item purchased"}
 
     # Normalize column names we expect to exist after validation
     # (these should already be present thanks to your validation step)
-    str_cols = df.select_dtypes(include=["object", "string"]).columns
-    df[str_cols] = df[str_cols].apply(lambda col: col.astype("string").str.strip())
+    str_cols = [
+        c for c in df.select_dtypes(include=["object", "string"]).columns
+        if c not in special_cols
+    ]
+    for col in str_cols:
+        df[col] = df[col].astype(string_dtype_for(df[col])).str.strip()
 
     # Normalize payment method to a consistent set of values
     if "payment method" in df.columns:
-        df["payment method"] = (
-            df["payment method"]
-            .astype("string")
-            .str.strip()
-            .str.title()
-        )
-        # Optional strict mapping
-        mapping = {
-            "Cash": "Cash",
-            "Credit Card": "Credit Card",
-            "Creditcard": "Credit Card",
-        }
-        df["payment method"] = df["payment method"].map(mapping).fillna(df["payment method"])
+        df["payment method"] = _normalize_strings(df["payment method"], _payment_method)
 
     # Normalize item purchased for cleaner analytics (e.g., "Jeans", "Handbag")
     if "item purchased" in df.columns:
-        df["item purchased"] = (
-            df["item purchased"]
-            .astype("string")
-            .str.strip()
-            .str.title()
-        )
-
-    # Deduplicate by a "business key" so the same customer-item-date
-    # only appears once per batch (last one wins)
-    key_cols = ["customer reference id", "item purchased", "date purchase"]
-    existing_key_cols = [c for c in key_cols if c in df.columns]
-    if len(existing_key_cols) == len(key_cols):
-        df = df.drop_duplicates(subset=key_cols, keep="last")
+        df["item purchased"] = _normalize_strings(df["item purchased"], _title_case)
+
+    return df
+
+
+def drop_duplicate_sales(df: pd.DataFrame, key_index: KeyIndex | None = None) -> pd.DataFrame:
+    """
+    Deduplicate by a "business key" so the same customer-item-date
+    only appears once (last one wins), using 64-bit key fingerprints.
+    - key_index: optional KeyIndex shared by all chunks of a file, so the
+      last row wins across chunks too (see dedup.py)
+    Returns df itself when there is nothing to drop.
+    """
+    existing_key_cols = [c for c in BUSINESS_KEY if c in df.columns]
+    if len(existing_key_cols) == len(BUSINESS_KEY):
+        key_cols = BUSINESS_KEY
     else:
         # Fallback: drop perfect duplicates if key columns aren't all present
-        df = df.drop_duplicates(keep="last")
+        key_cols = list(df.columns)
 
-    return df
+    # Most batches have no duplicates: dedup_last_wins hands back the same frame, no copy
+    return dedup_last_wins(df, key_cols, key_index)
+
+
+def clean_fashion_sales(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Apply cleaning and standardization to the Fashion Retail dataset.
+
+    - Strip whitespace from string-like columns
+    - Normalize payment method values
+    - Title-case item names
+    - Drop duplicate rows based on a business key so UPSERT is safe
+    """
+    df = df.copy()
+    normalize_columns(df)
+    return drop_duplicate_sales(df)
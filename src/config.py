@@ -20,4 +20,15 @@ def get_db_url():
     db_url = os.getenv("DB_URL")
     if not db_url:
         raise ValueError("DB_URL not set. Please create a .env file.")
-    return db_url
\ No newline at end of file
+    return db_url
+
+def get_source_option(cfg: dict, source: dict, key: str, default=None):
+    """
+    Look up an option for a source:
+      1. the source entry itself (per-source override)
+      2. the `defaults:` block of sources.yml
+      3. the given fallback default
+    """
+    if key in source:
+        return source[key]
+    return (cfg.get("defaults") or {}).get(key, default)
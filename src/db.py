@@ -0,0 +1,86 @@
+"""
+db.py
+
+Process-wide database access for the ETL and ML modules.
+
+- One SQLAlchemy engine (and connection pool) per DB URL, created lazily
+  and shared by every caller in the process
+- Pool settings come from `defaults.db_pool` in sources.yml
+- Reflected Table objects are cached so we only hit the catalog once per table
+"""
+
+import threading
+
+from sqlalchemy import create_engine, MetaData, Table
+
+from src.config import get_db_url, load_sources_config
+
+# Used when sources.yml has no `defaults.db_pool` block (or leaves a key out)
+DEFAULT_POOL_OPTIONS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_pre_ping": True,   # test connections before use (drops stale ones)
+    "pool_recycle": 1800,    # seconds before a connection is replaced
+}
+
+_engines = {}   # db_url -> Engine
+_tables = {}    # (db_url, table_name) -> reflected Table
+_metadata = {}  # db_url -> MetaData shared by all reflected tables
+_lock = threading.Lock()
+
+
+def get_pool_options() -> dict:
+    """Pool settings: DEFAULT_POOL_OPTIONS overridden by sources.yml defaults.db_pool."""
+    options = dict(DEFAULT_POOL_OPTIONS)
+    cfg = load_sources_config() or {}
+    options.update((cfg.get("defaults") or {}).get("db_pool") or {})
+    return options
+
+
+def get_engine(db_url: str | None = None):
+    """
+    Return the shared engine for db_url (DB_URL from .env by default).
+    The first call creates it; later calls reuse the same pool.
+    """
+    db_url = db_url or get_db_url()
+
+    with _lock:
+        engine = _engines.get(db_url)
+        if engine is None:
+            engine = create_engine(db_url, **get_pool_options())
+            _engines[db_url] = engine
+        return engine
+
+
+def get_table(table_name: str, db_url: str | None = None) -> Table:
+    """Reflect table_name once per process and return the cached Table."""
+    db_url = db_url or get_db_url()
+    key = (db_url, table_name)
+
+    table = _tables.get(key)
+    if table is not None:
+        return table
+
+    engine = get_engine(db_url)
+    with _lock:
+        table = _tables.get(key)
+        if table is None:
+            metadata = _metadata.setdefault(db_url, MetaData())
+            table = Table(table_name, metadata, autoload_with=engine)
+            _tables[key] = table
+        return table
+
+
+def dispose_engines(close: bool = True) -> None:
+    """
+    Drop every cached engine and reflected table.
+    - close=True: close pooled connections (end of run / tests)
+    - close=False: only forget them, for use right after a fork so the child
+      never reuses the parent's sockets
+    """
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose(close=close)
+        _engines.clear()
+        _tables.clear()
+        _metadata.clear()
@@ -0,0 +1,152 @@
+"""
+dedup.py
+
+Business-key dedup that holds across a whole streamed file.
+
+- The composite key (customer reference id, item purchased, date purchase) is
+  hashed into one 64-bit fingerprint per row (pd.util.hash_pandas_object), so
+  dedup never compares or stores the key strings themselves
+- Inside a chunk the last row of each key wins
+- Across chunks a KeyIndex remembers, per fingerprint, the sequence number
+  (file row position = the chunk index) of the row that was loaded. A row only
+  wins if it comes later in the file than what is already loaded, so "last
+  wins" holds for the whole file whatever order chunks arrive in
+- The KeyIndex keeps up to max_memory_keys fingerprints in a dict and spills
+  the rest to a temporary SQLite file, so memory stays bounded on huge files
+
+Two different keys sharing a 64-bit hash is possible but very unlikely
+(~1e-4 chance over 50M distinct keys).
+"""
+
+import os
+import sqlite3
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from src.logs.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_MAX_MEMORY_KEYS = 1_000_000
+
+# Keys per "WHERE fp IN (...)" lookup against the spill file
+SQLITE_LOOKUP_BATCH = 900
+
+
+def key_fingerprints(df: pd.DataFrame, key_cols: list[str]) -> np.ndarray:
+    """One uint64 fingerprint per row of df[key_cols] (index not included)."""
+    return pd.util.hash_pandas_object(df[key_cols], index=False).to_numpy()
+
+
+def last_in_chunk(fingerprints: np.ndarray) -> np.ndarray:
+    """Bool mask: True for the last row of every fingerprint in this chunk."""
+    return ~pd.Index(fingerprints).duplicated(keep="last")
+
+
+class KeyIndex:
+    """
+    fingerprint -> sequence number of the row that won so far.
+    Lives for one source run; close() removes the spill file.
+    """
+
+    def __init__(self, max_memory_keys: int = DEFAULT_MAX_MEMORY_KEYS, spill_dir=None):
+        self.max_memory_keys = max_memory_keys
+        self.spill_dir = spill_dir
+        self.superseded = 0   # rows loaded earlier and then replaced by a later row
+        self.stale = 0        # rows dropped because a later row was already loaded
+        self._memory = {}
+        self._db = None
+        self._db_path = None
+
+    def __len__(self) -> int:
+        spilled = self._db.execute("SELECT COUNT(*) FROM keys").fetchone()[0] if self._db else 0
+        return len(self._memory) + spilled
+
+    def observe(self, fingerprints: np.ndarray, seqs: np.ndarray) -> np.ndarray:
+        """
+        Check one chunk's (already chunk-deduplicated) keys against the index.
+        Returns a keep mask and records the kept rows as the new winners.
+        """
+        fps = np.asarray(fingerprints).view(np.int64)  # SQLite stores signed 64-bit
+        seqs = np.asarray(seqs, dtype=np.int64)
+        previous = self._lookup(fps)
+
+        keep = seqs > previous
+        self.superseded += int((keep & (previous >= 0)).sum())
+        self.stale += int((~keep).sum())
+
+        self._memory.update(zip(fps[keep].tolist(), seqs[keep].tolist()))
+        if len(self._memory) > self.max_memory_keys:
+            self._spill()
+        return keep
+
+    def _lookup(self, fps: np.ndarray) -> np.ndarray:
+        """Winning seq per fingerprint, -1 where the key was never seen."""
+        memory = self._memory
+        found = np.fromiter((memory.get(fp, -1) for fp in fps.tolist()), dtype=np.int64, count=len(fps))
+        if self._db is None:
+            return found
+
+        # Memory always holds the newest winner, so only go to disk for the misses
+        missing = np.flatnonzero(found < 0)
+        on_disk = {}
+        for start in range(0, len(missing), SQLITE_LOOKUP_BATCH):
+            batch = fps[missing[start:start + SQLITE_LOOKUP_BATCH]].tolist()
+            placeholders = ",".join("?" * len(batch))
+            on_disk.update(self._db.execute(f"SELECT fp, seq FROM keys WHERE fp IN ({placeholders})", batch))
+        if on_disk:
+            found[missing] = [on_disk.get(fp, -1) for fp in fps[missing].tolist()]
+        return found
+
+    def _spill(self) -> None:
+        """Move the in-memory keys into the SQLite spill file and empty the dict."""
+        if self._db is None:
+            fd, self._db_path = tempfile.mkstemp(prefix="dedup_keys_", suffix=".sqlite", dir=self.spill_dir)
+            os.close(fd)
+            self._db = sqlite3.connect(self._db_path)
+            self._db.execute("PRAGMA journal_mode=OFF")
+            self._db.execute("PRAGMA synchronous=OFF")
+            self._db.execute("CREATE TABLE keys (fp INTEGER PRIMARY KEY, seq INTEGER NOT NULL)")
+            logger.debug(f"   Dedup key index spilling to {self._db_path}")
+
+        self._db.executemany(
+            "INSERT INTO keys (fp, seq) VALUES (?, ?) "
+            "ON CONFLICT(fp) DO UPDATE SET seq = MAX(seq, excluded.seq)",
+            self._memory.items(),
+        )
+        self._db.commit()
+        self._memory.clear()
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            os.remove(self._db_path)
+            self._db = None
+        self._memory.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def dedup_last_wins(df: pd.DataFrame, key_cols: list[str], key_index: KeyIndex | None = None) -> pd.DataFrame:
+    """
+    Keep the last row of every key in df and, with a key_index, drop rows
+    that an already-loaded later row beats. Returns df itself when nothing is dropped.
+    """
+    if df.empty:
+        return df
+    fps = key_fingerprints(df, key_cols)
+    keep = last_in_chunk(fps)
+    if key_index is not None:
+        seqs = np.asarray(df.index, dtype=np.int64)
+        kept = np.flatnonzero(keep)
+        keep[kept] = key_index.observe(fps[kept], seqs[kept])
+
+    if keep.all():
+        return df
+    return df[keep]
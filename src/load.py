@@ -1,10 +1,15 @@
+import gzip
+import io
 import json
+import time
+from pathlib import Path
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine, MetaData, Table
 from sqlalchemy.dialects.postgresql import insert
 from datetime import datetime
-from sqlalchemy import text
-from src.config import get_db_url
+from sqlalchemy import literal_column, or_, text
+from src.running_stats import apply_batch as running_stats_apply
+from src.db import get_engine, get_table
 from src.logs.logging_config import *
 
 logger = get_logger(__name__)
@@ -20,110 +25,462 @@ FASHION_COL_RENAME = {
 }
 
 
-def get_engine():
-    db_url = get_db_url()
-    return create_engine(db_url)
+# Rows per INSERT batch when the source config does not set batch_size
+DEFAULT_BATCH_SIZE = 5000
 
+# How rows get into the target table (sources.yml `load_strategy`)
+#   insert: batched INSERT ... ON CONFLICT (executemany)
+#   copy:   COPY into a temp staging table, then one INSERT ... SELECT merge
+LOAD_STRATEGIES = ("insert", "copy")
 
-def load_rejects(reject_df: pd.DataFrame, source_name: str, reason: str) -> None:
+# NULL marker used in the CSV stream we COPY into PostgreSQL
+COPY_NULL = r"\N"
+
+# What ON CONFLICT does with an existing row (sources.yml `upsert_mode`)
+#   full:  always rewrite every non-key column
+#   delta: only rewrite when some value actually changed (no dead tuples / WAL for no-op updates)
+UPSERT_MODES = ("full", "delta")
+
+# Optional BIGINT column holding a hash of the non-key values of each row.
+# Only written when the target table has it (e.g.
+#   ALTER TABLE stg_fashion_sales ADD COLUMN row_hash BIGINT;)
+# and then delta mode compares this one column instead of every value.
+ROW_HASH_COL = "row_hash"
+
+# RETURNING expression telling a fresh insert (true) from an update (false)
+INSERTED_FLAG = "(xmax = 0)"
+
+
+def row_content_hash(df: pd.DataFrame, cols: list[str]) -> np.ndarray:
     """
-    Store rejected rows in a stg_rejects table with:
-      - source_name
-      - reason
-      - payload (JSON)
-      - rejected_at timestamp
+    Signed 64-bit hash of df[cols] per row (fits a BIGINT column).
+    Stable across runs as long as the columns keep their dtypes.
     """
-    if reject_df.empty:
-        logger.info("   No rejected rows to log.")
-        return
+    return pd.util.hash_pandas_object(df[cols], index=False).to_numpy().view(np.int64)
+
+
+def _write_counts(inserted_flags: list, n_sent: int) -> dict:
+    """inserted / updated / unchanged from the RETURNING (xmax = 0) flags of n_sent rows."""
+    inserted = sum(1 for flag in inserted_flags if flag)
+    return {
+        "inserted": inserted,
+        "updated": len(inserted_flags) - inserted,
+        "unchanged": n_sent - len(inserted_flags),
+    }
+
+
+def _prepare_upsert_frame(df, table, pk_cols, row_hash):
+    """
+    Columns of df that exist in the table, plus the row_hash column when
+    asked for and present. Returns (frame, compare_cols_for_delta).
+    """
+    table_cols = [c.name for c in table.columns]
+    used_cols = [c for c in df.columns if c in table_cols and c != ROW_HASH_COL]
+    if not used_cols:
+        raise ValueError(f"No overlapping columns between DataFrame and table {table.name}")
+
+    trimmed_df = df[used_cols]
+    compare_cols = [c for c in used_cols if c not in pk_cols]
+    if row_hash:
+        if ROW_HASH_COL in table_cols and compare_cols:
+            trimmed_df = trimmed_df.assign(**{ROW_HASH_COL: row_content_hash(trimmed_df, compare_cols)})
+            compare_cols = [ROW_HASH_COL]
+        else:
+            logger.warning(f"   row_hash requested but {table.name} has no {ROW_HASH_COL} column; comparing values")
+    return trimmed_df, compare_cols
 
-    engine = get_engine()
 
-    # Turn each row into a JSON string (timestamps / etc. handled with default=str)
-    payloads = [
-        json.dumps(row, default=str) for row in reject_df.to_dict(orient="records")
-    ]
+def _to_records(df: pd.DataFrame) -> list[dict]:
+    """DataFrame -> list of row dicts with NaN/NaT/pd.NA replaced by None (SQL NULL)."""
+    return df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+
+def serialize_reject_payloads(df: pd.DataFrame) -> pd.Series:
+    """
+    One JSON object per row, built column-wise by pandas' JSON encoder
+    (no per-cell Python loop):
+      - timestamps -> ISO strings
+      - NaN / NaT / NA -> null
+    Returns a string Series aligned with df's rows.
+    """
+    if df.empty:
+        return pd.Series([], dtype=object)
+    lines = df.to_json(orient="records", lines=True, date_format="iso", default_handler=str)
+    return pd.Series(lines.rstrip("\n").split("\n"), dtype=object)
 
-    log_df = pd.DataFrame(
+
+def spill_rejects(rejects_df: pd.DataFrame, spill_dir, source_name: str) -> Path:
+    """
+    Append rejects to a local gzip-compressed JSONL file:
+      <spill_dir>/<source_name>_rejects_<YYYYMMDD>.jsonl.gz
+    Each line is {"source_name", "reason", "rejected_at", "raw_payload"}.
+    """
+    spill_path = Path(spill_dir) / f"{source_name}_rejects_{datetime.utcnow():%Y%m%d}.jsonl.gz"
+    spill_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Payloads are already JSON: splice them in as text instead of re-encoding
+    prefix = (
+        '{"source_name": ' + rejects_df["source_name"].map(json.dumps)
+        + ', "reason": ' + rejects_df["reason"].map(json.dumps)
+        + f', "rejected_at": "{datetime.utcnow().isoformat()}", "raw_payload": '
+    )
+    lines = prefix + rejects_df["raw_payload"] + "}\n"
+
+    # Append mode on a .gz adds a new gzip member; readers see one continuous stream
+    with gzip.open(spill_path, "at", encoding="utf-8") as f:
+        f.write("".join(lines))
+    return spill_path
+
+
+def _copy_rejects(rejects_df: pd.DataFrame, batch_size: int) -> None:
+    """Stream rejects into stg_rejects with COPY FROM STDIN."""
+    cols = list(rejects_df.columns)
+    copy_sql = (
+        f"COPY stg_rejects ({', '.join(_quote_ident(c) for c in cols)}) "
+        f"FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+    )
+    raw_conn = get_engine().raw_connection()
+    try:
+        cursor = raw_conn.cursor()
+        for start in range(0, len(rejects_df), batch_size):
+            cursor.copy_expert(copy_sql, _copy_buffer(rejects_df.iloc[start:start + batch_size]))
+        raw_conn.commit()
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+
+
+def load_rejects(
+    df: pd.DataFrame,
+    source_name: str,
+    reason: str,
+    strategy: str = "insert",
+    sink: str = "db",
+    spill_dir=None,
+    batch_size: int = 1000,
+) -> None:
+    """
+    Load rejected rows into stg_rejects (source_name, raw_payload, reason).
+
+    - payloads are serialized in bulk (serialize_reject_payloads)
+    - strategy "insert": batched multi-row INSERTs, "copy": COPY FROM STDIN
+    - sink "db" (default), "file" (only the local spill file) or "both"
+    - spill_dir: where spill files go; if the DB write fails and spill_dir
+      is set, the rejects are spilled there instead of failing the run
+    """
+    if df.empty:
+        return
+
+    rejects_df = pd.DataFrame(
         {
             "source_name": source_name,
+            "raw_payload": serialize_reject_payloads(df),
             "reason": reason,
-            "payload": payloads,
-            "rejected_at": datetime.utcnow(),
         }
     )
 
-    log_df.to_sql(
-        name="stg_rejects",
-        con=engine,
-        if_exists="append",
-        index=False,
-        method="multi",
-    )
+    if sink in ("file", "both"):
+        if not spill_dir:
+            raise ValueError(f"reject sink {sink!r} needs a spill_dir")
+        path = spill_rejects(rejects_df, spill_dir, source_name)
+        logger.debug(f"   Spilled {len(rejects_df)} rejected rows to {path} ({reason})")
+        if sink == "file":
+            return
+
+    start = time.perf_counter()
+    try:
+        if strategy == "copy":
+            _copy_rejects(rejects_df, batch_size)
+        else:
+            rejects_df.to_sql(
+                name="stg_rejects",
+                con=get_engine(),
+                if_exists="append",
+                index=False,
+                method="multi",
+                chunksize=batch_size,
+            )
+    except Exception as exc:
+        if not spill_dir or sink == "both":
+            raise
+        # DB unavailable / timing out: keep the rejects locally and carry on
+        path = spill_rejects(rejects_df, spill_dir, source_name)
+        logger.warning(f"   stg_rejects write failed ({exc!r}); spilled {len(rejects_df)} rows to {path}")
+        return
 
-    logger.info(f"   Logged {len(log_df)} rejected rows to stg_rejects ({reason}).")
+    logger.debug(
+        f"   Logged {len(rejects_df)} rejected rows to stg_rejects ({reason}) "
+        f"in {time.perf_counter() - start:.3f}s"
+    )
 
 
-def upsert_dataframe(df: pd.DataFrame, table_name: str, pk_cols: list[str]) -> None:
+def upsert_dataframe(
+    df: pd.DataFrame,
+    table_name: str,
+    pk_cols: list[str],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    mode: str = "full",
+    row_hash: bool = False,
+    running_stats: bool = False,
+) -> dict:
     """
     Generic batch UPSERT into PostgreSQL using ON CONFLICT DO UPDATE.
 
+    - Rows are sent in batches of `batch_size` with executemany-style
+      parameter binding (one compiled statement, many parameter sets),
+      so we never build one giant VALUES list or hit the bind-parameter limit
+    - All batches run inside ONE transaction (all or nothing)
+    - mode "delta": the DO UPDATE only fires when a value IS DISTINCT FROM the
+      stored one, so unchanged rows are not rewritten
+    - row_hash: also write the row_hash column (if the table has it) and
+      compare just that in delta mode
+    - running_stats: fold the rows into <table_name>_stats in the same
+      transaction, before they are written (see running_stats.py)
+    - Returns {"rows": n, "batch_seconds": [...], "inserted", "updated", "unchanged"}
+      (counts come from RETURNING (xmax = 0))
+
     Assumes:
       - df columns already match DB column names
       - The DB table has a PRIMARY KEY or UNIQUE constraint on pk_cols
       - df has already been cleaned / deduplicated on pk_cols in the transform step
     """
+    if mode not in UPSERT_MODES:
+        raise ValueError(f"Unknown upsert mode {mode!r}; expected one of {UPSERT_MODES}")
+
+    result = {"rows": 0, "batch_seconds": [], "inserted": 0, "updated": 0, "unchanged": 0}
     if df.empty:
         logger.debug(f"   No rows to upsert into {table_name}.")
-        return
+        return result
 
     engine = get_engine()
-
-    metadata = MetaData()
-    table = Table(table_name, metadata, autoload_with=engine)
+    table = get_table(table_name)
 
     # Only keep columns that actually exist in the DB table
-    table_cols = [c.name for c in table.columns]
-    used_cols = [c for c in df.columns if c in table_cols]
-    if not used_cols:
-        raise ValueError(f"No overlapping columns between DataFrame and table {table_name}")
-
-    trimmed_df = df[used_cols].copy()
-    rows = trimmed_df.to_dict(orient="records")
+    trimmed_df, compare_cols = _prepare_upsert_frame(df, table, pk_cols, row_hash)
+    batch_size = max(int(batch_size or DEFAULT_BATCH_SIZE), 1)
 
-    stmt = insert(table).values(rows)
+    stmt = insert(table)
 
-    # Update all non-PK columns on conflict
+    # Update all non-PK columns on conflict (EXCLUDED = the row we tried to insert)
     update_cols = {
-        c.name: c
-        for c in table.columns
-        if c.name in used_cols and c.name not in pk_cols
+        c: stmt.excluded[c]
+        for c in trimmed_df.columns
+        if c not in pk_cols
     }
-
-    stmt = stmt.on_conflict_do_update(
-        index_elements=pk_cols,
-        set_=update_cols,
-    )
+    if update_cols:
+        where = None
+        if mode == "delta":
+            # Skip the update (no new tuple version) when nothing differs; NULL-safe
+            where = or_(*(table.c[c].is_distinct_from(stmt.excluded[c]) for c in compare_cols))
+        stmt = stmt.on_conflict_do_update(index_elements=pk_cols, set_=update_cols, where=where)
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=pk_cols)
+    stmt = stmt.returning(literal_column(INSERTED_FLAG).label("inserted"))
 
     #This context opens a transaction and COMMITs when the block exits
     with engine.begin() as conn:
-        conn.execute(stmt)
+        if running_stats:
+            running_stats_apply(conn.connection.cursor(), table_name, trimmed_df, page_size=batch_size)
+
+        for start in range(0, len(trimmed_df), batch_size):
+            batch = trimmed_df.iloc[start:start + batch_size]
+
+            batch_start = time.perf_counter()
+            inserted_flags = conn.execute(stmt, _to_records(batch)).scalars().all()
+            elapsed = time.perf_counter() - batch_start
+
+            for key, n in _write_counts(inserted_flags, len(batch)).items():
+                result[key] += n
+
+            result["batch_seconds"].append(elapsed)
+            logger.debug(
+                f"   Batch {len(result['batch_seconds'])}: {len(batch)} rows "
+                f"into {table_name} in {elapsed:.3f}s"
+            )
+
+    result["rows"] = len(trimmed_df)
+    logger.debug(
+        f"   UPSERTED {len(trimmed_df)} rows into {table_name} "
+        f"in {len(result['batch_seconds'])} batches ({sum(result['batch_seconds']):.3f}s): "
+        f"{result['inserted']} inserted, {result['updated']} updated, {result['unchanged']} unchanged."
+    )
+    return result
+
+
+def _quote_ident(name: str) -> str:
+    """Double-quote a SQL identifier (our CSV-style names can contain anything)."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def build_merge_sql(
+    staging_table: str,
+    target_table: str,
+    cols: list[str],
+    pk_cols: list[str],
+    compare_cols: list[str] | None = None,
+) -> str:
+    """
+    Build the single INSERT ... SELECT ... ON CONFLICT DO UPDATE statement
+    that merges the staging table into the target on the composite key.
+    - compare_cols: delta mode; only update rows where these columns differ
+    Every merged row returns (xmax = 0): true = inserted, false = updated.
+    """
+    col_list = ", ".join(_quote_ident(c) for c in cols)
+    pk_list = ", ".join(_quote_ident(c) for c in pk_cols)
+    update_cols = [c for c in cols if c not in pk_cols]
+
+    if update_cols:
+        set_list = ", ".join(f"{_quote_ident(c)} = EXCLUDED.{_quote_ident(c)}" for c in update_cols)
+        conflict = f"ON CONFLICT ({pk_list}) DO UPDATE SET {set_list}"
+        if compare_cols:
+            target = _quote_ident(target_table)
+            current = ", ".join(f"{target}.{_quote_ident(c)}" for c in compare_cols)
+            incoming = ", ".join(f"EXCLUDED.{_quote_ident(c)}" for c in compare_cols)
+            conflict += f" WHERE ({current}) IS DISTINCT FROM ({incoming})"
+    else:
+        conflict = f"ON CONFLICT ({pk_list}) DO NOTHING"
+
+    return (
+        f"INSERT INTO {_quote_ident(target_table)} ({col_list}) "
+        f"SELECT {col_list} FROM {_quote_ident(staging_table)} "
+        f"{conflict} RETURNING {INSERTED_FLAG}"
+    )
 
-    logger.debug(f"   UPSERTED {len(trimmed_df)} rows into {table_name}.")
 
+def _copy_buffer(df: pd.DataFrame) -> io.StringIO:
+    """Render a batch as CSV text for COPY FROM STDIN (no header, \\N for NULL)."""
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False, na_rep=COPY_NULL, date_format="%Y-%m-%d %H:%M:%S")
+    buf.seek(0)
+    return buf
 
 
-def load_fashion_sales_upsert(df: pd.DataFrame, table_name: str) -> None:
+def copy_upsert_dataframe(
+    df: pd.DataFrame,
+    table_name: str,
+    pk_cols: list[str],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    mode: str = "full",
+    row_hash: bool = False,
+    running_stats: bool = False,
+) -> dict:
+    """
+    Bulk UPSERT into PostgreSQL using COPY + a staging-table merge.
+
+    - Creates a TEMP staging table shaped like the target (dropped on commit)
+    - Streams the rows into it with COPY FROM STDIN, `batch_size` rows per COPY
+    - Merges everything into the target with ONE
+      INSERT ... SELECT ... ON CONFLICT (pk_cols) DO UPDATE
+    - mode / row_hash / running_stats work as in upsert_dataframe (delta = skip unchanged rows)
+    - Runs in a single transaction and returns the same
+      {"rows", "batch_seconds", "inserted", "updated", "unchanged"} shape as upsert_dataframe
+
+    Rows are deduplicated on pk_cols (last one wins) before staging because
+    ON CONFLICT cannot touch the same target row twice in one statement.
+    """
+    if mode not in UPSERT_MODES:
+        raise ValueError(f"Unknown upsert mode {mode!r}; expected one of {UPSERT_MODES}")
+
+    result = {"rows": 0, "batch_seconds": [], "inserted": 0, "updated": 0, "unchanged": 0}
+    if df.empty:
+        logger.debug(f"   No rows to copy into {table_name}.")
+        return result
+
+    engine = get_engine()
+    table = get_table(table_name)
+
+    # Only keep columns that actually exist in the DB table
+    trimmed_df, compare_cols = _prepare_upsert_frame(
+        df.drop_duplicates(subset=pk_cols, keep="last"), table, pk_cols, row_hash
+    )
+    used_cols = list(trimmed_df.columns)
+    batch_size = max(int(batch_size or DEFAULT_BATCH_SIZE), 1)
+
+    staging_table = f"tmp_{table_name}_stage"
+    col_list = ", ".join(_quote_ident(c) for c in used_cols)
+    create_sql = (
+        f"CREATE TEMP TABLE {_quote_ident(staging_table)} "
+        f"(LIKE {_quote_ident(table_name)} INCLUDING DEFAULTS) ON COMMIT DROP"
+    )
+    copy_sql = (
+        f"COPY {_quote_ident(staging_table)} ({col_list}) "
+        f"FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+    )
+    merge_sql = build_merge_sql(
+        staging_table, table_name, used_cols, pk_cols,
+        compare_cols=compare_cols if mode == "delta" else None,
+    )
+
+    # COPY is a driver-level feature, so we work on the raw DBAPI connection
+    raw_conn = engine.raw_connection()
+    try:
+        cursor = raw_conn.cursor()
+        cursor.execute(create_sql)
+
+        for start in range(0, len(trimmed_df), batch_size):
+            batch = trimmed_df.iloc[start:start + batch_size]
+
+            batch_start = time.perf_counter()
+            cursor.copy_expert(copy_sql, _copy_buffer(batch))
+            elapsed = time.perf_counter() - batch_start
+
+            result["batch_seconds"].append(elapsed)
+            logger.debug(
+                f"   COPY batch {len(result['batch_seconds'])}: {len(batch)} rows "
+                f"into {staging_table} in {elapsed:.3f}s"
+            )
+
+        if running_stats:
+            # Stored versions are still there: the merge has not run yet
+            running_stats_apply(cursor, table_name, trimmed_df, staging_table=staging_table, page_size=batch_size)
+
+        merge_start = time.perf_counter()
+        cursor.execute(merge_sql)
+        inserted_flags = [row[0] for row in cursor.fetchall()]
+        raw_conn.commit()
+        merge_elapsed = time.perf_counter() - merge_start
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+
+    result["rows"] = len(trimmed_df)
+    result.update(_write_counts(inserted_flags, len(trimmed_df)))
+    logger.debug(
+        f"   COPY-UPSERTED {len(trimmed_df)} rows into {table_name} "
+        f"(copy {sum(result['batch_seconds']):.3f}s, merge {merge_elapsed:.3f}s): "
+        f"{result['inserted']} inserted, {result['updated']} updated, {result['unchanged']} unchanged."
+    )
+    return result
+
+
+def load_fashion_sales_upsert(
+    df: pd.DataFrame,
+    table_name: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    strategy: str = "insert",
+    **upsert_options,
+) -> dict | None:
     """
     Loader for the Fashion Retail dataset.
 
     - Renames from CSV-style column names to DB column names
     - Performs batch UPSERT into the given table using a composite key:
       (customer_reference_id, item_purchased, date_purchase)
+    - Sends rows in batches of `batch_size`
+    - strategy "insert" = batched INSERT ... ON CONFLICT,
+      strategy "copy" = COPY into a staging table + one merge statement
+    - upsert_options (mode, row_hash, running_stats) are passed on to the chosen loader
     """
+    if strategy not in LOAD_STRATEGIES:
+        raise ValueError(f"Unknown load strategy {strategy!r}; expected one of {LOAD_STRATEGIES}")
+
     if df.empty:
         logger.debug("   No rows to load (fashion sales).")
-        return
+        return None
 
     # Rename columns to match DB schema
     db_df = df.rename(columns=FASHION_COL_RENAME)
@@ -131,54 +488,6 @@ def load_fashion_sales_upsert(df: pd.DataFrame, table_name: str) -> None:
     # Composite business key for a "sale" (must match DB PRIMARY KEY definition)
     pk_cols = ["customer_reference_id", "item_purchased", "date_purchase"]
 
-    upsert_dataframe(db_df, table_name, pk_cols)
-
-
-def load_rejects(df: pd.DataFrame, source_name: str, reason: str):
-    """
-    Load rejected rows into stg_rejects.
-    Converts row values into Python-native types so JSON serialization works.
-    """
-    if df.empty:
-        return
-
-    records = []
-    for rec in df.to_dict(orient="records"):
-
-        # Convert each value in the row
-        clean_rec = {}
-        for key, val in rec.items():
-            if isinstance(val, pd.Timestamp):
-                clean_rec[key] = val.isoformat()   # convert datetime -> string
-            elif pd.isna(val):
-                clean_rec[key] = None              # NaNs are not JSON
-            else:
-                clean_rec[key] = val
-
-        records.append(
-            {
-                "source_name": source_name,
-                "raw_payload": json.dumps(clean_rec),
-                "reason": reason,
-            }
-        )
-
-    rejects_df = pd.DataFrame(records)
-
-    db_url = get_db_url()
-    engine = create_engine(db_url)
-
-    rejects_df.to_sql(
-        name="stg_rejects",
-        con=engine,
-        if_exists="append",
-        index=False,
-        method="multi",
-        chunksize=1000,
-    )
-
-    logger.debug(f"   Logged {len(rejects_df)} rejected rows to stg_rejects ({reason})")
-    
-
-
-
+    if strategy == "copy":
+        return copy_upsert_dataframe(db_df, table_name, pk_cols, batch_size=batch_size, **upsert_options)
+    return upsert_dataframe(db_df, table_name, pk_cols, batch_size=batch_size, **upsert_options)
@@ -3,78 +3,457 @@ from src.reader import *
 from src.validate import *
 from src.load import *
 from src.clean import *
+from src.pipeline import transform_chunk
 from src.logs.logging_config import *
+from src.scheduler import run_parallel, combine_summaries
+from src.state import load_state, save_state, plan_ingest
+from src.metrics import RunMetrics, emit_run_record
+from src.dedup import KeyIndex, DEFAULT_MAX_MEMORY_KEYS
+from src.writer import BackgroundWriter, DEFAULT_MAX_PENDING
+from src import cache
+from contextlib import nullcontext
 import time
 
 logger = get_logger(__name__)     #logger store
 
+
+def new_summary(source_name: str) -> dict:
+    """Empty counters for one source; every chunk adds into these."""
+    return {  # COLLECT STATS FOR SUMMARY
+        "source": source_name,
+        "status": "ok",
+        "chunks": 0,
+        "loaded_raw": 0,
+        "valid_after_cast": 0,
+        "rejected_rows": 0,
+        "valid_after_rules": 0,
+        "loaded_to_db": 0,
+        "duplicates_dropped": 0,  # rows beaten by a later row with the same business key
+        "keys_superseded": 0,     # loaded rows later overwritten by a later duplicate
+        "rows_inserted": 0,       # new keys in the target table
+        "rows_updated": 0,        # existing keys whose values were rewritten
+        "rows_unchanged": 0,      # existing keys skipped by the delta upsert
+        "rule_rejects": {},   # rule text -> rows that failed it
+        "ingest_mode": "full",   # full / append / skip (incremental runs)
+        "watermark": None,       # max value of the watermark column loaded
+        "runtime_seconds": 0.0,
+    }
+
+
+def iter_source_chunks(cfg: dict, source: dict, start_offset: int = 0):
+    """
+    Yield the source as DataFrames.
+    - streaming mode: chunks of `batch_size` rows (bounded memory)
+    - otherwise: the whole file as a single DataFrame
+    - start_offset: byte offset to resume from (incremental append, CSV only)
+    - project_columns: only read the `schema:` columns
+    - csv_engine / dtype_backend: "pyarrow" parser and Arrow-backed dtypes
+    - parse_workers > 1: parse newline-aligned byte ranges in a process pool
+      (parse_ordered: false lets chunks arrive out of order)
+    - memory_map: parse plain CSVs from an mmap; .csv.gz / .csv.zst are
+      decompressed while streaming
+    """
+    batch_size = get_source_option(cfg, source, "batch_size")
+    streaming = get_source_option(cfg, source, "streaming", False)
+    dtype_backend = get_source_option(cfg, source, "dtype_backend")
+    columns = list(source["schema"]) if get_source_option(cfg, source, "project_columns", False) else None
+
+    if source["type"] == "parquet":
+        if streaming and batch_size:
+            yield from read_parquet_chunks(
+                source["path"], chunksize=int(batch_size), columns=columns, dtype_backend=dtype_backend
+            )
+        else:
+            yield read_parquet(source["path"], columns=columns, dtype_backend=dtype_backend)
+        return
+
+    csv_options = {
+        "start_offset": start_offset,
+        "columns": columns,
+        "engine": get_source_option(cfg, source, "csv_engine"),
+        "dtype_backend": dtype_backend,
+        "memory_map": get_source_option(cfg, source, "memory_map", False),
+    }
+    parse_workers = int(get_source_option(cfg, source, "parse_workers", 1))
+    if streaming and batch_size and parse_workers > 1:
+        # Byte-range split parsed on several cores
+        yield from read_csv_parallel(
+            source["path"],
+            chunksize=int(batch_size),
+            workers=parse_workers,
+            ordered=get_source_option(cfg, source, "parse_ordered", True),
+            **csv_options,
+        )
+    elif streaming and batch_size:
+        yield from read_csv_chunks(source["path"], chunksize=int(batch_size), **csv_options)
+    else:
+        yield read_csv(source["path"], **csv_options)
+
+
+# Source `type` values main.run() knows how to read
+SUPPORTED_SOURCE_TYPES = ("csv", "parquet")
+
+
+def process_chunk(
+    df,
+    source: dict,
+    summary: dict,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    load_strategy: str = "insert",
+    write_lock=None,
+    reject_options: dict | None = None,
+    metrics: RunMetrics | None = None,
+    key_index: KeyIndex | None = None,
+    upsert_options: dict | None = None,
+    writer: BackgroundWriter | None = None,
+    cache_dir=None,
+    format_cache: dict | None = None,
+    cache_months: set | None = None,
+) -> None:
+    """
+    Run one chunk through cast -> rules -> clean -> load
+    and add its row counts into `summary`.
+    The chunk is consumed (cast in place) by the fused transform.
+    `write_lock` (optional) is held around every DB write.
+    `reject_options` are passed to load_rejects (strategy, sink, spill_dir).
+    `metrics` (optional) collects per-stage timings.
+    `key_index` (optional) carries business-key dedup across the chunks of a file.
+    `upsert_options` are passed to load_fashion_sales_upsert (mode, row_hash, running_stats).
+    `writer` (optional) BackgroundWriter: the load step is queued on it and
+    this returns as soon as the chunk is transformed (pipelined mode).
+    `cache_dir` (optional): also append the loaded rows to this Parquet cache.
+    `format_cache` (optional) keeps guessed datetime formats across the chunks of a file.
+    `cache_months` (optional) collects the cache months this run wrote (to compact).
+    """
+    metrics = metrics or RunMetrics(source["name"])
+    summary["chunks"] += 1
+    summary["loaded_raw"] += len(df)
+
+    # Fused cast -> rules -> clean (one pass, the chunk is cast in place)
+    clean_df, reject_df, rule_reject_df = transform_chunk(
+        df,
+        source["schema"],
+        rules=source.get("rules"),
+        rule_counts=summary["rule_rejects"],
+        metrics=metrics,
+        key_index=key_index,
+        format_cache=format_cache,
+    )
+    valid_after_cast = len(df) - len(reject_df)
+    valid_after_rules = valid_after_cast - len(rule_reject_df)
+    summary["valid_after_cast"] += valid_after_cast
+    summary["valid_after_rules"] += valid_after_rules
+    summary["rejected_rows"] += len(reject_df) + len(rule_reject_df)
+    summary["duplicates_dropped"] += valid_after_rules - len(clean_df)
+    logger.debug(f"   After casting: {valid_after_cast} valid rows, {len(reject_df)} rejected rows")
+    logger.debug(f"   After rules:   {valid_after_rules} valid, {len(rule_reject_df)} rejected")
+    logger.debug(f"   After cleaning: {len(clean_df)} rows ready for load")
+
+    load_args = (clean_df, reject_df, rule_reject_df, source, summary)
+    load_kwargs = {
+        "batch_size": batch_size,
+        "load_strategy": load_strategy,
+        "write_lock": write_lock,
+        "reject_options": reject_options,
+        "upsert_options": upsert_options,
+        "metrics": metrics,
+        "cache_dir": cache_dir,
+        "cache_months": cache_months,
+    }
+    if writer is None:
+        load_chunk(*load_args, **load_kwargs)
+    else:
+        # Blocks only while the writer is max_pending chunks behind (backpressure)
+        with metrics.stage("write_wait"):
+            writer.submit(load_chunk, *load_args, **load_kwargs)
+
+
+def load_chunk(
+    clean_df,
+    reject_df,
+    rule_reject_df,
+    source: dict,
+    summary: dict,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    load_strategy: str = "insert",
+    write_lock=None,
+    reject_options: dict | None = None,
+    upsert_options: dict | None = None,
+    metrics: RunMetrics | None = None,
+    cache_dir=None,
+    cache_months: set | None = None,
+) -> None:
+    """
+    Write one transformed chunk: both reject sets, then the upsert.
+    Adds the load counters (loaded_to_db, inserted/updated/unchanged, watermark)
+    into `summary`. Runs on the writer thread in pipelined mode.
+    With `cache_dir`, the upserted rows are mirrored into the Parquet cache
+    (their months are invalid until both writes are done, see cache.py) and
+    their months added to `cache_months`.
+    """
+    write_lock = write_lock or nullcontext()
+    reject_options = reject_options or {}
+    upsert_options = upsert_options or {}
+    metrics = metrics or RunMetrics(source["name"])
+
+    if len(reject_df) > 0:
+        with write_lock, metrics.stage("reject_load", rows=len(reject_df)):
+            load_rejects(reject_df, source_name=source["name"], reason="type_cast_failed", **reject_options)
+
+    if len(rule_reject_df) > 0:
+        with write_lock, metrics.stage("reject_load", rows=len(rule_reject_df)):
+            load_rejects(rule_reject_df, source_name=source["name"], reason="business_rule_failed", **reject_options)
+
+    table_name = source["target_table"]  # "stg_fashion_sales"
+
+    if cache_dir:
+        cache_df = clean_df.rename(columns=FASHION_COL_RENAME)
+        cache_counts = cache.begin_batch(cache_df, cache_dir)
+        if cache_months is not None:
+            cache_months.update(cache_counts)
+
+    # Use dataset-specific loader with UPSERT
+    with write_lock, metrics.stage("upsert", rows=len(clean_df)):
+        result = load_fashion_sales_upsert(
+            clean_df, table_name, batch_size=batch_size, strategy=load_strategy, **upsert_options
+        )
+
+    if cache_dir:
+        with metrics.stage("cache_write", rows=len(cache_df)):
+            cache.commit_batch(cache_df, cache_dir, cache_counts)
+    summary["loaded_to_db"] += len(clean_df)
+    if result:
+        summary["rows_inserted"] += result.get("inserted", 0)
+        summary["rows_updated"] += result.get("updated", 0)
+        summary["rows_unchanged"] += result.get("unchanged", 0)
+
+    # High-water mark of what reached the DB (e.g. latest date purchase)
+    watermark_col = source.get("watermark_column")
+    if watermark_col and watermark_col in clean_df.columns and not clean_df.empty:
+        chunk_max = clean_df[watermark_col].max()
+        if summary["watermark"] is None or chunk_max > summary["watermark"]:
+            summary["watermark"] = chunk_max
+
+
+def log_summary(summary: dict) -> None:
+    # --- RUN SUMMARY BLOCK ---
+    logger.info("\n--- RUN SUMMARY ---")
+    logger.info(f"Source: {summary['source']}")
+    if summary.get("status") == "failed":
+        logger.info(f"FAILED: {summary.get('error')}")
+        return
+    logger.info(f"Ingest mode: {summary['ingest_mode']}")
+    logger.info(f"Chunks processed: {summary['chunks']}")
+    logger.info(f"Loaded (raw): {summary['loaded_raw']}")
+    logger.info(f"Valid after cast: {summary['valid_after_cast']}")
+    logger.info(f"Rejected rows: {summary['rejected_rows']}")
+    logger.info(f"Valid after rules: {summary['valid_after_rules']}")
+    for rule_text, n_failed in summary["rule_rejects"].items():
+        logger.info(f"   Rule failed {n_failed:>6}x: {rule_text}")
+    logger.info(f"Loaded into DB: {summary['loaded_to_db']}")
+    logger.info(
+        f"   {summary['rows_inserted']} inserted, {summary['rows_updated']} updated, "
+        f"{summary['rows_unchanged']} unchanged"
+    )
+    logger.info(
+        f"Duplicate keys: {summary['duplicates_dropped']} dropped, "
+        f"{summary['keys_superseded']} loaded then replaced by a later row"
+    )
+    if summary["watermark"] is not None:
+        logger.info(f"Watermark: {summary['watermark']}")
+    logger.info(f"Runtime: {round(summary['runtime_seconds'], 2)} seconds")
+    #logger.info("----------------------\n")
+
+
+def log_combined_summary(combined: dict) -> None:
+    logger.info("\n--- COMBINED SUMMARY ---")
+    logger.info(f"Sources: {combined['sources']} (failed: {combined['failed_sources'] or 'none'})")
+    logger.info(f"Loaded (raw): {combined.get('loaded_raw', 0)}")
+    logger.info(f"Rejected rows: {combined.get('rejected_rows', 0)}")
+    logger.info(f"Loaded into DB: {combined.get('loaded_to_db', 0)}")
+    logger.info(
+        f"Wall time: {combined['wall_seconds']} seconds "
+        f"(sum of source runtimes: {combined.get('runtime_seconds', 0)} seconds)"
+    )
+
+
+def run_source(job: dict, write_lock=None) -> dict:
+    """
+    Read + process + load ONE source and return its summary.
+    job = {"cfg": <sources.yml dict>, "source": <one source entry>}
+    (top-level function so the process pool can pickle it)
+    """
+    cfg, source = job["cfg"], job["source"]
+    start_time = time.time()  # START TIMER
+
+    summary = new_summary(source["name"])
+    batch_size = get_source_option(cfg, source, "batch_size", DEFAULT_BATCH_SIZE)
+    load_strategy = get_source_option(cfg, source, "load_strategy", "insert")
+    reject_options = {
+        "strategy": load_strategy,
+        "sink": get_source_option(cfg, source, "reject_sink", "db"),
+        "spill_dir": get_source_option(cfg, source, "reject_spill_dir"),
+    }
+    upsert_options = {
+        "mode": get_source_option(cfg, source, "upsert_mode", "full"),
+        "row_hash": get_source_option(cfg, source, "row_hash", False),
+        "running_stats": get_source_option(cfg, source, "running_stats", False),
+    }
+
+    # Incremental runs: skip unchanged files, resume append-only files
+    incremental = get_source_option(cfg, source, "incremental", False)
+    state_dir = get_source_option(cfg, source, "state_dir")
+    previous = load_state(source["name"], state_dir) if incremental else None
+    plan = plan_ingest(source["path"], previous) if incremental else {"mode": "full", "offset": 0}
+    if plan["mode"] == "append" and (source["type"] != "csv" or compression_of(source["path"])):
+        # Byte-offset resume only makes sense for plain line-based files
+        plan = {**plan, "mode": "full", "offset": 0}
+    summary["ingest_mode"] = plan["mode"]
+
+    if plan["mode"] == "skip":
+        logger.info(f"⏭  {source['name']}: file unchanged since last run, skipping")
+        summary["watermark"] = (previous or {}).get("watermark")
+        summary["runtime_seconds"] = time.time() - start_time
+        return summary
+
+    metrics = RunMetrics(
+        source["name"],
+        trace_memory=get_source_option(cfg, source, "trace_memory", False),
+        profile=get_source_option(cfg, source, "profile", False),
+        profile_dir=get_source_option(cfg, source, "profile_dir"),
+    )
+
+    logger.debug(f"📥 Reading source: {source['name']} ({plan['mode']}, offset {plan['offset']})")
+    chunks = metrics.timed_iter(
+        "read",
+        iter_source_chunks(cfg, source, start_offset=plan["offset"]),
+        bytes_of=lambda chunk: chunk.memory_usage(index=False).sum(),
+    )
+    # Business keys seen so far in this file (last row wins across chunks)
+    key_index = KeyIndex(
+        max_memory_keys=int(get_source_option(cfg, source, "dedup_max_memory_keys", DEFAULT_MAX_MEMORY_KEYS)),
+        spill_dir=get_source_option(cfg, source, "dedup_spill_dir"),
+    )
+    # Datetime formats guessed for this file only (another source may order day/month differently)
+    format_cache = {}
+    # Parquet copy of the loaded rows for ml_analysis (cache/<target_table>/)
+    cache_dir = None
+    cache_months = set()  # months this run wrote: the only ones compacted at the end
+    if get_source_option(cfg, source, "parquet_cache", False):
+        cache_dir = cache.cache_dir_for(source["target_table"], get_source_option(cfg, source, "parquet_cache_dir"))
+
+    # Pipelined: chunk N is written on a background thread while chunk N+1 is transformed
+    writer = None
+    if get_source_option(cfg, source, "pipelined", False):
+        max_pending = get_source_option(cfg, source, "max_pending_writes", DEFAULT_MAX_PENDING)
+        writer = BackgroundWriter(max_pending=max_pending, name=f"writer-{source['name']}")
+
+    # Leaving the block waits for every queued write (and re-raises a failed one)
+    with key_index, (writer or nullcontext()):
+        for df in chunks:
+            logger.debug(f"   Loaded {len(df)} rows")
+
+            ##Validation (columns are the same for every chunk, so check once)
+            if summary["chunks"] == 0:
+                missing = check_missing_columns(df, source["schema"])
+                logger.debug(f"   Missing columns: {missing}")
+
+            process_chunk(
+                df,
+                source,
+                summary,
+                batch_size=batch_size,
+                load_strategy=load_strategy,
+                write_lock=write_lock,
+                reject_options=reject_options,
+                metrics=metrics,
+                key_index=key_index,
+                upsert_options=upsert_options,
+                writer=writer,
+                cache_dir=cache_dir,
+                format_cache=format_cache,
+                cache_months=cache_months,
+            )
+        summary["keys_superseded"] = key_index.superseded
+
+    if cache_dir and cache_months:
+        # One deduplicated file per month again (each chunk appended its own);
+        # only this run's months, so the lock is held for work this run made
+        with metrics.stage("cache_compact"):
+            cache.compact_partitions(cache_dir, cache_months)
+
+    if incremental:
+        # Only reached when every chunk loaded; a crash leaves the old state in place
+        save_state(source["name"], build_source_state(previous, plan, summary), state_dir)
+
+    summary["runtime_seconds"] = time.time() - start_time
+    summary["metrics"] = metrics.as_record()
+    for path in metrics.dump_profiles():
+        logger.info(f"   Profile written: {path}")
+    return summary
+
+
+def build_source_state(previous: dict | None, plan: dict, summary: dict) -> dict:
+    """New state record after a successful full / append run."""
+    rows_before = (previous or {}).get("rows_loaded", 0) if plan["mode"] == "append" else 0
+    old_watermark = (previous or {}).get("watermark") if plan["mode"] == "append" else None
+
+    watermark = summary["watermark"]
+    if watermark is not None:
+        watermark = str(watermark)
+    if old_watermark is not None and (watermark is None or old_watermark > watermark):
+        watermark = old_watermark
+
+    return {
+        "source": summary["source"],
+        "fingerprint": plan["fingerprint"],
+        "rows_loaded": rows_before + summary["loaded_raw"],
+        "watermark": watermark,
+        "last_mode": plan["mode"],
+        "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
 def run():
     start_time = time.time()  # START TIMER
     cfg = load_sources_config()
 
+    sources = []
     for source in cfg["sources"]:
-        if source["type"] != "csv":
+        if source["type"] not in SUPPORTED_SOURCE_TYPES:
+            logger.warning(f"Skipping source {source['name']}: unsupported type {source['type']!r}")
             continue
-        
-        summary = {  # COLLECT STATS FOR SUMMARY
-            "source": source["name"],
-            "loaded_raw": 0,
-            "valid_after_cast": 0,
-            "rejected_rows": 0,
-            "valid_after_rules": 0,
-            "loaded_to_db": 0,
-        }
-        
-        logger.debug(f"📥 Reading source: {source['name']}")
-        df = read_csv(source["path"])
-        summary["loaded_raw"] = len(df)
-        logger.debug(f"   Loaded {len(df)} rows")
-
-        ##Validation
-        schema = source["schema"]
-        missing = check_missing_columns(df, schema)
-        logger.debug(f"   Missing columns: {missing}")
-
-        # type casting reject if anything wrong 
-        # Apply type casting
-        valid_df, reject_df = apply_schema_casts(df, schema)
-        summary["valid_after_cast"] = len(valid_df)
-        summary["rejected_rows"] += len(reject_df)
-        logger.debug(f"   After casting: {len(valid_df)} valid rows, {len(reject_df)} rejected rows")
-        
-        if len(reject_df) > 0:
-            load_rejects(reject_df, source_name=source["name"], reason="type_cast_failed")
-            
-        # Business rule validation on the cast-valid rows
-        rule_valid_df, rule_reject_df = apply_business_rules(valid_df)
-        summary["valid_after_rules"] = len(rule_valid_df)
-        summary["rejected_rows"] += len(rule_reject_df)
-        logger.debug(f"   After rules:   {len(rule_valid_df)} valid, {len(rule_reject_df)} rejected")
-        
-        if len(rule_reject_df) > 0:
-            load_rejects(rule_reject_df, source_name=source["name"], reason="business_rule_failed")
-
-        # CLEANING step (new)
-        clean_df = clean_fashion_sales(rule_valid_df)
-        logger.debug(f"   After cleaning: {len(clean_df)} rows ready for load")
-        table_name = source["target_table"]  # "stg_fashion_sales"
-        
-        # Use dataset-specific loader with UPSERT
-        load_fashion_sales_upsert(clean_df, table_name)
-        summary["loaded_to_db"] = len(clean_df)
-
-        
-        # --- RUN SUMMARY BLOCK ---
-        logger.info("\n--- RUN SUMMARY ---")
-        logger.info(f"Source: {summary['source']}")
-        logger.info(f"Loaded (raw): {summary['loaded_raw']}")
-        logger.info(f"Valid after cast: {summary['valid_after_cast']}")
-        logger.info(f"Rejected rows: {summary['rejected_rows']}")
-        logger.info(f"Valid after rules: {summary['valid_after_rules']}")
-        logger.info(f"Loaded into DB: {summary['loaded_to_db']}")
-        logger.info(f"Runtime: {round(time.time() - start_time, 2)} seconds")
-        #logger.info("----------------------\n")        
-        
-        
+        sources.append(source)
+
+    jobs = [{"cfg": cfg, "source": source} for source in sources]
+    max_workers = int(get_source_option(cfg, {}, "max_workers", 1))
+
+    if max_workers > 1 and len(jobs) > 1:
+        # Independent sources run side by side; DB writes share a bounded pool of slots
+        max_db_writers = get_source_option(cfg, {}, "max_db_writers", 2)
+        summaries = run_parallel(run_source, jobs, max_workers, max_db_writers)
+    else:
+        summaries = [run_source(job) for job in jobs]
+
+    for summary in summaries:
+        log_summary(summary)
+
+    combined = combine_summaries(summaries, time.time() - start_time)
+    log_combined_summary(combined)
+
+    # One JSON record per run: combined counters + per-source stage metrics
+    emit_run_record(
+        {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(start_time)),
+            "combined": combined,
+            "sources": {s["source"]: s.get("metrics") for s in summaries},
+        },
+        metrics_path=get_source_option(cfg, {}, "metrics_path"),
+    )
+    if combined["failed_sources"]:
+        raise RuntimeError(f"Sources failed: {combined['failed_sources']}")
+    return combined
+
+
 if __name__ == "__main__":
     run()
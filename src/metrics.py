@@ -0,0 +1,152 @@
+"""
+metrics.py
+
+Per-stage instrumentation for an ETL run.
+
+    metrics = RunMetrics("fashion_sales_csv")
+    with metrics.stage("upsert", rows=len(df)):
+        load_fashion_sales_upsert(...)
+
+Every stage accumulates, over all its calls (one per chunk):
+  - wall_seconds / cpu_seconds
+  - rows and bytes processed, rows_per_sec
+  - max_rss_bytes (process high-water mark, always available)
+  - peak_traced_bytes (Python allocations inside the stage, only with trace_memory=True)
+
+In pipelined mode reject_load / upsert run on the writer thread and overlap
+the main-thread stages, so stage times can add up to more than the wall time;
+"write_wait" is the time the main thread sat blocked on a full write queue.
+
+Opt-in extras:
+  - trace_memory=True: tracemalloc around each stage (adds noticeable overhead)
+  - profile=True: one cProfile per stage, dumped as <profile_dir>/<run>_<stage>.prof
+"""
+
+import cProfile
+import json
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+from src.logs.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+def _max_rss_bytes() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class RunMetrics:
+    """Collects per-stage timings for one source (or one whole run)."""
+
+    def __init__(self, run_name: str, trace_memory: bool = False, profile: bool = False, profile_dir=None):
+        self.run_name = run_name
+        self.trace_memory = trace_memory
+        self.profile = profile
+        self.profile_dir = Path(profile_dir or "profiles")
+        self.stages = {}
+        self._profilers = {}
+
+    def _stage_record(self, name: str) -> dict:
+        return self.stages.setdefault(
+            name,
+            {
+                "calls": 0,
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "rows": 0,
+                "bytes": 0,
+                "max_rss_bytes": 0,
+                "peak_traced_bytes": None,
+            },
+        )
+
+    @contextmanager
+    def stage(self, name: str, rows: int = 0, bytes_processed: int = 0):
+        """
+        Time one call of a stage. Yields the stage record so the caller can
+        add counts known only afterwards: `rec["rows"] += n`.
+        """
+        rec = self._stage_record(name)
+        rec["rows"] += rows
+        rec["bytes"] += bytes_processed
+
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        profiler = None
+        if self.profile:
+            profiler = self._profilers.setdefault(name, cProfile.Profile())
+            profiler.enable()
+
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield rec
+        finally:
+            rec["wall_seconds"] += time.perf_counter() - wall_start
+            rec["cpu_seconds"] += time.process_time() - cpu_start
+            rec["calls"] += 1
+            if profiler is not None:
+                profiler.disable()
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                rec["peak_traced_bytes"] = max(rec["peak_traced_bytes"] or 0, peak)
+            rec["max_rss_bytes"] = max(rec["max_rss_bytes"], _max_rss_bytes())
+
+    def timed_iter(self, name: str, iterable, bytes_of=None):
+        """
+        Wrap an iterator of DataFrames so every next() counts as one call of
+        stage `name` (e.g. reading the next chunk from disk).
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name) as rec:
+                item = next(iterator, None)
+                if item is not None:
+                    rec["rows"] += len(item)
+                    if bytes_of is not None:
+                        rec["bytes"] += int(bytes_of(item))
+            if item is None:
+                return
+            yield item
+
+    def as_record(self) -> dict:
+        """JSON-ready snapshot: every stage plus derived rows_per_sec."""
+        stages = {}
+        for name, rec in self.stages.items():
+            out = dict(rec)
+            out["wall_seconds"] = round(rec["wall_seconds"], 6)
+            out["cpu_seconds"] = round(rec["cpu_seconds"], 6)
+            out["rows_per_sec"] = round(rec["rows"] / rec["wall_seconds"], 1) if rec["wall_seconds"] else None
+            stages[name] = out
+        return {"run": self.run_name, "stages": stages}
+
+    def dump_profiles(self) -> list[Path]:
+        """Write one .prof file per profiled stage (open with pstats / snakeviz)."""
+        paths = []
+        if not self._profilers:
+            return paths
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        for name, profiler in self._profilers.items():
+            path = self.profile_dir / f"{self.run_name}_{name}.prof"
+            profiler.dump_stats(str(path))
+            paths.append(path)
+        return paths
+
+
+def emit_run_record(record: dict, metrics_path=None) -> None:
+    """Log the run record as one JSON line and optionally append it to metrics_path (JSONL)."""
+    line = json.dumps(record, default=str)
+    logger.info(f"RUN METRICS {line}")
+    if metrics_path:
+        path = Path(metrics_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
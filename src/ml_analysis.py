@@ -3,50 +3,124 @@ ml_analysis.py
 
 Lightweight ML module built on top of the ETL Data Ingestion Sub-System.
 
-- Reads cleaned data from stg_fashion_sales
+- Reads cleaned data from the Parquet cache the ETL writes (cache.py),
+  refreshing only invalidated months from stg_fashion_sales
 - Creates a binary target: low_review (rating <= 2)
-- Detects simple purchase amount outliers
+- Detects simple purchase amount outliers (in pandas, or pushed down to the
+  DB with ml_outliers: zscore / robust, see outliers.py)
 - Trains:
     * LogisticRegression
     * RandomForestClassifier
 - Prints metrics and feature importances
+- ml_training: streaming trains batch by batch instead (ml_streaming.py)
+- Trained models + vocabulary + scaler are saved under models/<snapshot>/,
+  keyed by a hash of the training data, and reused while it is unchanged;
+  streaming training saves its SGD / forest + hasher settings the same way,
+  after a hashing-only pass that finds the snapshot before training
+- `python -m src.ml_analysis score` scores rows that have no prediction yet
+  and bulk-loads them into ml_predictions
 """
 
-import os
+import argparse
+import json
+import time
+from pathlib import Path
 
+import joblib
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
+import scipy.sparse as sp
 from sklearn.model_selection import train_test_split
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.preprocessing import StandardScaler
-
-from dotenv import load_dotenv
-
-# Load .env once at import time
-load_dotenv()
-
-
-def get_db_url() -> str:
-    db_url = os.getenv("DB_URL")
-    if not db_url:
-        raise ValueError("DB_URL not set. Please create a .env file with DB_URL.")
-    return db_url
+from sqlalchemy import text
+
+from src import cache, ml_streaming
+from src.config import get_source_option, load_sources_config
+from src.db import get_engine
+from src.load import copy_upsert_dataframe
+from src.outliers import detect_outliers_sql
+
+SILVER_TABLE = "stg_fashion_sales"
+
+# Low-cardinality text columns come back as categoricals (see build_features_and_target)
+CATEGORY_COLS = {"item_purchased": "category", "payment_method": "category"}
+
+NUMERIC_FEATURES = ["purchase_amount_usd"]
+CATEGORICAL_FEATURES = ["payment_method", "item_purchased"]
+
+DEFAULT_MODEL_DIR = Path(__file__).parent.parent / "models"
+DEFAULT_VOCABULARY_PATH = DEFAULT_MODEL_DIR / "feature_vocabulary.json"
+ARTIFACT_FILE = "models.joblib"
+LATEST_FILE = "latest.json"
+
+# Batch scoring output: one row per sale and model version
+PREDICTIONS_TABLE = "ml_predictions"
+KEY_COLS = ["customer_reference_id", "item_purchased", "date_purchase"]
+PREDICTION_PK = KEY_COLS + ["model_version"]
+PREDICTIONS_DDL = f"""
+CREATE TABLE IF NOT EXISTS {PREDICTIONS_TABLE} (
+    customer_reference_id BIGINT NOT NULL,
+    item_purchased TEXT NOT NULL,
+    date_purchase DATE NOT NULL,
+    model_version TEXT NOT NULL,
+    low_review_proba DOUBLE PRECISION,
+    low_review_pred SMALLINT,
+    scored_at TIMESTAMP,
+    PRIMARY KEY (customer_reference_id, item_purchased, date_purchase, model_version)
+)
+"""
+# Rows without a prediction from this model version yet (new loads since the last scoring run)
+UNSCORED_ROWS_SQL = f"""
+SELECT s.customer_reference_id, s.item_purchased, s.date_purchase,
+       s.purchase_amount_usd, s.payment_method
+FROM {SILVER_TABLE} s
+LEFT JOIN {PREDICTIONS_TABLE} p
+  ON p.customer_reference_id = s.customer_reference_id
+ AND p.item_purchased = s.item_purchased
+ AND p.date_purchase = s.date_purchase
+ AND p.model_version = :model_version
+WHERE p.customer_reference_id IS NULL
+"""
 
 
-def get_engine():
-    return create_engine(get_db_url())
+def _silver_cache_dir():
+    cfg = load_sources_config()
+    if not get_source_option(cfg, {}, "parquet_cache", False):
+        return None
+    return cache.cache_dir_for(SILVER_TABLE, get_source_option(cfg, {}, "parquet_cache_dir"))
 
 
-def load_silver_data() -> pd.DataFrame:
+def load_silver_data(columns=None, filters=None, use_cache: bool = True) -> pd.DataFrame:
     """
-    Load the cleaned / silver-layer data from stg_fashion_sales.
+    Load the cleaned / silver-layer data.
+
+    - From the Parquet cache when it is enabled: only `columns` are read and
+      `filters` (e.g. [("purchase_month", ">=", "2023-06")]) prune partitions
+    - Months invalidated since the last load are re-read from the DB first
+    - Cache never seeded: one full read of stg_fashion_sales, which seeds it
     """
-    engine = get_engine()
-    query = "SELECT * FROM stg_fashion_sales"
-    df = pd.read_sql(query, engine)
-    return df
+    cache_dir = _silver_cache_dir() if use_cache else None
+    if cache_dir is None:
+        col_list = ", ".join(columns) if columns is not None else "*"
+        df = pd.read_sql(f"SELECT {col_list} FROM {SILVER_TABLE}", get_engine())
+        return df.astype({c: t for c, t in CATEGORY_COLS.items() if c in df.columns})
+
+    manifest = cache.load_manifest(cache_dir)
+    if not manifest.get("seeded_at"):
+        # First use: the ETL may have loaded rows before the cache existed
+        print(f"[cache] Seeding the Parquet cache from {SILVER_TABLE}")
+        cache.bootstrap_cache(pd.read_sql(f"SELECT * FROM {SILVER_TABLE}", get_engine()), cache_dir)
+    else:
+        invalid = [m for m, p in manifest["partitions"].items() if p.get("status") != "valid"]
+        if invalid:
+            print(f"[cache] Refreshing {len(invalid)} invalidated month(s) from {SILVER_TABLE}")
+            cache.refresh_partitions(cache_dir, invalid, get_engine(), SILVER_TABLE)
+
+    df = cache.read_cache(cache_dir, columns=columns, filters=filters)
+    return df.astype({c: t for c, t in CATEGORY_COLS.items() if c in df.columns})
 
 
 def detect_outliers(df: pd.DataFrame, z_thresh: float = 3.0) -> pd.DataFrame:
@@ -75,14 +149,80 @@ def detect_outliers(df: pd.DataFrame, z_thresh: float = 3.0) -> pd.DataFrame:
     return outliers.sort_values("z_score", key=lambda s: s.abs(), ascending=False)
 
 
-def build_features_and_target(df: pd.DataFrame):
+class FeatureVocabulary:
+    """
+    The one-hot columns of the model, fixed once at training time.
+
+    - Same layout as get_dummies(drop_first=True): purchase_amount_usd, then
+      "<column>_<value>" for every category but the first (sorted) one
+    - transform() builds a scipy CSR matrix straight from the category codes,
+      no dense dummy frame in between
+    - Values unseen at fit time get no column (like the dropped baseline), so
+      scoring new rows always yields exactly the training columns
+    - save() / load() keep it next to the model as JSON
+    """
+
+    def __init__(self, categories: dict):
+        self.categories = {col: list(values) for col, values in categories.items()}
+
+    @classmethod
+    def fit(cls, df: pd.DataFrame) -> "FeatureVocabulary":
+        categories = {}
+        for col in CATEGORICAL_FEATURES:
+            values = sorted(df[col].dropna().astype(str).unique())
+            categories[col] = values[1:]  # drop_first: the first value is the baseline
+        return cls(categories)
+
+    @property
+    def feature_names(self) -> list[str]:
+        return NUMERIC_FEATURES + [f"{col}_{value}" for col, values in self.categories.items() for value in values]
+
+    def transform(self, df: pd.DataFrame) -> sp.csr_matrix:
+        n_rows = len(df)
+        rows, cols, data = [], [], []
+        for i, col in enumerate(NUMERIC_FEATURES):
+            rows.append(np.arange(n_rows))
+            cols.append(np.full(n_rows, i))
+            data.append(df[col].astype(float).to_numpy())
+
+        offset = len(NUMERIC_FEATURES)
+        for col, values in self.categories.items():
+            # codes index into the vocabulary, -1 = baseline / unseen value / missing
+            codes = pd.Categorical(df[col].astype(str), categories=values).codes
+            hit = np.flatnonzero(codes >= 0)
+            rows.append(hit)
+            cols.append(offset + codes[hit])
+            data.append(np.ones(len(hit)))
+            offset += len(values)
+
+        return sp.csr_matrix(
+            (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(n_rows, offset),
+        )
+
+    def save(self, path=None) -> Path:
+        path = Path(path or DEFAULT_VOCABULARY_PATH)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"numeric": NUMERIC_FEATURES, "categories": self.categories}, f, indent=2)
+        return path
+
+    @classmethod
+    def load(cls, path=None) -> "FeatureVocabulary":
+        with open(path or DEFAULT_VOCABULARY_PATH, "r", encoding="utf-8") as f:
+            return cls(json.load(f)["categories"])
+
+
+def build_features_and_target(df: pd.DataFrame, vocabulary: FeatureVocabulary | None = None):
     """
     Prepare features X and target y for classification:
     Target: low_review = 1 if review_rating <= 2, else 0
-    Features:
+    Features (sparse CSR, columns from the vocabulary):
         - purchase_amount_usd (numeric)
         - payment_method (one-hot)
         - item_purchased (one-hot)
+    vocabulary: reuse a fitted / loaded FeatureVocabulary (scoring); None fits one.
+    Returns X, y, feature_names, vocabulary.
     """
     # Drop rows without ratings or amounts
     df = df.dropna(subset=["review_rating", "purchase_amount_usd"])
@@ -90,39 +230,30 @@ def build_features_and_target(df: pd.DataFrame):
         raise ValueError("No rows left after dropping missing review_rating/purchase_amount_usd.")
 
     # Target
-    df["low_review"] = (df["review_rating"] <= 2).astype(int)
+    y = (df["review_rating"] <= 2).astype(int).rename("low_review")
 
-    feature_cols = ["purchase_amount_usd", "payment_method", "item_purchased"]
+    feature_cols = NUMERIC_FEATURES + CATEGORICAL_FEATURES
     missing = [c for c in feature_cols if c not in df.columns]
     if missing:
         raise ValueError(f"Missing expected feature columns: {missing}")
 
-    feat_df = df[feature_cols].copy()
-
-    # One-hot encode categorical features
-    feat_df = pd.get_dummies(
-        feat_df,
-        columns=["payment_method", "item_purchased"],
-        drop_first=True,
-    )
-
-    X = feat_df
-    y = df["low_review"]
-
-    return X, y, feat_df.columns.tolist()
+    vocabulary = vocabulary or FeatureVocabulary.fit(df)
+    X = vocabulary.transform(df)
+    return X, y, vocabulary.feature_names, vocabulary
 
 
 def train_and_evaluate_models(X, y, feature_names):
     """
     Train LogisticRegression and RandomForestClassifier,
     print metrics & feature importances.
+    Returns {"scaler", "log_reg", "random_forest"} (what save_artifacts stores).
     """
     X_train, X_test, y_train, y_test = train_test_split(
         X, y, test_size=0.25, random_state=42, stratify=y
     )
 
-    # Scale numeric features for Logistic Regression
-    scaler = StandardScaler(with_mean=False)  # with_mean=False for sparse matrices
+    # Scale for Logistic Regression; with_mean=False keeps X sparse
+    scaler = StandardScaler(with_mean=False)
     X_train_scaled = scaler.fit_transform(X_train)
     X_test_scaled = scaler.transform(X_test)
 
@@ -160,14 +291,183 @@ def train_and_evaluate_models(X, y, feature_names):
     print("\nConfusion matrix - Random Forest:")
     print(confusion_matrix(y_test, y_pred_rf))
 
+    return {"scaler": scaler, "log_reg": log_reg, "random_forest": rf}
+
+
+def data_snapshot_id(df: pd.DataFrame) -> str:
+    """
+    Short hash of the training data: row count + an order-independent sum of
+    per-row hashes, so the same rows read back in another order (e.g. after a
+    cache compaction) give the same id and any changed row gives a new one.
+    """
+    return ml_streaming.StreamSnapshot().update(df).id
+
+
+def save_artifacts(models: dict, vocabulary, snapshot: str, model_dir=None, **meta) -> Path:
+    """
+    Write models/<snapshot>/ (fitted models + vocabulary) and point
+    models/latest.json at it. Returns the artifact directory.
+    vocabulary: FeatureVocabulary, or ml_streaming.HashedFeatures for the
+    streamed models.
+    """
+    model_dir = Path(model_dir or DEFAULT_MODEL_DIR)
+    artifact_dir = model_dir / snapshot
+    artifact_dir.mkdir(parents=True, exist_ok=True)
+    vocabulary.save(artifact_dir / DEFAULT_VOCABULARY_PATH.name)
+    joblib.dump(models, artifact_dir / ARTIFACT_FILE)
+
+    latest = {"snapshot": snapshot, "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S"), **meta}
+    with open(artifact_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(latest, f, indent=2)
+    with open(model_dir / LATEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(latest, f, indent=2)
+    return artifact_dir
+
+
+def load_artifacts(snapshot: str | None = None, model_dir=None) -> dict | None:
+    """
+    Models + vocabulary saved for `snapshot` (the latest one when None).
+    Returns None when nothing was saved for it.
+    """
+    model_dir = Path(model_dir or DEFAULT_MODEL_DIR)
+    if snapshot is None:
+        latest_path = model_dir / LATEST_FILE
+        if not latest_path.exists():
+            return None
+        with open(latest_path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)["snapshot"]
+
+    artifact_dir = model_dir / snapshot
+    if not (artifact_dir / ARTIFACT_FILE).exists():
+        return None
+    return {
+        "snapshot": snapshot,
+        "models": joblib.load(artifact_dir / ARTIFACT_FILE),
+        "vocabulary": _load_features(artifact_dir / DEFAULT_VOCABULARY_PATH.name),
+    }
+
+
+def _load_features(path: Path):
+    """FeatureVocabulary, or HashedFeatures when the models were trained streaming."""
+    with open(path, "r", encoding="utf-8") as f:
+        saved = json.load(f)
+    if "hashed_features" in saved:
+        return ml_streaming.HashedFeatures(saved["hashed_features"])
+    return FeatureVocabulary(saved["categories"])
+
+
+def predict_batch(artifacts: dict, df: pd.DataFrame, model_name: str = "log_reg") -> pd.DataFrame:
+    """
+    Score one batch of silver rows with a saved model.
+    Rows without purchase_amount_usd cannot be scored and are skipped.
+    Returns key columns + low_review_proba / low_review_pred.
+    """
+    df = df.dropna(subset=["purchase_amount_usd"])
+    proba = np.empty(0)
+    if not df.empty:
+        models = artifacts["models"]
+        X = artifacts["vocabulary"].transform(df)
+        if "scaler" in models and model_name == "log_reg":
+            X = models["scaler"].transform(X)
+        proba = models[model_name].predict_proba(X)[:, 1]
+
+    out = df[KEY_COLS].reset_index(drop=True)
+    out["low_review_proba"] = proba
+    out["low_review_pred"] = (proba >= 0.5).astype(np.int16)
+    return out
+
+
+def score_new_rows(
+    model_name: str = "log_reg",
+    batch_size: int = ml_streaming.DEFAULT_BATCH_SIZE,
+    snapshot: str | None = None,
+    model_dir=None,
+) -> int:
+    """
+    Score every stg_fashion_sales row that has no prediction from this model
+    version yet, batch_size rows at a time (server-side cursor), and bulk-load
+    each batch into ml_predictions (COPY + merge). Returns the rows scored.
+    """
+    artifacts = load_artifacts(snapshot, model_dir)
+    if artifacts is None:
+        raise FileNotFoundError("No saved model artifacts; run ml_analysis (training) first.")
+    model_version = f"{model_name}-{artifacts['snapshot']}"
+
+    engine = get_engine()
+    with engine.begin() as conn:
+        conn.execute(text(PREDICTIONS_DDL))
+
+    scored = 0
+    with engine.connect().execution_options(stream_results=True, max_row_buffer=batch_size) as conn:
+        batches = pd.read_sql(
+            text(UNSCORED_ROWS_SQL), conn, params={"model_version": model_version}, chunksize=batch_size
+        )
+        for batch in batches:
+            predictions = predict_batch(artifacts, batch, model_name)
+            if predictions.empty:
+                continue
+            predictions["model_version"] = model_version
+            predictions["scored_at"] = pd.Timestamp.now().floor("s")
+            copy_upsert_dataframe(predictions, PREDICTIONS_TABLE, PREDICTION_PK, batch_size)
+            scored += len(predictions)
+            print(f"[score] {scored} rows scored with {model_version}")
+    return scored
+
 
 def main():
     print("=== ML Analysis: Predicting Low Reviews from stg_fashion_sales ===")
-    df = load_silver_data()
-    print(f"[info] Loaded {len(df)} rows from stg_fashion_sales")
+    cfg = load_sources_config()
+    if get_source_option(cfg, {}, "ml_training", "memory") == "streaming":
+        # Tables bigger than RAM: batched partial_fit, see ml_streaming.py
+        batch_size = int(get_source_option(cfg, {}, "ml_batch_size", ml_streaming.DEFAULT_BATCH_SIZE))
+        model_dir = get_source_option(cfg, {}, "ml_model_dir", None)
+        # A hashing-only pass is much cheaper than the two training passes
+        snapshot = ml_streaming.stream_snapshot_id(batch_size)
+        if load_artifacts(snapshot, model_dir) is not None:
+            print(f"\n[models] Data unchanged (snapshot {snapshot}); reusing the saved models")
+            print("\n=== ML analysis complete ===")
+            return
+
+        result = ml_streaming.run_streaming_training(
+            batch_size=batch_size,
+            forest_sample=int(get_source_option(cfg, {}, "ml_forest_sample", ml_streaming.DEFAULT_FOREST_SAMPLE)),
+        )
+        # saved under the id of the rows actually trained on (the table may have moved on since)
+        artifact_dir = save_artifacts(
+            result["models"],
+            result["features"],
+            result["snapshot"],
+            model_dir,
+            rows=result["rows"],
+            training="streaming",
+        )
+        print(f"\n[models] Saved streamed models for snapshot {result['snapshot']} to {artifact_dir}")
+        print("\n=== ML analysis complete ===")
+        return
+
+    # Only the columns the outlier check and the model use
+    df = load_silver_data(
+        columns=[
+            "customer_reference_id",
+            "item_purchased",
+            "purchase_amount_usd",
+            "review_rating",
+            "payment_method",
+        ]
+    )
+    print(f"[info] Loaded {len(df)} silver rows")
 
     print("\n=== Outlier Detection on purchase_amount_usd ===")
-    outliers = detect_outliers(df, z_thresh=3.0)
+    outlier_method = get_source_option(cfg, {}, "ml_outliers", "pandas")
+    if outlier_method == "pandas":
+        outliers = detect_outliers(df, z_thresh=3.0)
+    else:
+        # Statistics + filtering in the DB, only flagged rows come back (outliers.py)
+        outliers = detect_outliers_sql(
+            z_thresh=3.0,
+            method=outlier_method,
+            group_by=get_source_option(cfg, {}, "ml_outlier_group_by", None),
+        )
     if outliers.empty:
         print("[outliers] No strong outliers detected.")
     else:
@@ -182,22 +482,48 @@ def main():
                 "purchase_amount_usd",
                 "review_rating",
                 "payment_method",
+                "outlier_group",
                 "z_score",
             )
         ]
         print(outliers[display_cols].head(5))
 
+    model_dir = get_source_option(cfg, {}, "ml_model_dir", None)
+    snapshot = data_snapshot_id(df)
+    if load_artifacts(snapshot, model_dir) is not None:
+        print(f"\n[models] Data unchanged (snapshot {snapshot}); reusing the saved models")
+        print("\n=== ML analysis complete ===")
+        return
+
     print("\n=== Building features and target (low_review) ===")
-    X, y, feature_names = build_features_and_target(df)
+    X, y, feature_names, vocabulary = build_features_and_target(df)
     print(
-        f"[info] Feature matrix shape: {X.shape}, "
+        f"[info] Sparse feature matrix shape: {X.shape} ({X.nnz} non-zeros), "
         f"Target positive rate (low_review=1): {y.mean():.3f}"
     )
 
-    train_and_evaluate_models(X, y, feature_names)
+    models = train_and_evaluate_models(X, y, feature_names)
+    artifact_dir = save_artifacts(models, vocabulary, snapshot, model_dir, rows=len(df))
+    print(f"\n[models] Saved models for snapshot {snapshot} to {artifact_dir}")
 
     print("\n=== ML analysis complete ===")
 
 
+def score_main():
+    cfg = load_sources_config()
+    print("=== ML Scoring: low_review predictions for new stg_fashion_sales rows ===")
+    scored = score_new_rows(
+        model_name=get_source_option(cfg, {}, "ml_score_model", "log_reg"),
+        batch_size=int(get_source_option(cfg, {}, "ml_batch_size", ml_streaming.DEFAULT_BATCH_SIZE)),
+        model_dir=get_source_option(cfg, {}, "ml_model_dir", None),
+    )
+    print(f"=== Scored {scored} rows into {PREDICTIONS_TABLE} ===")
+
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Train (default) or batch-score the low_review models.")
+    parser.add_argument("command", nargs="?", choices=["train", "score"], default="train")
+    if parser.parse_args().command == "score":
+        score_main()
+    else:
+        main()
@@ -0,0 +1,295 @@
+"""
+ml_streaming.py
+
+Out-of-core version of the low_review models in ml_analysis, for silver
+tables that do not fit in memory.
+
+- Streams stg_fashion_sales in batches through a server-side cursor
+  (stream_results), never holding the whole table
+- Fixed-width sparse features per batch, no global get_dummies:
+    * log1p(purchase_amount_usd)
+    * payment_method / item_purchased one-hot, hashed into n_features columns
+- Deterministic holdout: a row is in the test set when the hash of its key
+  falls in the last test_pct percent, so every pass agrees on the split
+- Pass 1 trains an SGD logistic regression with partial_fit and fills a
+  per-class reservoir sample (stratified) for the random forest
+- Pass 2 streams again and accumulates confusion matrices for both models
+- The trained models are returned under the in-memory names ("log_reg" =
+  the SGD logistic regression, "random_forest") together with HashedFeatures
+  and a snapshot id of the streamed rows, so ml_analysis saves them in the
+  same models/<snapshot>/ layout and `score` works after either training mode
+"""
+
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.linear_model import SGDClassifier
+
+from src.db import get_engine
+
+SILVER_TABLE = "stg_fashion_sales"
+
+FEATURE_COLUMNS = [
+    "customer_reference_id",
+    "item_purchased",
+    "date_purchase",
+    "purchase_amount_usd",
+    "review_rating",
+    "payment_method",
+]
+KEY_COLUMNS = ["customer_reference_id", "item_purchased", "date_purchase"]
+CATEGORICAL_FEATURES = ["payment_method", "item_purchased"]
+
+DEFAULT_BATCH_SIZE = 50_000
+DEFAULT_HASH_FEATURES = 2 ** 10
+DEFAULT_FOREST_SAMPLE = 100_000
+CLASSES = np.array([0, 1])
+
+
+def iter_silver_batches(batch_size: int = DEFAULT_BATCH_SIZE, columns=None, engine=None):
+    """
+    Yield stg_fashion_sales in DataFrames of batch_size rows.
+    stream_results makes psycopg2 use a named (server-side) cursor, so only
+    one batch is ever held by the client.
+    """
+    engine = engine or get_engine()
+    col_list = ", ".join(columns or FEATURE_COLUMNS)
+    with engine.connect().execution_options(stream_results=True, max_row_buffer=batch_size) as conn:
+        yield from pd.read_sql(f"SELECT {col_list} FROM {SILVER_TABLE}", conn, chunksize=batch_size)
+
+
+def prepare_batch(df: pd.DataFrame) -> pd.DataFrame:
+    """Drop rows without rating / amount and add the low_review target (same as build_features_and_target)."""
+    df = df.dropna(subset=["review_rating", "purchase_amount_usd"])
+    return df.assign(low_review=(df["review_rating"] <= 2).astype(int))
+
+
+def hash_features(df: pd.DataFrame, n_features: int = DEFAULT_HASH_FEATURES) -> sp.csr_matrix:
+    """
+    Sparse feature matrix with a fixed number of columns whatever values show up:
+    column 0 = log1p(amount), columns 1.. = hashed "column=value" one-hot tokens.
+    """
+    hasher = FeatureHasher(n_features=n_features, input_type="string", alternate_sign=False)
+    tokens = zip(*(f"{col}=" + df[col].astype(str) for col in CATEGORICAL_FEATURES))
+    hashed = hasher.transform(tokens)
+    amount = np.log1p(df["purchase_amount_usd"].astype(float).clip(lower=0).to_numpy())
+    return sp.hstack([sp.csr_matrix(amount.reshape(-1, 1)), hashed], format="csr")
+
+
+class HashedFeatures:
+    """
+    Feature builder saved in place of ml_analysis.FeatureVocabulary for the
+    streamed models: hashing has no fitted state, only n_features.
+    """
+
+    def __init__(self, n_features: int = DEFAULT_HASH_FEATURES):
+        self.n_features = int(n_features)
+
+    def transform(self, df: pd.DataFrame) -> sp.csr_matrix:
+        return hash_features(df, self.n_features)
+
+    def save(self, path) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"hashed_features": self.n_features, "categories": CATEGORICAL_FEATURES}, f, indent=2)
+        return path
+
+
+class StreamSnapshot:
+    """
+    Order-independent id of rows seen batch by batch: row count + sum of
+    per-row hashes, the same id ml_analysis.data_snapshot_id gives the
+    whole frame.
+    """
+
+    def __init__(self):
+        self.columns = None
+        self.rows = 0
+        self.hash_sum = 0
+
+    def update(self, df: pd.DataFrame) -> "StreamSnapshot":
+        df = df[sorted(df.columns)]
+        self.columns = list(df.columns)
+        self.rows += len(df)
+        row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        self.hash_sum = (self.hash_sum + int(np.add.reduce(row_hashes, dtype=np.uint64))) % 2 ** 64
+        return self
+
+    def track(self, batches):
+        """Pass batches through, hashing each one on the way."""
+        for df in batches:
+            self.update(df)
+            yield df
+
+    @property
+    def id(self) -> str:
+        digest = hashlib.sha256()
+        digest.update(json.dumps([self.columns, self.rows]).encode())
+        digest.update(np.uint64(self.hash_sum).tobytes())
+        return digest.hexdigest()[:16]
+
+
+def holdout_mask(df: pd.DataFrame, test_pct: int = 25) -> np.ndarray:
+    """True for test rows: stable per key, so both passes (and reruns) split the same way."""
+    buckets = pd.util.hash_pandas_object(df[KEY_COLUMNS], index=False).to_numpy() % 100
+    return buckets >= 100 - test_pct
+
+
+class StratifiedReservoir:
+    """Uniform sample of at most per_class rows for each class, over a stream (Algorithm R)."""
+
+    def __init__(self, per_class: int, seed: int = 42):
+        self.per_class = per_class
+        self.rng = np.random.default_rng(seed)
+        self.seen = {}
+        self.rows = {}
+
+    def add(self, X: sp.csr_matrix, y: np.ndarray) -> None:
+        for label in np.unique(y):
+            X_label = X[np.flatnonzero(y == label)]
+            seen = self.seen.get(label, 0)
+            kept = self.rows.get(label)
+
+            # Fill up the reservoir first
+            room = self.per_class - (kept.shape[0] if kept is not None else 0)
+            head = X_label[:max(room, 0)]
+            kept = head if kept is None else sp.vstack([kept, head], format="csr")
+            rest = X_label[head.shape[0]:]
+
+            # Then row i of the stream replaces a random slot with probability per_class / i
+            if rest.shape[0]:
+                positions = seen + head.shape[0] + np.arange(1, rest.shape[0] + 1)
+                slots = (self.rng.random(rest.shape[0]) * positions).astype(np.int64)
+                take = np.flatnonzero(slots < self.per_class)
+                if len(take):
+                    kept = kept.tolil()
+                    for row, slot in zip(take, slots[take]):
+                        kept[slot] = rest[row]
+                    kept = kept.tocsr()
+
+            self.rows[label] = kept
+            self.seen[label] = seen + X_label.shape[0]
+
+    def sample(self):
+        """(X, y) of everything currently in the reservoirs."""
+        labels = sorted(self.rows)
+        X = sp.vstack([self.rows[label] for label in labels], format="csr")
+        y = np.concatenate([np.full(self.rows[label].shape[0], label) for label in labels])
+        return X, y
+
+
+def _report(name: str, cm: np.ndarray) -> dict:
+    """Precision / recall / f1 of the positive class from a 2x2 confusion matrix."""
+    tn, fp, fn, tp = cm.ravel()
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    accuracy = (tp + tn) / cm.sum() if cm.sum() else 0.0
+    print(f"\n=== {name} (predict low_review, streamed holdout) ===")
+    print(f"accuracy {accuracy:.3f} | low_review precision {precision:.3f} recall {recall:.3f} f1 {f1:.3f}")
+    print(cm)
+    return {"accuracy": accuracy, "precision": precision, "recall": recall, "f1": f1, "confusion": cm.tolist()}
+
+
+def _confusion(y_true: np.ndarray, y_pred: np.ndarray) -> np.ndarray:
+    return np.bincount(2 * y_true + y_pred, minlength=4).reshape(2, 2)
+
+
+def train_streaming(
+    batches,
+    n_features: int = DEFAULT_HASH_FEATURES,
+    forest_sample: int = DEFAULT_FOREST_SAMPLE,
+    test_pct: int = 25,
+):
+    """
+    Pass 1 over `batches` (an iterable of silver DataFrames).
+    Returns (sgd_model, forest_model or None, rows_trained).
+    forest_sample: rows kept for the forest (half per class); 0 disables it.
+    """
+    sgd = SGDClassifier(loss="log_loss", alpha=1e-4, random_state=42)
+    reservoir = StratifiedReservoir(forest_sample // 2) if forest_sample else None
+    trained = 0
+
+    for df in batches:
+        df = prepare_batch(df)
+        train = df[~holdout_mask(df, test_pct)]
+        if train.empty:
+            continue
+        X = hash_features(train, n_features)
+        y = train["low_review"].to_numpy()
+        sgd.partial_fit(X, y, classes=CLASSES)
+        if reservoir is not None:
+            reservoir.add(X, y)
+        trained += len(train)
+
+    if trained == 0:
+        raise ValueError("No training rows after dropping missing review_rating/purchase_amount_usd.")
+
+    forest = None
+    if reservoir is not None:
+        X_sample, y_sample = reservoir.sample()
+        forest = RandomForestClassifier(n_estimators=200, random_state=42, n_jobs=-1)
+        forest.fit(X_sample, y_sample)
+    return sgd, forest, trained
+
+
+def evaluate_streaming(models: dict, batches, n_features: int = DEFAULT_HASH_FEATURES, test_pct: int = 25) -> dict:
+    """Pass 2: confusion matrix per model over the holdout rows, one batch at a time."""
+    matrices = {name: np.zeros((2, 2), dtype=np.int64) for name in models}
+    for df in batches:
+        df = prepare_batch(df)
+        test = df[holdout_mask(df, test_pct)]
+        if test.empty:
+            continue
+        X = hash_features(test, n_features)
+        y = test["low_review"].to_numpy()
+        for name, model in models.items():
+            matrices[name] += _confusion(y, model.predict(X).astype(int))
+    return {name: _report(name, cm) for name, cm in matrices.items()}
+
+
+def stream_snapshot_id(batch_size: int = DEFAULT_BATCH_SIZE, engine=None) -> str:
+    """
+    Snapshot id of stg_fashion_sales from one streamed hashing pass (no
+    features, no models), so saved models can be reused before training.
+    """
+    snapshot = StreamSnapshot()
+    for _ in snapshot.track(iter_silver_batches(batch_size, engine=engine)):
+        pass
+    return snapshot.id
+
+
+def run_streaming_training(
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    forest_sample: int = DEFAULT_FOREST_SAMPLE,
+    n_features: int = DEFAULT_HASH_FEATURES,
+    engine=None,
+) -> dict:
+    """
+    Train + evaluate both models with two streamed passes over stg_fashion_sales.
+    Returns models (keyed like the in-memory ones), features (HashedFeatures),
+    snapshot (id of the rows of pass 1), rows (trained on) and reports.
+    """
+    snapshot = StreamSnapshot()
+    sgd, forest, trained = train_streaming(
+        snapshot.track(iter_silver_batches(batch_size, engine=engine)), n_features, forest_sample
+    )
+    print(f"[info] SGD trained on {trained} streamed rows")
+    models = {"SGD Logistic Regression": sgd}
+    if forest is not None:
+        models["Random Forest (stratified sample)"] = forest
+    reports = evaluate_streaming(models, iter_silver_batches(batch_size, engine=engine), n_features)
+    return {
+        "models": {"log_reg": sgd, **({"random_forest": forest} if forest is not None else {})},
+        "features": HashedFeatures(n_features),
+        "snapshot": snapshot.id,
+        "rows": trained,
+        "reports": reports,
+    }
@@ -0,0 +1,215 @@
+"""
+outliers.py
+
+Outlier detection on purchase_amount_usd without pulling the silver table
+into pandas (the in-memory version is ml_analysis.detect_outliers).
+
+- Statistics are computed next to the data:
+    * "zscore": mean / population std in the DB, from centered sums (a
+      per-group mean, then AVG((x - mean)^2)) so it stays exact for large,
+      tightly clustered amounts
+    * "running": the same mean / std from the running stats table the ETL
+      keeps (running_stats.py), O(groups) instead of O(rows)
+    * "robust": median / MAD from the mergeable quantile sketches the ETL
+      keeps per item / month (running_stats.py, sketch.py): O(groups) reads,
+      no scan of the silver table
+- Optional grouping: per item ("item") or per purchase month ("month")
+- Only the flagged rows come back: the per-group [lo, hi] bounds go to the DB
+  as a small VALUES list and the WHERE clause does the filtering
+"""
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from src.db import get_engine
+from src.running_stats import NULL_GROUP, sketch_table_for, stats_table_for
+from src.sketch import QuantileSketch
+
+SILVER_TABLE = "stg_fashion_sales"
+AMOUNT_COL = "purchase_amount_usd"
+
+STATS_TABLE = stats_table_for(SILVER_TABLE)
+SKETCH_TABLE = sketch_table_for(SILVER_TABLE)
+
+OUTLIER_METHODS = ("zscore", "robust", "running")
+
+# Group key as a SQL expression on table alias {t} / its date column {d};
+# CAST + substr works on PostgreSQL and SQLite. The ungrouped case selects a
+# literal label and has no GROUP BY (PostgreSQL rejects GROUP BY 'all')
+GROUP_EXPRESSIONS = {
+    None: "'all'",
+    "item": "{t}.item_purchased",
+    "month": "substr(CAST({t}.{d} AS TEXT), 1, 7)",
+}
+
+OUTLIER_COLUMNS = [
+    "customer_reference_id",
+    "item_purchased",
+    "date_purchase",
+    "purchase_amount_usd",
+    "review_rating",
+    "payment_method",
+]
+
+# MAD * 1.4826 estimates the std of normal data, so robust z-scores read like plain ones
+MAD_TO_STD = 1.4826
+
+
+def _group_expr(group_by, alias: str = "s", date_col: str = "date_purchase") -> str:
+    if group_by not in GROUP_EXPRESSIONS:
+        raise ValueError(f"Unknown outlier group_by {group_by!r}; expected one of {list(GROUP_EXPRESSIONS)}")
+    return GROUP_EXPRESSIONS[group_by].format(t=alias, d=date_col)
+
+
+def _group_by_clause(group_by, group: str) -> str:
+    """GROUP BY on the group expression; empty for the whole table (one aggregate row)."""
+    return "" if group_by is None else f"GROUP BY {group}"
+
+
+def _moments_to_stats(grp, n, total, total_sq) -> pd.DataFrame:
+    """center / scale (mean / population std) from count, sum and sum of squares."""
+    mean = total / n
+    variance = (total_sq / n - mean ** 2).clip(lower=0)
+    return pd.DataFrame({"grp": grp, "n": n, "center": mean, "scale": np.sqrt(variance)})
+
+
+def zscore_stats(engine, group_by=None) -> pd.DataFrame:
+    """
+    Per-group row count, mean and population std of the amount, aggregated in the DB.
+    The variance is AVG((x - mean)^2) around the per-group mean of a first
+    pass, not AVG(x^2) - AVG(x)^2, which cancels to noise (or below zero) for
+    large, tightly clustered amounts; plain SQL, so PostgreSQL and SQLite alike.
+    """
+    group = _group_expr(group_by)
+    query = f"""
+        WITH m AS (
+            SELECT {group} AS grp, COUNT(s.{AMOUNT_COL}) AS n, AVG(s.{AMOUNT_COL}) AS mean
+            FROM {SILVER_TABLE} s
+            WHERE s.{AMOUNT_COL} IS NOT NULL
+            {_group_by_clause(group_by, group)}
+        )
+        SELECT m.grp, m.n, m.mean,
+               AVG((s.{AMOUNT_COL} - m.mean) * (s.{AMOUNT_COL} - m.mean)) AS variance
+        FROM {SILVER_TABLE} s
+        JOIN m ON {group} = m.grp
+        WHERE s.{AMOUNT_COL} IS NOT NULL
+        GROUP BY m.grp, m.n, m.mean
+    """
+    stats = pd.read_sql(text(query), engine)
+    # population variance (ddof=0, like detect_outliers)
+    scale = np.sqrt(stats["variance"].clip(lower=0))
+    return pd.DataFrame({"grp": stats["grp"], "n": stats["n"], "center": stats["mean"], "scale": scale})
+
+
+def running_zscore_stats(engine, group_by=None) -> pd.DataFrame:
+    """
+    Same as zscore_stats, summed from the running stats table (one row per
+    item / payment / day). Only count / sum / sum of squares are stored, so
+    the variance is the E[x^2] - E[x]^2 form: use "zscore" when amounts are
+    large and tightly clustered.
+    """
+    group = _group_expr(group_by, alias="r", date_col="purchase_day")
+    # HAVING needs a GROUP BY on older SQLite: filter empty groups outside instead
+    query = f"""
+        SELECT grp, n, total, total_sq FROM (
+            SELECT {group} AS grp, SUM(r.amount_count) AS n,
+                   SUM(r.amount_sum) AS total, SUM(r.amount_sumsq) AS total_sq
+            FROM {STATS_TABLE} r
+            {_group_by_clause(group_by, group)}
+        ) g
+        WHERE n > 0
+    """
+    stats = pd.read_sql(text(query), engine)
+    return _moments_to_stats(stats["grp"], stats["n"], stats["total"], stats["total_sq"])
+
+
+def robust_stats(engine, group_by=None) -> pd.DataFrame:
+    """
+    Per-group approximate median and MAD (scaled to a std estimate), merged
+    from the per-(item, month) amount sketches the load keeps up to date.
+    Reads one row per item / month, never the silver table. Amounts replaced
+    by later loads still count until running_stats.rebuild_running_stats().
+    """
+    _group_expr(group_by)  # validates group_by
+    stored = pd.read_sql(text(f"SELECT item_purchased, purchase_month, sketch FROM {SKETCH_TABLE}"), engine)
+
+    sketches = {}
+    for row in stored.itertuples(index=False):
+        if group_by is None:
+            grp = "all"
+        elif group_by == "item":
+            if row.item_purchased == NULL_GROUP:
+                continue  # NULL items belong to no item group
+            grp = row.item_purchased
+        else:
+            grp = row.purchase_month
+        sketch = QuantileSketch.from_json(row.sketch)
+        sketches[grp] = sketches[grp].merge(sketch) if grp in sketches else sketch
+
+    rows = []
+    for grp, sketch in sketches.items():
+        if not sketch.n:
+            continue
+        median, mad = sketch.median_mad()
+        rows.append({"grp": grp, "n": sketch.n, "center": median, "scale": mad * MAD_TO_STD})
+    return pd.DataFrame(rows, columns=["grp", "n", "center", "scale"])
+
+
+def fetch_flagged_rows(engine, bounds: pd.DataFrame, group_by=None) -> pd.DataFrame:
+    """
+    Rows whose amount falls outside their group's [lo, hi], filtered in the DB.
+    bounds: one row per group with grp / center / scale / lo / hi.
+    """
+    if bounds.empty:
+        return pd.DataFrame(columns=OUTLIER_COLUMNS + ["outlier_group", "z_score"])
+
+    values, params = [], {}
+    for i, row in enumerate(bounds.itertuples(index=False)):
+        values.append(f"(:g{i}, :c{i}, :s{i}, :lo{i}, :hi{i})")
+        params.update({f"g{i}": row.grp, f"c{i}": row.center, f"s{i}": row.scale, f"lo{i}": row.lo, f"hi{i}": row.hi})
+
+    col_list = ", ".join(f"s.{c}" for c in OUTLIER_COLUMNS)
+    query = f"""
+        WITH bounds (grp, center, scale, lo, hi) AS (VALUES {", ".join(values)})
+        SELECT {col_list}, b.grp AS outlier_group, b.center, b.scale
+        FROM {SILVER_TABLE} s
+        JOIN bounds b ON {_group_expr(group_by)} = b.grp
+        WHERE s.{AMOUNT_COL} < b.lo OR s.{AMOUNT_COL} > b.hi
+    """
+    flagged = pd.read_sql(text(query), engine, params=params)
+    flagged["z_score"] = (flagged[AMOUNT_COL].astype(float) - flagged["center"]) / flagged["scale"]
+    return flagged.drop(columns=["center", "scale"])
+
+
+def detect_outliers_sql(
+    z_thresh: float = 3.0,
+    method: str = "zscore",
+    group_by=None,
+    engine=None,
+) -> pd.DataFrame:
+    """
+    Same result shape as ml_analysis.detect_outliers (flagged rows + z_score,
+    largest |z| first) plus outlier_group, without loading the table.
+    - method: "zscore" (mean / std in SQL), "running" (mean / std from the
+      running stats table) or "robust" (median / MAD from the stored sketches)
+    - group_by: None (whole table), "item" or "month"
+    """
+    if method not in OUTLIER_METHODS:
+        raise ValueError(f"Unknown outlier method {method!r}; expected one of {OUTLIER_METHODS}")
+    engine = engine or get_engine()
+
+    if method == "zscore":
+        stats = zscore_stats(engine, group_by)
+    elif method == "running":
+        stats = running_zscore_stats(engine, group_by)
+    else:
+        stats = robust_stats(engine, group_by)
+
+    # groups without spread cannot have outliers (same rule as detect_outliers)
+    bounds = stats[stats["scale"] > 0].assign(
+        lo=lambda b: b["center"] - z_thresh * b["scale"],
+        hi=lambda b: b["center"] + z_thresh * b["scale"],
+    )
+    flagged = fetch_flagged_rows(engine, bounds, group_by)
+    return flagged.sort_values("z_score", key=lambda s: s.abs(), ascending=False).reset_index(drop=True)
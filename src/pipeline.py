@@ -0,0 +1,79 @@
+"""
+pipeline.py
+
+Fused validate + clean stage for one chunk.
+
+Same results as running apply_schema_casts -> apply_business_rules ->
+clean_fashion_sales one after the other, but:
+  - the chunk is cast in place (the caller hands it over; no df.copy())
+  - rules are evaluated as masks on the cast chunk, never on a copy
+  - the valid rows are materialized ONCE (a single take); only the reject
+    frames are extra, and they are usually tiny
+  - normalization runs in place on that one copy, each string column stripped once
+  - the original row index is kept (no reset_index) so rows can still be
+    traced back to their position in the source file (and it doubles as the
+    sequence number for cross-chunk dedup)
+"""
+
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+
+from src.clean import normalize_columns, drop_duplicate_sales
+from src.rules import failed_rule_labels
+from src.validate import cast_columns, business_rule_failures
+
+
+def _stage(metrics, name: str, rows: int = 0):
+    return metrics.stage(name, rows=rows) if metrics is not None else nullcontext()
+
+
+def transform_chunk(
+    df: pd.DataFrame,
+    schema: dict,
+    rules=None,
+    rule_counts: dict | None = None,
+    metrics=None,
+    key_index=None,
+    format_cache: dict | None = None,
+):
+    """
+    Cast, validate and clean one chunk in a single pass.
+
+    NOTE: df is modified in place (its schema columns are cast); pass a copy
+    if the caller still needs the raw values.
+    metrics: optional RunMetrics; times the "cast", "rules" and "clean" stages.
+    key_index: optional dedup.KeyIndex shared by the chunks of one file so the
+    last row of a business key wins across chunks, not just inside this one.
+    format_cache: optional dict shared by the chunks of one file for the
+    guessed datetime formats (see validate.parse_datetimes).
+
+    Returns (clean_df, cast_reject_df, rule_reject_df):
+      - clean_df: valid, normalized and deduplicated rows ready for load
+      - cast_reject_df: rows where a non-string column failed casting
+      - rule_reject_df: cast-valid rows that broke a business rule
+        (with a `failed_rules` column)
+    """
+    with _stage(metrics, "cast", rows=len(df)):
+        cast_bad = cast_columns(df, schema, format_cache=format_cache)
+
+    with _stage(metrics, "rules", rows=len(df)):
+        fail_matrix, rules_used = business_rule_failures(
+            df, rules, counts=rule_counts, skip_mask=cast_bad
+        )
+        rule_bad = fail_matrix.any(axis=1)
+
+        cast_reject_df = df.take(np.flatnonzero(cast_bad))
+        rule_reject_df = df.take(np.flatnonzero(rule_bad))
+        rule_reject_df["failed_rules"] = failed_rule_labels(fail_matrix[rule_bad], rules_used)
+
+    with _stage(metrics, "clean") as rec:
+        # The one materialized copy: rows that passed both casting and rules
+        clean_df = df.take(np.flatnonzero(~(cast_bad | rule_bad)))
+        normalize_columns(clean_df)
+        clean_df = drop_duplicate_sales(clean_df, key_index=key_index)
+        if metrics is not None:
+            rec["rows"] += len(clean_df)
+
+    return clean_df, cast_reject_df, rule_reject_df
@@ -1,15 +1,405 @@
+import io
+import mmap
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+
 import pandas as pd
 
-def read_csv(path: str):
+
+def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Strip whitespace and lowercase column names (in place)."""
+    df.columns = [c.strip().lower() for c in df.columns]  #for each c normalize and add it to col arr
+    return df
+
+
+# File suffix -> compression; these are decompressed on the fly while parsing
+# (gzip is built in, .zst needs the optional `zstandard` package)
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+
+
+def compression_of(path) -> str | None:
+    """"gzip" / "zstd" for .csv.gz / .csv.zst paths, None for plain files."""
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(str(path))[1].lower())
+
+
+@contextmanager
+def _csv_input(path: str, start_offset: int = 0, memory_map: bool = False):
+    """
+    Yield (source, read_csv kwargs) for pandas.
+    With start_offset > 0 the file is opened and positioned at that byte
+    (must be the start of a line); the header is still taken from line 1.
+    memory_map: parse straight from an mmap of the file (pages come from the
+    page cache, no extra buffered copy of the file in the process).
+    Compressed files are streamed through the decompressor and cannot be
+    resumed at a byte offset.
+    """
+    if compression_of(path):
+        if start_offset:
+            raise ValueError(f"Cannot resume compressed file {path} at byte offset {start_offset}")
+        yield path, {"compression": compression_of(path)}
+        return
+
+    if not start_offset:
+        yield path, {"memory_map": True} if memory_map else {}
+        return
+
+    with open(path, "rb") as f:
+        header = pd.read_csv(io.BytesIO(f.readline()), nrows=0).columns.tolist()
+        if memory_map:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                mapped.seek(start_offset)
+                yield mapped, {"header": None, "names": header}
+            return
+        f.seek(start_offset)
+        yield f, {"header": None, "names": header}
+
+
+def _usecols(columns):
+    """read_csv usecols that keeps only the wanted (normalized) column names."""
+    if not columns:
+        return None
+    wanted = set(columns)
+    return lambda c: c.strip().lower() in wanted
+
+
+def _to_pandas(table, dtype_backend: str | None, row_offset: int = 0) -> pd.DataFrame:
+    """Arrow table -> normalized DataFrame (ArrowDtype columns when dtype_backend='pyarrow')."""
+    if dtype_backend == "pyarrow":
+        df = table.to_pandas(types_mapper=pd.ArrowDtype)
+    else:
+        df = table.to_pandas()
+    df.index = pd.RangeIndex(row_offset, row_offset + len(df))
+    return _normalize_columns(df)
+
+
+def _rebatch(batches, chunksize: int):
+    """Regroup Arrow record batches (any sizes) into tables of exactly chunksize rows (last may be smaller)."""
+    import pyarrow as pa
+
+    pending, pending_rows = [], 0
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= chunksize:
+            table = pa.Table.from_batches(pending)
+            yield table.slice(0, chunksize)
+            rest = table.slice(chunksize)
+            pending, pending_rows = rest.to_batches(), rest.num_rows
+    if pending_rows:
+        yield pa.Table.from_batches(pending)
+
+
+def _arrow_header(path) -> list:
+    """Raw header names of a CSV file (no rows parsed)."""
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
+
+def _arrow_csv_chunks(src, chunksize: int, names, columns, dtype_backend, memory_map: bool = False):
+    """
+    Streaming CSV read with pyarrow's multithreaded parser, re-cut into
+    chunksize rows. Columns come back as strings; typing is cast_columns' job.
+    """
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+
+    read_options = pa_csv.ReadOptions(column_names=names) if names else pa_csv.ReadOptions()
+    header = names or _arrow_header(src)
+    if columns:
+        wanted = set(columns)
+        header = [c for c in header if c.strip().lower() in wanted]
+    # Everything stays a string: the streaming reader would otherwise infer
+    # types from the first block and abort on a bad value further down,
+    # instead of leaving it to cast_columns (-> type-cast rejects)
+    convert_options = pa_csv.ConvertOptions(
+        include_columns=header if columns else None,
+        column_types={c: pa.string() for c in header},
+        strings_can_be_null=True,  # "" / NA / null -> missing, like pandas
+    )
+
+    mapped = None
+    if memory_map and isinstance(src, str):
+        src = mapped = pa.memory_map(src)  # zero-copy: Arrow parses the mapped pages directly
+
+    row_offset = 0
+    try:
+        with pa_csv.open_csv(src, read_options=read_options, convert_options=convert_options) as reader:
+            for table in _rebatch(reader, chunksize):
+                yield _to_pandas(table, dtype_backend, row_offset)
+                row_offset += table.num_rows
+    finally:
+        if mapped is not None:
+            mapped.close()
+
+
+def read_csv(
+    path: str,
+    start_offset: int = 0,
+    columns=None,
+    engine: str | None = None,
+    dtype_backend: str | None = None,
+    memory_map: bool = False,
+):
     """
     Basic CSV reader: 
     - loads CSV into a pandas DataFrame -=
     - strips the col names from whitespaces
     - we want to lowercase all of the values
+    - columns: only read these (normalized) columns, e.g. the schema keys
+    - engine / dtype_backend: "pyarrow" for the multithreaded parser and
+      Arrow-backed dtypes (string[pyarrow] instead of Python objects)
+    - memory_map: parse from an mmap of the file (plain files only)
+    - .csv.gz / .csv.zst paths are decompressed while parsing
     """
-    df = pd.read_csv(path) #dataframe 
+    with _csv_input(path, start_offset, memory_map and engine != "pyarrow") as (src, kwargs):
+        if engine == "pyarrow" and columns:
+            # pyarrow engine wants an explicit column list, not a callable
+            wanted = set(columns)
+            header = kwargs.get("names") or _arrow_header(path)
+            kwargs["usecols"] = [c for c in header if c.strip().lower() in wanted]
+        else:
+            kwargs["usecols"] = _usecols(columns)
+        if dtype_backend:
+            kwargs["dtype_backend"] = dtype_backend
+        df = pd.read_csv(src, engine=engine, **kwargs) #dataframe 
     
     # After loading the CSV we normalize by lowercase, stip spacing, remove special chars
-    df.columns = [c.strip().lower() for c in df.columns]  #for each c normalize and add it to col arr
-    
-    return df
+    return _normalize_columns(df)
+
+
+def read_csv_chunks(
+    path: str,
+    chunksize: int,
+    start_offset: int = 0,
+    columns=None,
+    engine: str | None = None,
+    dtype_backend: str | None = None,
+    memory_map: bool = False,
+):
+    """
+    Streaming CSV reader:
+    - yields DataFrames of at most `chunksize` rows so memory stays bounded
+      no matter how big the file is
+    - applies the same column normalization as read_csv to every chunk
+    - chunk indexes keep counting across chunks (row 0..n of the whole file)
+    - start_offset: byte offset of the first line to read (incremental appends)
+    - columns / engine / dtype_backend / memory_map: same as read_csv
+    """
+    with _csv_input(path, start_offset, memory_map and engine != "pyarrow") as (src, kwargs):
+        if engine == "pyarrow":
+            # pandas' pyarrow engine cannot chunk, so stream with pyarrow.csv directly
+            yield from _arrow_csv_chunks(
+                src, chunksize, kwargs.get("names"), columns, dtype_backend,
+                memory_map=memory_map and not compression_of(path),
+            )
+            return
+
+        if dtype_backend:
+            kwargs["dtype_backend"] = dtype_backend
+        with pd.read_csv(src, chunksize=chunksize, usecols=_usecols(columns), **kwargs) as chunks:
+            for chunk in chunks:
+                yield _normalize_columns(chunk)
+
+
+# Bytes sampled from the top of the file to estimate the average row size
+ROW_SIZE_SAMPLE_BYTES = 64 * 1024
+
+
+def _line_start_after(f, offset: int) -> int:
+    """First byte offset >= offset that starts a line (EOF if there is none)."""
+    if offset == 0:
+        return 0
+    f.seek(offset - 1)
+    f.readline()  # finish the line `offset` falls in
+    return f.tell()
+
+
+def split_byte_ranges(path: str, range_bytes: int, start_offset: int = 0) -> list[tuple[int, int]]:
+    """
+    Cut the data part of a CSV (after the header, or from start_offset) into
+    (start, end) byte ranges of about range_bytes, every boundary moved to
+    the start of a line so no row is split.
+    Assumes no quoted field contains a newline (true for our flat files).
+    """
+    with open(path, "rb") as f:
+        size = f.seek(0, io.SEEK_END)
+        if not start_offset:
+            f.seek(0)
+            f.readline()  # header
+            start_offset = f.tell()
+
+        bounds = [start_offset]
+        target = start_offset + max(int(range_bytes), 1)
+        while target < size:
+            line_start = _line_start_after(f, target)
+            if line_start >= size:
+                break
+            if line_start > bounds[-1]:
+                bounds.append(line_start)
+            target = line_start + max(int(range_bytes), 1)
+        bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def _estimate_row_bytes(path: str, start_offset: int) -> float:
+    """Average bytes per line over the first ROW_SIZE_SAMPLE_BYTES of data."""
+    with open(path, "rb") as f:
+        f.seek(start_offset)
+        sample = f.read(ROW_SIZE_SAMPLE_BYTES)
+    lines = sample.count(b"\n")
+    return len(sample) / lines if lines else max(len(sample), 1)
+
+
+class _MappedRange(io.RawIOBase):
+    """Read-only file object over bytes [start, end) of an mmap (no copy of the range)."""
+
+    def __init__(self, mapped, start: int, end: int):
+        self._view = memoryview(mapped)[start:end]
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = min(len(buffer), len(self._view) - self._pos)
+        buffer[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+def _parse_byte_range(path, start, end, names, usecols, engine, dtype_backend, memory_map=True) -> pd.DataFrame:
+    """Worker: parse one newline-aligned byte range (top-level so the process pool can pickle it)."""
+    kwargs = {"header": None, "names": names, "usecols": usecols, "engine": engine}
+    if dtype_backend:
+        kwargs["dtype_backend"] = dtype_backend
+    with open(path, "rb") as f:
+        if not memory_map:
+            f.seek(start)
+            return _normalize_columns(pd.read_csv(io.BytesIO(f.read(end - start)), **kwargs))
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with io.BufferedReader(_MappedRange(mapped, start, end)) as src:
+                df = pd.read_csv(src, **kwargs)
+    return _normalize_columns(df)
+
+
+def read_csv_parallel(
+    path: str,
+    chunksize: int,
+    start_offset: int = 0,
+    columns=None,
+    engine: str | None = None,
+    dtype_backend: str | None = None,
+    workers: int | None = None,
+    ordered: bool = True,
+    memory_map: bool = False,
+):
+    """
+    Multi-core CSV reader:
+    - splits the file into newline-aligned byte ranges of about `chunksize` rows
+      (row size estimated from a sample) and parses them in a process pool
+    - at most 2 ranges per worker are in flight, so memory stays bounded
+    - ordered=True: chunks come out in file order and the index is the row
+      number, exactly like read_csv_chunks
+    - ordered=False: chunks come out as soon as they are parsed; the index is
+      the range's start byte + row position, unique and increasing through the
+      file, so sequence-based dedup (dedup.KeyIndex) still lets the last row win
+    - columns / engine / dtype_backend / start_offset: same as read_csv_chunks
+    - memory_map: each worker parses its range straight from an mmap of the
+      file instead of reading it into a bytes copy first
+    - compressed files cannot be split; they fall back to read_csv_chunks
+    """
+    if compression_of(path):
+        yield from read_csv_chunks(
+            path, chunksize, start_offset=start_offset, columns=columns,
+            engine=engine, dtype_backend=dtype_backend, memory_map=memory_map,
+        )
+        return
+
+    names = _arrow_header(path)
+    usecols = None
+    if columns:
+        wanted = set(columns)
+        usecols = [c for c in names if c.strip().lower() in wanted]
+
+    with open(path, "rb") as f:
+        data_start = start_offset or len(f.readline())
+    row_bytes = _estimate_row_bytes(path, data_start)
+    ranges = split_byte_ranges(path, int(chunksize * row_bytes), data_start)
+    if not ranges:
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        next_range = 0
+        row_offset = 0
+        while pending or next_range < len(ranges):
+            # Keep the pool busy without parsing the whole file ahead of the consumer
+            while next_range < len(ranges) and len(pending) < 2 * workers:
+                start, end = ranges[next_range]
+                future = pool.submit(
+                    _parse_byte_range, path, start, end, names, usecols, engine, dtype_backend, memory_map
+                )
+                pending.append((start, future))
+                next_range += 1
+
+            if ordered:
+                start, future = pending.popleft()
+                df = future.result()
+                df.index = pd.RangeIndex(row_offset, row_offset + len(df))
+                row_offset += len(df)
+                yield df
+                continue
+
+            done, _ = wait([future for _, future in pending], return_when=FIRST_COMPLETED)
+            for start, future in [item for item in pending if item[1] in done]:
+                pending.remove((start, future))
+                df = future.result()
+                df.index = pd.RangeIndex(start, start + len(df))
+                yield df
+
+
+def _parquet_projection(parquet_file, columns):
+    """Physical column names whose normalized form is wanted (None = all)."""
+    if not columns:
+        return None
+    wanted = set(columns)
+    return [c for c in parquet_file.schema_arrow.names if c.strip().lower() in wanted]
+
+
+def read_parquet(path: str, columns=None, dtype_backend: str | None = None) -> pd.DataFrame:
+    """
+    Parquet reader: whole file, only the wanted (normalized) columns are decoded.
+    """
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(path)
+    table = parquet_file.read(columns=_parquet_projection(parquet_file, columns))
+    return _to_pandas(table, dtype_backend)
+
+
+def read_parquet_chunks(path: str, chunksize: int, columns=None, dtype_backend: str | None = None):
+    """
+    Streaming Parquet reader:
+    - reads record batches and yields chunks of `chunksize` rows
+    - only the columns whose normalized name is wanted are decoded (column projection)
+    - same column normalization / running index as read_csv_chunks
+    """
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(path)
+    batches = parquet_file.iter_batches(
+        batch_size=chunksize, columns=_parquet_projection(parquet_file, columns)
+    )
+
+    row_offset = 0
+    for table in _rebatch(batches, chunksize):
+        yield _to_pandas(table, dtype_backend, row_offset)
+        row_offset += table.num_rows
@@ -0,0 +1,205 @@
+"""
+rules.py
+
+Compiles the SQL-ish `rules:` from sources.yml into vectorized row checks.
+
+Supported rule shapes (keywords are case-insensitive):
+    <col> >= | > | <= | < | = | != | <> <literal>
+    <col> [NOT] BETWEEN <low> AND <high>
+    <col> [NOT] IN ('a', 'b', ...)
+    <col> IS [NOT] NULL
+    <col> IS [NOT] BLANK            (blank = NULL or only whitespace)
+
+NULL handling follows the checks we used to hardcode in validate.py:
+  - comparisons / BETWEEN let NULL through (e.g. a missing review rating is fine)
+  - IN treats NULL as "not in the list" (a missing payment method is rejected)
+
+A rule on a column the DataFrame does not have is skipped.
+"""
+
+import operator
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# text = rule as written in sources.yml, fails(df) -> bool ndarray (True = row breaks the rule)
+Rule = namedtuple("Rule", ["text", "column", "fails"])
+
+# Separator used in the `failed_rules` column of rejected rows
+FAILED_RULES_SEP = "; "
+
+_COMPARE_OPS = {
+    ">=": operator.ge,
+    ">": operator.gt,
+    "<=": operator.le,
+    "<": operator.lt,
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<>": operator.ne,
+}
+
+_IS_RE = re.compile(r"^(?P<col>.+?)\s+IS\s+(?P<neg>NOT\s+)?(?P<what>NULL|BLANK)$", re.IGNORECASE)
+_IN_RE = re.compile(r"^(?P<col>.+?)\s+(?P<neg>NOT\s+)?IN\s*\((?P<values>.*)\)$", re.IGNORECASE)
+_BETWEEN_RE = re.compile(
+    r"^(?P<col>.+?)\s+(?P<neg>NOT\s+)?BETWEEN\s+(?P<low>\S+)\s+AND\s+(?P<high>\S+)$",
+    re.IGNORECASE,
+)
+_COMPARE_RE = re.compile(r"^(?P<col>.+?)\s*(?P<op>>=|<=|<>|!=|=|<|>)\s*(?P<value>.+)$")
+_LIST_ITEM_RE = re.compile(r"'((?:[^']|'')*)'|([^,\s]+)")
+
+
+def _parse_literal(token: str):
+    """'Cash' -> "Cash", 5 -> 5.0, NULL -> None"""
+    token = token.strip()
+    if len(token) >= 2 and token[0] == token[-1] == "'":
+        return token[1:-1].replace("''", "'")
+    if token.upper() == "NULL":
+        return None
+    try:
+        return float(token)
+    except ValueError:
+        raise ValueError(f"Cannot parse rule literal {token!r} (quote strings with '...')")
+
+
+def _parse_list(values: str) -> list:
+    """'Cash', 'Credit Card' -> ["Cash", "Credit Card"] (commas inside quotes are fine)"""
+    return [
+        m.group(1).replace("''", "'") if m.group(1) is not None else _parse_literal(m.group(2))
+        for m in _LIST_ITEM_RE.finditer(values)
+    ]
+
+
+def _coerce_literal(series: pd.Series, value):
+    """Make a literal comparable with the column (e.g. '2023-01-01' vs a datetime column)."""
+    if isinstance(value, str) and pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return pd.Timestamp(value)
+    return value
+
+
+def _is_categorical(series: pd.Series) -> bool:
+    return isinstance(series.dtype, pd.CategoricalDtype)
+
+
+def _per_category(series: pd.Series, category_mask: np.ndarray, missing_value: bool) -> np.ndarray:
+    """
+    Spread a result computed once per category to every row through the codes.
+    Rows with a missing value (code -1) get `missing_value`.
+    """
+    codes = series.cat.codes.to_numpy()
+    lookup = np.append(np.asarray(category_mask, dtype=bool), missing_value)
+    return lookup[codes]   # code -1 picks the appended missing_value
+
+
+def _to_bool(mask) -> np.ndarray:
+    """Boolean Series (numpy or nullable) -> plain bool ndarray, NA counted as False."""
+    return np.asarray(mask.to_numpy(dtype=bool, na_value=False), dtype=bool)
+
+
+def _compile_one(text: str) -> Rule:
+    expr = text.strip()
+
+    m = _IS_RE.match(expr)
+    if m:
+        col, negate, what = m["col"].strip().lower(), bool(m["neg"]), m["what"].upper()
+
+        def fails(df):
+            series = df[col]
+            if _is_categorical(series):
+                # check each distinct value once, not every row
+                blank = np.zeros(len(series.cat.categories), dtype=bool)
+                if what == "BLANK":
+                    blank = _to_bool(pd.Series(series.cat.categories).astype("string").str.strip() == "")
+                missing = _per_category(series, blank, missing_value=True)
+                return missing if negate else ~missing
+
+            missing = series.isna()
+            if what == "BLANK":
+                missing = missing | (series.astype("string").str.strip() == "")
+            # IS NOT NULL fails on missing values, IS NULL fails on present ones
+            return _to_bool(missing) if negate else ~_to_bool(missing)
+
+        return Rule(text, col, fails)
+
+    m = _IN_RE.match(expr)
+    if m:
+        col, negate, allowed = m["col"].strip().lower(), bool(m["neg"]), _parse_list(m["values"])
+
+        def fails(df):
+            series = df[col]
+            if _is_categorical(series):
+                # isin on the category dictionary, then lookup by code
+                allowed_cats = _to_bool(pd.Series(series.cat.categories).isin(allowed))
+                inside = _per_category(series, allowed_cats, missing_value=False)
+            else:
+                inside = _to_bool(series.isin(allowed))
+            return inside if negate else ~inside
+
+        return Rule(text, col, fails)
+
+    m = _BETWEEN_RE.match(expr)
+    if m:
+        col, negate = m["col"].strip().lower(), bool(m["neg"])
+        low, high = _parse_literal(m["low"]), _parse_literal(m["high"])
+
+        def fails(df):
+            series = df[col]
+            lo, hi = _coerce_literal(series, low), _coerce_literal(series, high)
+            inside = _to_bool((series >= lo) & (series <= hi))
+            present = _to_bool(series.notna())
+            return present & (inside if negate else ~inside)
+
+        return Rule(text, col, fails)
+
+    m = _COMPARE_RE.match(expr)
+    if m:
+        col, op, value = m["col"].strip().lower(), _COMPARE_OPS[m["op"]], _parse_literal(m["value"])
+
+        def fails(df):
+            series = df[col]
+            ok = _to_bool(op(series, _coerce_literal(series, value)))
+            present = _to_bool(series.notna())
+            return present & ~ok
+
+        return Rule(text, col, fails)
+
+    raise ValueError(f"Unsupported rule expression: {text!r}")
+
+
+@lru_cache(maxsize=64)
+def _compile_cached(texts: tuple) -> tuple:
+    return tuple(_compile_one(t) for t in texts)
+
+
+def compile_rules(rules) -> tuple:
+    """
+    Compile rules once (cached by their text).
+    `rules` is the sources.yml list: either plain strings or {"rule": "..."} entries.
+    """
+    texts = tuple(r["rule"] if isinstance(r, dict) else r for r in (rules or []))
+    return _compile_cached(texts)
+
+
+def evaluate_rules(df: pd.DataFrame, compiled) -> tuple[np.ndarray, list]:
+    """
+    Run every applicable rule over df.
+    Returns (fail_matrix, rules_used):
+      - fail_matrix: bool array shaped (rows, rules), True = row breaks that rule
+      - rules_used: the rules whose column exists in df (matrix column order)
+    """
+    rules_used = [r for r in compiled if r.column in df.columns]
+    fail_matrix = np.zeros((len(df), len(rules_used)), dtype=bool)
+    for j, rule in enumerate(rules_used):
+        fail_matrix[:, j] = rule.fails(df)
+    return fail_matrix, rules_used
+
+
+def failed_rule_labels(fail_matrix: np.ndarray, rules_used: list) -> np.ndarray:
+    """Per row: the texts of every rule it failed, joined with FAILED_RULES_SEP."""
+    labels = np.full(len(fail_matrix), "", dtype=object)
+    for j, rule in enumerate(rules_used):
+        hit = fail_matrix[:, j]
+        labels[hit] = np.where(labels[hit] == "", rule.text, labels[hit] + FAILED_RULES_SEP + rule.text)
+    return labels
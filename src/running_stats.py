@@ -0,0 +1,416 @@
+"""
+running_stats.py
+
+Running summary of stg_fashion_sales, kept up to date by the load stage so
+downstream aggregates read O(groups) rows instead of O(rows).
+
+Table <target>_stats, one row per (item_purchased, payment_method, purchase_day):
+
+    row_count, amount_count, amount_sum, amount_sumsq, amount_min, amount_max,
+    rating_count, rating_sum, rating_0 .. rating_5 (histogram of floor(rating))
+
+- Every column but min / max is additive, so a batch is applied as a delta:
+  + aggregates of the incoming rows, - aggregates of the stored versions of
+  the same keys (read BEFORE the upsert, in the same transaction)
+- Rows identical to what is stored are left out of the delta (no-op updates)
+- min / max can only be widened incrementally (an update that lowers the max
+  cannot be subtracted); rebuild_running_stats() recomputes everything from
+  the table when exact extremes matter
+- Keys that are NULL in the data are stored as "" (they are part of the PK)
+
+Table <target>_amount_sketch, one row per (item_purchased, purchase_month):
+a QuantileSketch (sketch.py) of purchase_amount_usd, as JSON text.
+
+- Each batch's new / changed amounts are sketched and merged into the
+  stored rows (locked with FOR UPDATE, so parallel loads queue per group);
+  outliers.robust_stats() merges these instead of scanning the table
+- Like min / max, a replaced amount cannot be taken out of a sketch; the
+  old value keeps its weight until rebuild_running_stats()
+"""
+
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+from sqlalchemy import text
+
+from src.db import get_engine
+from src.logs.logging_config import get_logger
+from src.sketch import DEFAULT_SKETCH_K, QuantileSketch
+
+logger = get_logger(__name__)
+
+KEY_COLS = ["customer_reference_id", "item_purchased", "date_purchase"]
+GROUP_COLS = ["item_purchased", "payment_method", "purchase_day"]
+VALUE_COLS = ["purchase_amount_usd", "review_rating", "payment_method"]
+RATING_BUCKETS = range(6)
+
+ADDITIVE_COLS = [
+    "row_count",
+    "amount_count",
+    "amount_sum",
+    "amount_sumsq",
+    "rating_count",
+    "rating_sum",
+    *(f"rating_{b}" for b in RATING_BUCKETS),
+]
+STATS_COLS = GROUP_COLS + ADDITIVE_COLS + ["amount_min", "amount_max"]
+
+NULL_GROUP = ""
+
+# Keys / stats rows per statement when the caller does not pass its batch_size
+DEFAULT_PAGE_SIZE = 1000
+
+_ensured = set()
+_ensure_lock = threading.Lock()
+
+
+def stats_table_for(table_name: str) -> str:
+    return f"{table_name}_stats"
+
+
+def stats_ddl(table_name: str) -> str:
+    rating_cols = "".join(f"    rating_{b} BIGINT NOT NULL DEFAULT 0,\n" for b in RATING_BUCKETS)
+    return (
+        f'CREATE TABLE IF NOT EXISTS "{stats_table_for(table_name)}" (\n'
+        "    item_purchased TEXT NOT NULL,\n"
+        "    payment_method TEXT NOT NULL,\n"
+        "    purchase_day DATE NOT NULL,\n"
+        "    row_count BIGINT NOT NULL DEFAULT 0,\n"
+        "    amount_count BIGINT NOT NULL DEFAULT 0,\n"
+        "    amount_sum DOUBLE PRECISION NOT NULL DEFAULT 0,\n"
+        "    amount_sumsq DOUBLE PRECISION NOT NULL DEFAULT 0,\n"
+        "    amount_min DOUBLE PRECISION,\n"
+        "    amount_max DOUBLE PRECISION,\n"
+        "    rating_count BIGINT NOT NULL DEFAULT 0,\n"
+        "    rating_sum DOUBLE PRECISION NOT NULL DEFAULT 0,\n"
+        f"{rating_cols}"
+        "    updated_at TIMESTAMP,\n"
+        "    PRIMARY KEY (item_purchased, payment_method, purchase_day)\n"
+        ")"
+    )
+
+
+def sketch_table_for(table_name: str) -> str:
+    return f"{table_name}_amount_sketch"
+
+
+def sketch_ddl(table_name: str) -> str:
+    return (
+        f'CREATE TABLE IF NOT EXISTS "{sketch_table_for(table_name)}" (\n'
+        "    item_purchased TEXT NOT NULL,\n"
+        "    purchase_month TEXT NOT NULL,\n"
+        "    sketch TEXT,\n"
+        "    updated_at TIMESTAMP,\n"
+        "    PRIMARY KEY (item_purchased, purchase_month)\n"
+        ")"
+    )
+
+
+def aggregate_rows(df: pd.DataFrame, sign: int = 1) -> pd.DataFrame:
+    """
+    Per-group aggregates of silver rows (DB column names), indexed by GROUP_COLS.
+    sign=-1 negates the additive columns and leaves min / max empty (rows
+    being replaced cannot narrow them).
+    """
+    amount = pd.to_numeric(df["purchase_amount_usd"], errors="coerce").astype(float)
+    rating = pd.to_numeric(df["review_rating"], errors="coerce").astype(float)
+    bucket = np.floor(rating).clip(0, 5)
+
+    frame = pd.DataFrame(
+        {
+            "item_purchased": df["item_purchased"].astype(object).fillna(NULL_GROUP).astype(str),
+            "payment_method": df["payment_method"].astype(object).fillna(NULL_GROUP).astype(str),
+            "purchase_day": pd.to_datetime(df["date_purchase"]).dt.date,
+            "row_count": 1,
+            "amount_count": amount.notna().astype(int),
+            "amount_sum": amount.fillna(0.0),
+            "amount_sumsq": amount.fillna(0.0) ** 2,
+            "rating_count": rating.notna().astype(int),
+            "rating_sum": rating.fillna(0.0),
+            **{f"rating_{b}": (bucket == b).astype(int) for b in RATING_BUCKETS},
+            "amount_min": amount,
+            "amount_max": amount,
+        },
+        index=df.index,
+    )
+    grouped = frame.groupby(GROUP_COLS, sort=False)
+    agg = grouped[ADDITIVE_COLS].sum().join(grouped["amount_min"].min()).join(grouped["amount_max"].max())
+    if sign < 0:
+        agg[ADDITIVE_COLS] = -agg[ADDITIVE_COLS]
+        agg[["amount_min", "amount_max"]] = np.nan
+    return agg
+
+
+def changed_rows(new_rows: pd.DataFrame, old_rows: pd.DataFrame):
+    """
+    (new_rows, old_rows) without the keys whose values are identical on both
+    sides: those would add and subtract the same values.
+    """
+    new_rows = new_rows.reset_index(drop=True)
+    if old_rows.empty:
+        return new_rows, old_rows
+    old = old_rows.assign(**{"date_purchase": pd.to_datetime(old_rows["date_purchase"])})
+    new = new_rows.assign(**{"date_purchase": pd.to_datetime(new_rows["date_purchase"])})
+    paired = new[KEY_COLS + VALUE_COLS].reset_index().merge(
+        old[KEY_COLS + VALUE_COLS], on=KEY_COLS, how="inner", suffixes=("", "_old")
+    )
+    same = np.ones(len(paired), dtype=bool)
+    for col in VALUE_COLS:
+        a, b = paired[col].astype(object), paired[f"{col}_old"].astype(object)
+        same &= ((a == b) | (a.isna() & b.isna())).to_numpy()
+    unchanged = paired[same]
+    old_keys = pd.MultiIndex.from_frame(unchanged[KEY_COLS])
+    return new_rows.drop(index=unchanged["index"]), old[~pd.MultiIndex.from_frame(old[KEY_COLS]).isin(old_keys)]
+
+
+def batch_delta(new_rows: pd.DataFrame, old_rows: pd.DataFrame) -> pd.DataFrame:
+    """
+    What applying new_rows does to the summary, given old_rows = the stored
+    versions of the keys new_rows will overwrite (KEY_COLS + VALUE_COLS).
+    Returns one row per touched group (STATS_COLS), ready for the upsert.
+    """
+    new_rows, old_rows = changed_rows(new_rows, old_rows)
+    return _delta(new_rows, old_rows)
+
+
+def _delta(new_rows: pd.DataFrame, old_rows: pd.DataFrame) -> pd.DataFrame:
+    parts = [aggregate_rows(new_rows)] if not new_rows.empty else []
+    if not old_rows.empty:
+        parts.append(aggregate_rows(old_rows, sign=-1))
+    if not parts:
+        return pd.DataFrame(columns=STATS_COLS)
+
+    combined = pd.concat(parts)
+    grouped = combined.groupby(level=GROUP_COLS, sort=False)
+    delta = grouped[ADDITIVE_COLS].sum().join(grouped["amount_min"].min()).join(grouped["amount_max"].max())
+    return delta.reset_index()[STATS_COLS]
+
+
+def batch_sketches(df: pd.DataFrame, k: int = DEFAULT_SKETCH_K) -> dict:
+    """{(item_purchased, purchase_month): QuantileSketch} of the non-null amounts in df."""
+    amount = pd.to_numeric(df["purchase_amount_usd"], errors="coerce").astype(float)
+    frame = pd.DataFrame(
+        {
+            "item_purchased": df["item_purchased"].astype(object).fillna(NULL_GROUP).astype(str),
+            "purchase_month": pd.to_datetime(df["date_purchase"]).dt.strftime("%Y-%m"),
+            "amount": amount,
+        }
+    ).dropna(subset=["amount"])
+    sketches = {}
+    for key, values in frame.groupby(["item_purchased", "purchase_month"], sort=True)["amount"]:
+        sketches[key] = QuantileSketch(k)
+        sketches[key].update(values.to_numpy())
+    return sketches
+
+
+def ensure_stats_table(table_name: str, engine=None) -> None:
+    """
+    CREATE the stats + sketch tables once per process, in its OWN committed transaction:
+    created inside a load transaction it would vanish again if that load
+    rolled back, while this process already believed it existed.
+    """
+    engine = engine or get_engine()
+    key = (str(getattr(engine, "url", "")), table_name)  # per database, not just per name
+    with _ensure_lock:
+        if key in _ensured:
+            return
+        with engine.begin() as conn:
+            conn.execute(text(stats_ddl(table_name)))
+            conn.execute(text(sketch_ddl(table_name)))
+        _ensured.add(key)  # only once the CREATE is committed
+
+
+def _fetch_stored_rows(
+    cursor, table_name: str, df: pd.DataFrame, staging_table: str | None, page_size: int
+) -> pd.DataFrame:
+    """
+    Stored versions of df's keys: joined against the COPY staging table when
+    there is one, else sent as VALUES lists of at most page_size keys.
+    """
+    cols = KEY_COLS + VALUE_COLS
+    select = ", ".join(f't."{c}"' for c in cols)
+    if staging_table is not None:
+        using = ", ".join(f'"{c}"' for c in KEY_COLS)
+        cursor.execute(f'SELECT {select} FROM "{table_name}" t JOIN "{staging_table}" s USING ({using})')
+        rows = cursor.fetchall()
+    else:
+        keys = list(
+            zip(
+                df["customer_reference_id"].astype(object).tolist(),
+                df["item_purchased"].astype(object).tolist(),
+                [ts.to_pydatetime() for ts in pd.to_datetime(df["date_purchase"])],
+            )
+        )
+        on = " AND ".join(f't."{c}" = k."{c}"' for c in KEY_COLS)
+        query = f'SELECT {select} FROM "{table_name}" t JOIN (VALUES %s) AS k ({", ".join(KEY_COLS)}) ON {on}'
+        # fetch=True collects the rows of every page
+        rows = execute_values(cursor, query, keys, page_size=page_size, fetch=True)
+    return pd.DataFrame(rows, columns=cols)
+
+
+def _upsert_sql(table_name: str) -> str:
+    stats_table = stats_table_for(table_name)
+    col_list = ", ".join(STATS_COLS + ["updated_at"])
+    updates = [f"{c} = s.{c} + EXCLUDED.{c}" for c in ADDITIVE_COLS] + [
+        "amount_min = LEAST(s.amount_min, EXCLUDED.amount_min)",
+        "amount_max = GREATEST(s.amount_max, EXCLUDED.amount_max)",
+        "updated_at = EXCLUDED.updated_at",
+    ]
+    return (
+        f'INSERT INTO "{stats_table}" AS s ({col_list}) VALUES %s '
+        f"ON CONFLICT ({', '.join(GROUP_COLS)}) DO UPDATE SET {', '.join(updates)}"
+    )
+
+
+def apply_sketch_batch(cursor, table_name: str, df: pd.DataFrame, page_size: int = DEFAULT_PAGE_SIZE) -> int:
+    """
+    Merge the amounts of df (rows about to be written) into the stored
+    per-(item, month) sketches. Returns the sketch rows updated.
+    """
+    sketches = batch_sketches(df)
+    if not sketches:
+        return 0
+    sketch_table = sketch_table_for(table_name)
+    keys = sorted(sketches)  # one lock order for every loader: no deadlocks
+    # Make sure every row exists first, so FOR UPDATE has something to lock
+    execute_values(
+        cursor,
+        f'INSERT INTO "{sketch_table}" (item_purchased, purchase_month) VALUES %s '
+        "ON CONFLICT (item_purchased, purchase_month) DO NOTHING",
+        keys,
+        page_size=page_size,
+    )
+    stored = execute_values(
+        cursor,
+        f'SELECT t.item_purchased, t.purchase_month, t.sketch FROM "{sketch_table}" t '
+        "JOIN (VALUES %s) AS k (item_purchased, purchase_month) "
+        "ON t.item_purchased = k.item_purchased AND t.purchase_month = k.purchase_month "
+        "ORDER BY t.item_purchased, t.purchase_month FOR UPDATE OF t",
+        keys,
+        page_size=page_size,
+        fetch=True,
+    )
+    for item, month, value in stored:
+        sketches[(item, month)] = QuantileSketch.from_json(value).merge(sketches[(item, month)])
+
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    execute_values(
+        cursor,
+        f'INSERT INTO "{sketch_table}" (item_purchased, purchase_month, sketch, updated_at) VALUES %s '
+        "ON CONFLICT (item_purchased, purchase_month) DO UPDATE "
+        "SET sketch = EXCLUDED.sketch, updated_at = EXCLUDED.updated_at",
+        [(item, month, sketches[(item, month)].to_json(), now) for item, month in keys],
+        page_size=page_size,
+    )
+    return len(keys)
+
+
+def apply_batch(
+    cursor,
+    table_name: str,
+    df: pd.DataFrame,
+    staging_table: str | None = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+) -> int:
+    """
+    Fold a batch that is ABOUT to be upserted into table_name into its stats
+    and amount sketch tables. Call it inside the load transaction, before the
+    upsert runs, with a DBAPI cursor on that transaction (the tables
+    themselves are created up front in a separate transaction). Returns the
+    stats groups touched.
+    - page_size: keys / stats rows per statement (the loader's batch_size)
+    """
+    if df.empty:
+        return 0
+    page_size = max(int(page_size or DEFAULT_PAGE_SIZE), 1)
+    ensure_stats_table(table_name)
+    old_rows = _fetch_stored_rows(cursor, table_name, df, staging_table, page_size)
+    new_rows, old_rows = changed_rows(df, old_rows)
+    if not new_rows.empty:
+        apply_sketch_batch(cursor, table_name, new_rows, page_size)
+    delta = _delta(new_rows, old_rows)
+    if delta.empty:
+        return 0
+
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    records = [
+        tuple(None if isinstance(v, float) and np.isnan(v) else v for v in row) + (now,)
+        for row in delta.astype(object).itertuples(index=False, name=None)
+    ]
+    execute_values(cursor, _upsert_sql(table_name), records, page_size=page_size)
+    logger.debug(f"   Running stats: {len(delta)} groups updated for {len(df)} rows ({len(old_rows)} replaced)")
+    return len(delta)
+
+
+def rebuild_running_stats(table_name: str = "stg_fashion_sales", engine=None) -> int:
+    """
+    Recompute the whole stats table (exact min / max again) and the amount
+    sketches from table_name. Returns the stats group count.
+    """
+    engine = engine or get_engine()
+    stats_table = stats_table_for(table_name)
+    bucket = "LEAST(GREATEST(FLOOR(review_rating), 0), 5)"
+    rating_aggs = ", ".join(f"SUM(CASE WHEN {bucket} = {b} THEN 1 ELSE 0 END)" for b in RATING_BUCKETS)
+    insert_sql = f"""
+        INSERT INTO "{stats_table}" ({", ".join(STATS_COLS)}, updated_at)
+        SELECT COALESCE(item_purchased, '') AS item_purchased,
+               COALESCE(payment_method, '') AS payment_method,
+               CAST(date_purchase AS DATE) AS purchase_day,
+               COUNT(*), COUNT(purchase_amount_usd),
+               COALESCE(SUM(purchase_amount_usd), 0),
+               COALESCE(SUM(purchase_amount_usd * purchase_amount_usd), 0),
+               COUNT(review_rating), COALESCE(SUM(review_rating), 0),
+               {rating_aggs},
+               MIN(purchase_amount_usd), MAX(purchase_amount_usd),
+               CURRENT_TIMESTAMP
+        FROM "{table_name}"
+        GROUP BY 1, 2, 3
+    """
+    ensure_stats_table(table_name, engine)
+    with engine.begin() as conn:
+        conn.execute(text(f'DELETE FROM "{stats_table}"'))
+        groups = conn.execute(text(insert_sql)).rowcount
+    logger.info(f"Rebuilt {stats_table} from {table_name}: {groups} groups")
+    rebuild_amount_sketches(table_name, engine)
+    return groups
+
+
+def rebuild_amount_sketches(
+    table_name: str = "stg_fashion_sales", engine=None, batch_size: int = 100_000, k: int = DEFAULT_SKETCH_K
+) -> int:
+    """
+    Recompute the amount sketches from table_name: one streamed pass
+    (server-side cursor, batch_size rows at a time), so replaced amounts are
+    gone again. Returns the sketch rows written.
+    """
+    engine = engine or get_engine()
+    sketch_table = sketch_table_for(table_name)
+    query = (
+        f'SELECT item_purchased, date_purchase, purchase_amount_usd FROM "{table_name}" '
+        "WHERE purchase_amount_usd IS NOT NULL"
+    )
+    sketches = {}
+    with engine.connect().execution_options(stream_results=True, max_row_buffer=batch_size) as conn:
+        for batch in pd.read_sql(text(query), conn, chunksize=batch_size):
+            for key, sketch in batch_sketches(batch, k).items():
+                sketches[key] = sketches[key].merge(sketch) if key in sketches else sketch
+
+    ensure_stats_table(table_name, engine)
+    rows = [
+        {"item": item, "month": month, "sketch": sketch.to_json()} for (item, month), sketch in sorted(sketches.items())
+    ]
+    with engine.begin() as conn:
+        conn.execute(text(f'DELETE FROM "{sketch_table}"'))
+        if rows:
+            conn.execute(
+                text(
+                    f'INSERT INTO "{sketch_table}" (item_purchased, purchase_month, sketch, updated_at) '
+                    "VALUES (:item, :month, :sketch, CURRENT_TIMESTAMP)"
+                ),
+                rows,
+            )
+    logger.info(f"Rebuilt {sketch_table} from {table_name}: {len(rows)} sketches")
+    return len(rows)
@@ -0,0 +1,88 @@
+"""
+scheduler.py
+
+Runs independent ingestion sources concurrently.
+
+- Each source runs in its own worker process (parse / cast / clean are CPU bound
+  and hold the GIL, so threads would not help)
+- DB writes are throttled by a shared semaphore so N sources never open more
+  than `max_db_writers` concurrent write transactions
+- One failing source does not stop the others; its summary is marked "failed"
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src.db import dispose_engines
+from src.logs.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+def _init_worker() -> None:
+    # A forked child inherits the parent's engine registry; forget those
+    # pools so each worker opens its own connections.
+    dispose_engines(close=False)
+
+
+def _job_name(job) -> str:
+    """Source name of a main.run job ({"cfg": ..., "source": {"name": ...}})."""
+    try:
+        return job["source"]["name"]
+    except (KeyError, TypeError):
+        return str(job)
+
+
+def run_parallel(run_fn, jobs: list, max_workers: int, max_db_writers: int) -> list[dict]:
+    """
+    Call run_fn(job, write_slots) for every job on a process pool.
+    Jobs have the main.run shape {"cfg": ..., "source": {"name": ..., ...}}.
+
+    - write_slots is a cross-process semaphore (use it as `with write_slots:`)
+      around every DB write
+    - returns one summary dict per job, in the same order as `jobs`
+    - a job that raises gets {"source": ..., "status": "failed", "error": ...}
+    """
+    if not jobs:
+        return []
+
+    results = [None] * len(jobs)
+    with multiprocessing.Manager() as manager:
+        write_slots = manager.BoundedSemaphore(max(int(max_db_writers), 1))
+
+        with ProcessPoolExecutor(
+            max_workers=max(min(int(max_workers), len(jobs)), 1),
+            initializer=_init_worker,
+        ) as pool:
+            futures = {
+                pool.submit(run_fn, job, write_slots): i
+                for i, job in enumerate(jobs)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                name = _job_name(jobs[i])
+                try:
+                    results[i] = future.result()
+                except Exception as exc:
+                    logger.error(f"Source {name} failed: {exc!r}")
+                    results[i] = {"source": name, "status": "failed", "error": repr(exc)}
+
+    return results
+
+
+def combine_summaries(summaries: list[dict], wall_seconds: float) -> dict:
+    """Add up the numeric counters of every per-source summary."""
+    combined = {
+        "sources": len(summaries),
+        "failed_sources": [s["source"] for s in summaries if s.get("status") == "failed"],
+        "wall_seconds": round(wall_seconds, 2),
+    }
+    for summary in summaries:
+        for key, value in summary.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                combined[key] = combined.get(key, 0) + value
+    # Sum of per-source runtimes = what a sequential run would have cost
+    if "runtime_seconds" in combined:
+        combined["runtime_seconds"] = round(combined["runtime_seconds"], 2)
+    return combined
+
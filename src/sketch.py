@@ -0,0 +1,112 @@
+"""
+sketch.py
+
+Mergeable streaming quantile sketch (QuantileSketch) for the robust outlier
+statistics: running_stats.py keeps one per (item, purchase month) up to
+date at load time, outliers.py merges them into per-group median / MAD.
+"""
+
+import json
+
+import numpy as np
+
+DEFAULT_SKETCH_K = 200
+
+
+class QuantileSketch:
+    """
+    Streaming approximate quantiles (KLL-style compactor levels).
+
+    - Level i holds items of weight 2**i; when a level outgrows its capacity
+      it is sorted and every other item (random offset) moves up one level
+    - Capacities shrink geometrically below the top level, so the sketch keeps
+      O(k) items however many values went in; rank error is roughly O(1/k)
+    - Mergeable: merge() adds another sketch level by level, so per-batch
+      sketches can be folded into stored ones and per-group ones combined
+    - to_json() / from_json() store it as a small TEXT value
+    """
+
+    def __init__(self, k: int = DEFAULT_SKETCH_K, seed: int = 0):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - 1 - level
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def update(self, values) -> None:
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.n += len(values)
+        self._compress()
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """Add other's items (with their weights) to this sketch. Returns self."""
+        if not other.n:
+            return self
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def to_json(self) -> str:
+        return json.dumps({"k": self.k, "n": self.n, "levels": [level.tolist() for level in self.levels]})
+
+    @classmethod
+    def from_json(cls, value: str | None, k: int = DEFAULT_SKETCH_K) -> "QuantileSketch":
+        """Sketch stored by to_json(); an empty one for NULL / ""."""
+        if not value:
+            return cls(k)
+        saved = json.loads(value)
+        sketch = cls(saved["k"])
+        sketch.n = int(saved["n"])
+        sketch.levels = [np.asarray(level, dtype=float) for level in saved["levels"]] or [np.empty(0)]
+        return sketch
+
+    def _compress(self) -> None:
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # an odd item out stays here so total weight is preserved
+                keep, items = (items[:1], items[1:]) if len(items) % 2 else (items[:0], items)
+                promoted = items[self._rng.integers(2)::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def _weighted_items(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(lvl), 2.0 ** i) for i, lvl in enumerate(self.levels)])
+        return items, weights
+
+    @staticmethod
+    def _weighted_quantile(items, weights, q: float) -> float:
+        order = np.argsort(items)
+        cumulative = np.cumsum(weights[order])
+        idx = np.searchsorted(cumulative, q * cumulative[-1], side="left")
+        return float(items[order][min(idx, len(items) - 1)])
+
+    def quantile(self, q: float) -> float:
+        if self.n == 0:
+            return float("nan")
+        return self._weighted_quantile(*self._weighted_items(), q)
+
+    def median_mad(self):
+        """(median, MAD) from the same sketch: MAD = weighted median of |item - median|."""
+        if self.n == 0:
+            return float("nan"), float("nan")
+        items, weights = self._weighted_items()
+        median = self._weighted_quantile(items, weights, 0.5)
+        return median, self._weighted_quantile(np.abs(items - median), weights, 0.5)
@@ -0,0 +1,119 @@
+"""
+state.py
+
+Ingestion state store used for incremental runs.
+
+One small JSON file per source (state/<source name>.json) remembers what the
+last successful run loaded:
+  - the file fingerprint (size, mtime, sha256)
+  - the byte offset we stopped at (for append-only files)
+  - rows loaded so far and the high-water mark of the watermark column
+
+plan_ingest() compares the current file against that record and decides:
+  - "skip":   file unchanged, nothing to do
+  - "append": file only grew (old content is an exact prefix), read from the old end
+  - "full":   new or rewritten file, read everything
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+DEFAULT_STATE_DIR = Path(__file__).parent.parent / "state"
+
+# Read size used while hashing files
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def _state_path(source_name: str, state_dir=None) -> Path:
+    return Path(state_dir or DEFAULT_STATE_DIR) / f"{source_name}.json"
+
+
+def load_state(source_name: str, state_dir=None) -> dict | None:
+    """Return the saved state for a source, or None if it never loaded."""
+    path = _state_path(source_name, state_dir)
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(source_name: str, state: dict, state_dir=None) -> None:
+    """Write the state atomically (temp file + rename) so a crash never leaves half a file."""
+    path = _state_path(source_name, state_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def fingerprint_file(path: str, prefix_size: int | None = None) -> dict:
+    """
+    Size, mtime and sha256 of a file, in one read pass.
+    If prefix_size is given, also returns the sha256 of the first prefix_size
+    bytes (used to check that an older version is an exact prefix).
+    """
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    prefix_digest = None
+    last_byte = b""
+
+    with open(path, "rb") as f:
+        remaining_prefix = prefix_size if prefix_size is not None else -1
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            if 0 <= remaining_prefix < len(block):
+                digest.update(block[:remaining_prefix])
+                prefix_digest = digest.hexdigest()
+                digest.update(block[remaining_prefix:])
+            else:
+                digest.update(block)
+            if remaining_prefix >= 0:
+                remaining_prefix -= len(block)
+            last_byte = block[-1:]
+
+    if prefix_size is not None and prefix_digest is None and remaining_prefix == 0:
+        prefix_digest = digest.hexdigest()  # prefix was the whole file
+
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": digest.hexdigest(),
+        "prefix_sha256": prefix_digest,
+        "ends_with_newline": last_byte == b"\n",
+    }
+
+
+def plan_ingest(path: str, previous: dict | None) -> dict:
+    """
+    Decide how much of `path` needs to be read.
+    Returns {"mode": "skip" | "append" | "full", "offset": <byte offset>, "fingerprint": {...}}
+    """
+    old_fp = (previous or {}).get("fingerprint")
+    if not old_fp:
+        return {"mode": "full", "offset": 0, "fingerprint": fingerprint_file(path)}
+
+    stat = os.stat(path)
+    if stat.st_size == old_fp["size"] and stat.st_mtime == old_fp["mtime"]:
+        # Same size and mtime: treat as unchanged without reading the file
+        return {"mode": "skip", "offset": old_fp["size"], "fingerprint": old_fp}
+
+    fp = fingerprint_file(path, prefix_size=old_fp["size"])
+
+    if fp["sha256"] == old_fp["sha256"]:
+        # Touched but identical content
+        return {"mode": "skip", "offset": fp["size"], "fingerprint": fp}
+
+    if (
+        fp["size"] > old_fp["size"]
+        and fp["prefix_sha256"] == old_fp["sha256"]
+        and old_fp.get("ends_with_newline")
+    ):
+        # Old content untouched and new rows appended after it
+        return {"mode": "append", "offset": old_fp["size"], "fingerprint": fp}
+
+    return {"mode": "full", "offset": 0, "fingerprint": fp}
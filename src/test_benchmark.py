@@ -0,0 +1,64 @@
+import json
+
+from src import main
+from src.benchmark import benchmark_full_run, compare_results, generate_fashion_sales, write_synthetic_csv
+from src.config import load_sources_config
+from src.pipeline import transform_chunk
+from src.reader import _normalize_columns, read_csv
+
+
+def test_generated_data_has_requested_dirt():
+    clean = generate_fashion_sales(2000, seed=1, bad_cast_rate=0, rule_violation_rate=0, duplicate_rate=0)
+    dirty = generate_fashion_sales(2000, seed=1, bad_cast_rate=0.1, rule_violation_rate=0.1, duplicate_rate=0.1)
+    source = load_sources_config()["sources"][0]
+
+    clean_df, cast_rej, rule_rej = transform_chunk(_normalize_columns(clean), source["schema"], source.get("rules"))
+    assert len(cast_rej) == 0
+    assert len(rule_rej) == 0
+
+    clean_df, cast_rej, rule_rej = transform_chunk(_normalize_columns(dirty), source["schema"], source.get("rules"))
+    assert len(cast_rej) > 0
+    assert len(rule_rej) > 0
+    assert len(clean_df) < 2000 - len(cast_rej) - len(rule_rej)  # duplicates dropped
+
+
+def test_write_synthetic_csv_in_steps(tmp_path, monkeypatch):
+    monkeypatch.setattr("src.benchmark.GENERATE_CHUNK_ROWS", 300)
+    path = write_synthetic_csv(tmp_path / "sales.csv", 1000, seed=3)
+
+    df = read_csv(str(path))
+    assert len(df) == 1000
+    assert "customer reference id" in df.columns
+
+
+def test_compare_results_against_previous_commit(tmp_path):
+    results = tmp_path / "results.jsonl"
+    lines = [
+        {"commit": "aaa", "rows": 10, "stages": {"cast": {"wall_seconds": 2.0}}},
+        {"commit": "bbb", "rows": 10, "stages": {"cast": {"wall_seconds": 1.0}}},
+    ]
+    results.write_text("\n".join(json.dumps(line) for line in lines) + "\n")
+
+    rows = compare_results(results)
+    assert rows == [
+        {"rows": 10, "stage": "cast", "baseline": "aaa 2.000s", "current": "bbb 1.000s", "ratio": 0.5}
+    ]
+
+
+def test_full_run_keeps_synthetic_rows_out_of_the_cache_and_running_stats(tmp_path, monkeypatch):
+    cfg = load_sources_config()
+    jobs = []
+
+    def fake_run_source(job):
+        jobs.append(job)
+        return {"runtime_seconds": 1.0, "loaded_to_db": 10, "rejected_rows": 0, "metrics": {"stages": {}}}
+
+    monkeypatch.setattr(main, "run_source", fake_run_source)
+    benchmark_full_run(tmp_path / "sales.csv", cfg, cfg["sources"][0])
+
+    source = jobs[0]["source"]
+    assert source["name"].startswith("bench_")
+    assert source["parquet_cache"] is False and source["running_stats"] is False
+    # the overrides win over the shipped defaults
+    assert main.get_source_option(cfg, source, "parquet_cache") is False
+    assert main.get_source_option(cfg, source, "running_stats") is False
@@ -0,0 +1,98 @@
+import multiprocessing
+
+import pandas as pd
+
+from src import cache
+
+
+def _batch(ids, amounts, dates):
+    return pd.DataFrame(
+        {
+            "customer_reference_id": pd.array(ids, dtype="Int64"),
+            "item_purchased": pd.Categorical(["Jeans"] * len(ids)),
+            "purchase_amount_usd": amounts,
+            "date_purchase": pd.to_datetime(dates),
+        }
+    )
+
+
+def test_batches_are_partitioned_by_month_and_latest_write_wins(tmp_path):
+    first = _batch([1, 2], [10.0, 20.0], ["2023-01-05", "2023-02-07"])
+    counts = cache.begin_batch(first, tmp_path)
+    assert cache.load_manifest(tmp_path)["partitions"]["2023-01"]["status"] == "invalid"
+    cache.commit_batch(first, tmp_path, counts)
+
+    second = _batch([1], [99.0], ["2023-01-05"])
+    cache.commit_batch(second, tmp_path, cache.begin_batch(second, tmp_path))
+
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_dir()) == [
+        "purchase_month=2023-01",
+        "purchase_month=2023-02",
+    ]
+    df = cache.read_cache(tmp_path).sort_values("customer_reference_id")
+    assert df["purchase_amount_usd"].tolist() == [99.0, 20.0]
+    assert "_load_seq" not in df.columns
+
+    # Projection + partition pruning
+    jan = cache.read_cache(tmp_path, columns=["purchase_amount_usd"], filters=[("purchase_month", "=", "2023-01")])
+    assert list(jan.columns) == ["purchase_amount_usd"]
+    assert jan["purchase_amount_usd"].tolist() == [99.0]
+
+    cache.compact_partitions(tmp_path)
+    assert len(list((tmp_path / "purchase_month=2023-01").glob("*.parquet"))) == 1
+    pd.testing.assert_frame_equal(cache.read_cache(tmp_path).sort_values("customer_reference_id"), df)
+
+
+def test_refresh_rebuilds_only_invalid_months_from_the_db(tmp_path, monkeypatch):
+    batch = _batch([1, 2], [10.0, 20.0], ["2023-01-05", "2023-02-07"])
+    cache.bootstrap_cache(batch, tmp_path)
+    cache.begin_batch(_batch([3], [30.0], ["2023-02-09"]), tmp_path)  # DB write never confirmed
+
+    queries = []
+
+    def fake_read_sql(query, engine, params):
+        queries.append(params["start"])
+        # The DB has what actually got committed for February
+        return pd.DataFrame(
+            {
+                "customer_reference_id": [2, 3],
+                "item_purchased": ["Jeans", "Jeans"],
+                "purchase_amount_usd": [20.0, 30.0],
+                "date_purchase": [pd.Timestamp("2023-02-07").date(), pd.Timestamp("2023-02-09").date()],
+            }
+        )
+
+    monkeypatch.setattr(cache.pd, "read_sql", fake_read_sql)
+    manifest = cache.load_manifest(tmp_path)
+    invalid = [m for m, p in manifest["partitions"].items() if p["status"] != "valid"]
+    cache.refresh_partitions(tmp_path, invalid, engine=None, table_name="stg_fashion_sales")
+
+    assert invalid == ["2023-02"]
+    assert [q.month for q in queries] == [2]
+    feb = cache.load_manifest(tmp_path)["partitions"]["2023-02"]
+    assert (feb["status"], feb["rows"]) == ("valid", 2)
+    assert sorted(cache.read_cache(tmp_path)["customer_reference_id"].tolist()) == [1, 2, 3]
+
+
+def _commit_months(cache_dir, worker):
+    for i in range(20):
+        batch = _batch([worker * 100 + i], [1.0], [f"{2000 + worker}-{i % 12 + 1:02d}-01"])
+        cache.commit_batch(batch, cache_dir, cache.begin_batch(batch, cache_dir))
+        if i % 5 == 4:
+            cache.compact_partitions(cache_dir)
+
+
+def test_parallel_writers_do_not_lose_manifest_updates(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    workers = [ctx.Process(target=_commit_months, args=(str(tmp_path), w)) for w in range(4)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+    assert [p.exitcode for p in workers] == [0] * 4
+
+    partitions = cache.load_manifest(tmp_path)["partitions"]
+    assert len(partitions) == 4 * 12
+    assert {p["status"] for p in partitions.values()} == {"valid"}
+    assert sum(p["rows"] for p in partitions.values()) == 4 * 20
+    assert len(cache.read_cache(tmp_path)) == 4 * 20
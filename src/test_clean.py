@@ -95,3 +95,25 @@ def test_clean_fashion_sales_fallback_dedup_when_key_incomplete():
     assert row["purchase amount (usd)"] == 4619.0
     assert row["review rating"] == 4.5
     assert row["payment method"] == "Cash"
+
+
+def test_clean_fashion_sales_normalizes_categoricals_on_the_dictionary():
+    """Categorical columns are normalized per category and equal results are merged."""
+    df = pd.DataFrame(
+        {
+            "customer reference id": [1, 2, 3, 4],
+            "item purchased": pd.Categorical([" jeans", "Jeans", "hat ", None]),
+            "payment method": pd.Categorical(["cash", "Cash ", "creditcard", "Credit Card"]),
+        }
+    )
+
+    clean_df = clean_fashion_sales(df)
+
+    items = clean_df["item purchased"]
+    payments = clean_df["payment method"]
+    assert isinstance(items.dtype, pd.CategoricalDtype)
+    assert sorted(items.cat.categories) == ["Hat", "Jeans"]
+    assert items.tolist()[:3] == ["Jeans", "Jeans", "Hat"]
+    assert pd.isna(items.iloc[3])
+    assert sorted(payments.cat.categories) == ["Cash", "Credit Card"]
+    assert payments.tolist() == ["Cash", "Cash", "Credit Card", "Credit Card"]
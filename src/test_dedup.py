@@ -0,0 +1,50 @@
+import pandas as pd
+
+from src.dedup import KeyIndex, dedup_last_wins, key_fingerprints
+
+KEY = ["customer reference id", "item purchased", "date purchase"]
+
+
+def _sales(ids, index=None, amounts=None):
+    return pd.DataFrame(
+        {
+            "customer reference id": ids,
+            "item purchased": ["Jeans"] * len(ids),
+            "date purchase": pd.to_datetime(["2023-01-01"] * len(ids)),
+            "purchase amount (usd)": amounts or [float(i) for i in range(len(ids))],
+        },
+        index=index,
+    )
+
+
+def test_fingerprints_ignore_dtype_dictionary_differences():
+    a = _sales([1, 2])
+    b = _sales([2, 1])
+    b["item purchased"] = b["item purchased"].astype("category")
+
+    assert key_fingerprints(a, KEY)[0] == key_fingerprints(b, KEY)[1]
+
+
+def test_last_row_wins_across_chunks():
+    with KeyIndex() as key_index:
+        first = dedup_last_wins(_sales([1, 2, 1], index=[0, 1, 2], amounts=[1.0, 2.0, 3.0]), KEY, key_index)
+        second = dedup_last_wins(_sales([2, 3], index=[3, 4], amounts=[4.0, 5.0]), KEY, key_index)
+
+        assert first["purchase amount (usd)"].tolist() == [2.0, 3.0]
+        assert second["purchase amount (usd)"].tolist() == [4.0, 5.0]
+        assert key_index.superseded == 1  # customer 2 from the first chunk
+        assert len(key_index) == 3
+
+
+def test_older_chunk_arriving_late_loses_even_after_spill(tmp_path):
+    with KeyIndex(max_memory_keys=1, spill_dir=tmp_path) as key_index:
+        dedup_last_wins(_sales([1, 2, 3], index=[10, 11, 12]), KEY, key_index)
+        assert list(tmp_path.iterdir())  # keys went to the SQLite spill file
+
+        late = dedup_last_wins(_sales([1, 4], index=[0, 1]), KEY, key_index)
+
+        assert late.index.tolist() == [1]
+        assert key_index.stale == 1
+        assert len(key_index) == 4
+
+    assert not list(tmp_path.iterdir())
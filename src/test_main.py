@@ -0,0 +1,172 @@
+import threading
+
+import pandas as pd
+import src.main as main
+from src.writer import BackgroundWriter
+
+
+def test_process_chunk_aggregates_counters_across_chunks(monkeypatch):
+    """Each chunk adds into the same summary; nothing is loaded for real."""
+    loaded = []
+    monkeypatch.setattr(main, "load_rejects", lambda *args, **kwargs: None)
+    monkeypatch.setattr(main, "load_fashion_sales_upsert", lambda df, table_name, batch_size, strategy: loaded.append(len(df)))
+
+    source = {
+        "name": "test_source",
+        "target_table": "stg_fashion_sales",
+        "schema": {
+            "customer reference id": "int",
+            "item purchased": "str",
+            "purchase amount (usd)": "float",
+            "date purchase": "datetime",
+            "review rating": "float",
+            "payment method": "str",
+        },
+    }
+    chunk1 = pd.DataFrame(
+        {
+            "customer reference id": ["1", "bad"],
+            "item purchased": ["Jeans", "Hat"],
+            "purchase amount (usd)": ["10.0", "20.0"],
+            "date purchase": ["2023-01-01", "2023-01-02"],
+            "review rating": ["4.0", "3.0"],
+            "payment method": ["Cash", "Cash"],
+        }
+    )
+    chunk2 = pd.DataFrame(
+        {
+            "customer reference id": ["2", "3"],
+            "item purchased": ["Jeans", "Hat"],
+            "purchase amount (usd)": ["10.0", "-5.0"],
+            "date purchase": ["2023-01-03", "2023-01-04"],
+            "review rating": ["4.0", "3.0"],
+            "payment method": ["Cash", "Cash"],
+        }
+    )
+
+    summary = main.new_summary("test_source")
+    main.process_chunk(chunk1, source, summary)
+    main.process_chunk(chunk2, source, summary)
+
+    assert summary["chunks"] == 2
+    assert summary["loaded_raw"] == 4
+    assert summary["valid_after_cast"] == 3     # "bad" id fails the int cast
+    assert summary["valid_after_rules"] == 2    # -5.0 amount fails the rules
+    assert summary["rejected_rows"] == 2
+    assert summary["loaded_to_db"] == 2
+    assert loaded == [1, 1]
+
+
+def test_process_chunk_with_writer_loads_on_the_writer_thread(monkeypatch):
+    """Pipelined mode: same counters, but the upsert runs on the background writer."""
+    threads = []
+    monkeypatch.setattr(main, "load_rejects", lambda *args, **kwargs: None)
+    monkeypatch.setattr(
+        main,
+        "load_fashion_sales_upsert",
+        lambda df, table_name, batch_size, strategy: threads.append(threading.current_thread().name),
+    )
+
+    source = {
+        "name": "test_source",
+        "target_table": "stg_fashion_sales",
+        "schema": {"customer reference id": "int", "purchase amount (usd)": "float"},
+        "rules": ["purchase amount (usd) >= 0"],
+    }
+    summary = main.new_summary("test_source")
+    with BackgroundWriter(name="writer-test") as writer:
+        for amounts in (["1.0", "-1.0"], ["2.0", "3.0"]):
+            chunk = pd.DataFrame({"customer reference id": ["1", "2"], "purchase amount (usd)": amounts})
+            main.process_chunk(chunk, source, summary, writer=writer)
+
+    assert summary["loaded_to_db"] == 3
+    assert summary["rejected_rows"] == 1
+    assert threads == ["writer-test", "writer-test"]
+
+
+def test_datetime_format_guesses_do_not_leak_between_sources(monkeypatch, tmp_path):
+    """A day-first feed followed by a month-first feed in the same process: each keeps its own format."""
+    loaded = {}
+    monkeypatch.setattr(main, "load_rejects", lambda *args, **kwargs: None)
+    monkeypatch.setattr(
+        main,
+        "load_fashion_sales_upsert",
+        lambda df, table_name, batch_size, strategy, **kw: loaded.setdefault(table_name, []).extend(df["date purchase"]),
+    )
+
+    header = "customer reference id,item purchased,purchase amount (usd),date purchase,review rating,payment method\n"
+    (tmp_path / "day_first.csv").write_text(header + "1,Jeans,10,25/12/2023,4,Cash\n2,Hat,12,05/02/2023,3,Cash\n")
+    (tmp_path / "month_first.csv").write_text(header + "3,Jeans,10,05/02/2023,4,Cash\n4,Hat,12,12/25/2023,3,Cash\n")
+
+    schema = {
+        "customer reference id": "int",
+        "item purchased": "str",
+        "purchase amount (usd)": "float",
+        "date purchase": "datetime",
+        "review rating": "float",
+        "payment method": "str",
+    }
+    cfg = {"defaults": {"streaming": True, "batch_size": 1, "reject_sink": "file"}}
+    for name in ("day_first", "month_first"):
+        source = {"name": name, "type": "csv", "path": str(tmp_path / f"{name}.csv"), "target_table": name, "schema": schema}
+        main.run_source({"cfg": cfg, "source": source})
+
+    # batch_size 1: the ambiguous 05/02 is in the second chunk of the day-first file, the first of the other
+    assert loaded["day_first"] == [pd.Timestamp("2023-12-25"), pd.Timestamp("2023-02-05")]
+    assert loaded["month_first"] == [pd.Timestamp("2023-05-02"), pd.Timestamp("2023-12-25")]
+
+
+def test_run_compacts_only_the_cache_months_it_wrote(monkeypatch, tmp_path):
+    from src import cache
+
+    monkeypatch.setattr(main, "load_rejects", lambda *args, **kwargs: None)
+    monkeypatch.setattr(main, "load_fashion_sales_upsert", lambda df, table_name, batch_size, strategy, **kw: None)
+    cache_dir = cache.cache_dir_for("sales", tmp_path / "cache")
+
+    # An older month with two files, untouched by this run
+    for amount in (1.0, 2.0):
+        old = pd.DataFrame(
+            {
+                "customer_reference_id": [9],
+                "item_purchased": ["Hat"],
+                "purchase_amount_usd": [amount],
+                "date_purchase": [pd.Timestamp("2022-06-01")],
+            }
+        )
+        cache.commit_batch(old, cache_dir, cache.begin_batch(old, cache_dir))
+
+    compacted = []
+    real_compact = cache.compact_partitions
+
+    def spy_compact(cache_dir, months=None):
+        compacted.append(set(months))
+        real_compact(cache_dir, months)
+
+    monkeypatch.setattr(cache, "compact_partitions", spy_compact)
+
+    header = "customer reference id,item purchased,purchase amount (usd),date purchase,review rating,payment method\n"
+    path = tmp_path / "sales.csv"
+    path.write_text(header + "1,Jeans,10,2023-02-05,4,Cash\n2,Hat,12,2023-02-07,3,Cash\n3,Hat,12,2023-03-01,3,Cash\n")
+    schema = {
+        "customer reference id": "int",
+        "item purchased": "str",
+        "purchase amount (usd)": "float",
+        "date purchase": "datetime",
+        "review rating": "float",
+        "payment method": "str",
+    }
+    cfg = {
+        "defaults": {
+            "streaming": True,
+            "batch_size": 1,
+            "reject_sink": "file",
+            "parquet_cache": True,
+            "parquet_cache_dir": str(tmp_path / "cache"),
+        }
+    }
+    source = {"name": "sales", "type": "csv", "path": str(path), "target_table": "sales", "schema": schema}
+    main.run_source({"cfg": cfg, "source": source})
+
+    assert compacted == [{"2023-02", "2023-03"}]
+    assert len(list((cache_dir / "purchase_month=2023-02").glob("*.parquet"))) == 1
+    assert len(list((cache_dir / "purchase_month=2022-06").glob("*.parquet"))) == 2
@@ -0,0 +1,48 @@
+import json
+
+import pandas as pd
+
+from src.metrics import RunMetrics, emit_run_record
+
+
+def test_stage_accumulates_calls_rows_and_times():
+    metrics = RunMetrics("test_source", trace_memory=True)
+
+    with metrics.stage("cast", rows=10):
+        sum(range(1000))
+    with metrics.stage("cast", rows=5) as rec:
+        rec["bytes"] += 100
+
+    record = metrics.as_record()
+    cast = record["stages"]["cast"]
+    assert record["run"] == "test_source"
+    assert cast["calls"] == 2
+    assert cast["rows"] == 15
+    assert cast["bytes"] == 100
+    assert cast["wall_seconds"] >= 0
+    assert cast["max_rss_bytes"] > 0
+    assert cast["peak_traced_bytes"] is not None
+
+
+def test_timed_iter_counts_each_chunk_read():
+    metrics = RunMetrics("test_source")
+    chunks = [pd.DataFrame({"a": [1, 2]}), pd.DataFrame({"a": [3]})]
+
+    seen = list(metrics.timed_iter("read", chunks, bytes_of=lambda c: 8 * len(c)))
+
+    assert len(seen) == 2
+    read = metrics.as_record()["stages"]["read"]
+    assert read["rows"] == 3
+    assert read["bytes"] == 24
+    # two chunks + the final call that finds the iterator exhausted
+    assert read["calls"] == 3
+
+
+def test_emit_run_record_appends_json_lines(tmp_path):
+    path = tmp_path / "metrics" / "runs.jsonl"
+
+    emit_run_record({"run": 1}, metrics_path=path)
+    emit_run_record({"run": 2}, metrics_path=path)
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["run"] for line in lines] == [1, 2]
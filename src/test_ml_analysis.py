@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import sqlalchemy
+
+from src import ml_analysis
+
+
+def _silver():
+    return pd.DataFrame(
+        {
+            "item_purchased": pd.Categorical(["Jeans", "Handbag", "Loafers", "Jeans", "Handbag"]),
+            "purchase_amount_usd": [10.0, 250.0, None, 40.0, 75.5],
+            "review_rating": [1.0, 4.5, 3.0, None, 2.0],
+            "payment_method": ["Cash", "Credit Card", "Cash", "Cash", "Credit Card"],
+        }
+    )
+
+
+def test_sparse_features_match_get_dummies():
+    df = _silver()
+    X, y, names, _ = ml_analysis.build_features_and_target(df)
+
+    assert sp.issparse(X) and X.format == "csr"
+    kept = df.dropna(subset=["review_rating", "purchase_amount_usd"])
+    dense = pd.get_dummies(
+        kept[["purchase_amount_usd", "payment_method", "item_purchased"]].astype(
+            {"payment_method": "category", "item_purchased": "category"}
+        ),
+        columns=["payment_method", "item_purchased"],
+        drop_first=True,
+    )
+    # Loafers only shows up in a dropped row, so it is not in the vocabulary
+    assert names == [c for c in dense.columns if c != "item_purchased_Loafers"]
+    np.testing.assert_array_equal(X.toarray(), dense[names].to_numpy(dtype=float))
+    assert y.tolist() == [1, 0, 1]
+
+
+def test_saved_vocabulary_gives_the_training_columns_at_scoring(tmp_path):
+    _, _, names, vocabulary = ml_analysis.build_features_and_target(_silver())
+    path = vocabulary.save(tmp_path / "vocab.json")
+
+    new_rows = pd.DataFrame(
+        {
+            "item_purchased": ["Handbag", "Sneakers"],  # Sneakers was never seen
+            "purchase_amount_usd": [20.0, 30.0],
+            "review_rating": [5.0, 1.0],
+            "payment_method": ["Credit Card", "Cash"],
+        }
+    )
+    X, _, new_names, _ = ml_analysis.build_features_and_target(
+        new_rows, vocabulary=ml_analysis.FeatureVocabulary.load(path)
+    )
+    assert new_names == names
+    assert X.shape == (2, len(names))
+    assert X[1].nnz == 1  # only the amount: Sneakers and Cash (baseline) have no column
+
+
+def _trained(tmp_path, n=400):
+    df = _training_rows(n)
+    X, y, names, vocabulary = ml_analysis.build_features_and_target(df)
+    models = ml_analysis.train_and_evaluate_models(X, y, names)
+    snapshot = ml_analysis.data_snapshot_id(df)
+    ml_analysis.save_artifacts(models, vocabulary, snapshot, tmp_path, rows=len(df))
+    return df, snapshot
+
+
+def _training_rows(n):
+    rng = np.random.default_rng(0)
+    items = rng.choice(["Jeans", "Handbag", "Loafers"], n)
+    return pd.DataFrame(
+        {
+            "customer_reference_id": np.arange(n),
+            "item_purchased": items,
+            "date_purchase": pd.Timestamp("2023-01-01") + pd.to_timedelta(np.arange(n) % 300, unit="D"),
+            "purchase_amount_usd": rng.uniform(10, 500, n),
+            "review_rating": np.where(items == "Handbag", 1.0, 4.0),
+            "payment_method": rng.choice(["Cash", "Credit Card"], n),
+        }
+    )
+
+
+def test_snapshot_id_ignores_row_order_but_not_values():
+    df = _training_rows(50)
+    snapshot = ml_analysis.data_snapshot_id(df)
+    assert ml_analysis.data_snapshot_id(df.sample(frac=1, random_state=1)) == snapshot
+
+    changed = df.copy()
+    changed.loc[3, "review_rating"] = 2.0
+    assert ml_analysis.data_snapshot_id(changed) != snapshot
+
+
+def test_saved_artifacts_are_reloaded_by_snapshot_and_latest(tmp_path):
+    df, snapshot = _trained(tmp_path)
+    assert ml_analysis.load_artifacts("0" * 16, tmp_path) is None
+
+    artifacts = ml_analysis.load_artifacts(model_dir=tmp_path)
+    assert artifacts["snapshot"] == snapshot
+    assert set(artifacts["models"]) == {"scaler", "log_reg", "random_forest"}
+
+    scores = ml_analysis.predict_batch(artifacts, df.head(20))
+    assert list(scores.columns) == ml_analysis.KEY_COLS + ["low_review_proba", "low_review_pred"]
+    expected = (df.head(20)["item_purchased"] == "Handbag").astype(int).tolist()
+    assert scores["low_review_pred"].tolist() == expected
+
+
+def test_score_new_rows_only_scores_unscored_rows_in_batches(tmp_path, monkeypatch):
+    df, snapshot = _trained(tmp_path)
+    engine = sqlalchemy.create_engine("sqlite://")
+    df.to_sql(ml_analysis.SILVER_TABLE, engine, index=False)
+
+    loads = []
+
+    def fake_copy_upsert(frame, table_name, pk_cols, batch_size):
+        loads.append(len(frame))
+        frame.to_sql(table_name, engine, index=False, if_exists="append")
+
+    monkeypatch.setattr(ml_analysis, "get_engine", lambda: engine)
+    monkeypatch.setattr(ml_analysis, "copy_upsert_dataframe", fake_copy_upsert)
+
+    assert ml_analysis.score_new_rows(batch_size=150, model_dir=tmp_path) == len(df)
+    assert loads == [150, 150, 100]
+
+    # Nothing new since: the next run scores nothing
+    assert ml_analysis.score_new_rows(batch_size=150, model_dir=tmp_path) == 0
+    versions = pd.read_sql("SELECT DISTINCT model_version FROM ml_predictions", engine)["model_version"]
+    assert versions.tolist() == [f"log_reg-{snapshot}"]
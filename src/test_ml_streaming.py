@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+from src import ml_analysis, ml_streaming
+
+
+def _silver(n, seed=0):
+    rng = np.random.default_rng(seed)
+    items = rng.choice(["Jeans", "Handbag", "Loafers"], n)
+    # Handbags get bad reviews, so the models have something to learn
+    ratings = np.where(items == "Handbag", rng.uniform(0, 2, n), rng.uniform(3, 5, n))
+    return pd.DataFrame(
+        {
+            "customer_reference_id": np.arange(n),
+            "item_purchased": items,
+            "date_purchase": pd.Timestamp("2023-01-01") + pd.to_timedelta(np.arange(n) % 365, unit="D"),
+            "purchase_amount_usd": rng.uniform(10, 500, n),
+            "review_rating": ratings,
+            "payment_method": rng.choice(["Cash", "Credit Card"], n),
+        }
+    )
+
+
+def _batches(df, size):
+    return (df.iloc[i:i + size] for i in range(0, len(df), size))
+
+
+def test_hash_features_have_a_fixed_width():
+    df = _silver(10)
+    X = ml_streaming.hash_features(df, n_features=64)
+    assert X.shape == (10, 65)
+    # amount + one token per categorical column
+    assert (X.getnnz(axis=1) == 3).all()
+    assert X[:1].toarray()[0, 0] == np.log1p(df["purchase_amount_usd"].iloc[0])
+
+
+def test_holdout_split_does_not_depend_on_batching():
+    df = _silver(1000)
+    whole = ml_streaming.holdout_mask(df)
+    batched = np.concatenate([ml_streaming.holdout_mask(b) for b in _batches(df, 77)])
+    assert (whole == batched).all()
+    assert 0.15 < whole.mean() < 0.35
+
+
+def test_reservoir_keeps_at_most_per_class_rows_of_each_class():
+    reservoir = ml_streaming.StratifiedReservoir(per_class=50)
+    df = ml_streaming.prepare_batch(_silver(2000))
+    for batch in _batches(df, 300):
+        reservoir.add(ml_streaming.hash_features(batch, 16), batch["low_review"].to_numpy())
+
+    X, y = reservoir.sample()
+    assert X.shape[0] == 100
+    assert (np.bincount(y) == [50, 50]).all()
+    assert reservoir.seen[1] == df["low_review"].sum()
+
+
+def test_streamed_training_learns_the_signal():
+    df = _silver(4000)
+    sgd, forest, trained = ml_streaming.train_streaming(_batches(df, 500), forest_sample=400)
+    assert trained == (~ml_streaming.holdout_mask(df)).sum()
+
+    report = ml_streaming.evaluate_streaming({"sgd": sgd, "forest": forest}, _batches(df, 500))
+    assert sum(map(sum, report["sgd"]["confusion"])) == ml_streaming.holdout_mask(df).sum()
+    assert report["sgd"]["f1"] > 0.9
+    assert report["forest"]["f1"] > 0.9
+
+
+def test_silver_table_is_read_in_batches():
+    engine = sqlalchemy.create_engine("sqlite://")
+    _silver(1234).to_sql(ml_streaming.SILVER_TABLE, engine, index=False)
+    sizes = [len(b) for b in ml_streaming.iter_silver_batches(500, engine=engine)]
+    assert sizes == [500, 500, 234]
+
+
+def test_streaming_training_saves_artifacts_that_score(tmp_path, monkeypatch):
+    df = _silver(3000)
+    engine = sqlalchemy.create_engine("sqlite://")
+    df.to_sql(ml_streaming.SILVER_TABLE, engine, index=False)
+    monkeypatch.setattr(ml_streaming, "get_engine", lambda: engine)
+    cfg = {
+        "defaults": {
+            "ml_training": "streaming",
+            "ml_batch_size": 700,
+            "ml_forest_sample": 400,
+            "ml_model_dir": str(tmp_path),
+        }
+    }
+    monkeypatch.setattr(ml_analysis, "load_sources_config", lambda: cfg)
+
+    ml_analysis.main()
+
+    artifacts = ml_analysis.load_artifacts(model_dir=tmp_path)
+    # batch-by-batch id of the streamed rows, same as hashing the whole frame
+    whole = next(ml_streaming.iter_silver_batches(len(df), engine=engine))
+    assert artifacts["snapshot"] == ml_analysis.data_snapshot_id(whole)
+    assert isinstance(artifacts["vocabulary"], ml_streaming.HashedFeatures)
+    assert set(artifacts["models"]) == {"log_reg", "random_forest"}
+
+    expected = (df["review_rating"].head(50) <= 2).astype(int).tolist()
+    for model_name in ("log_reg", "random_forest"):
+        scores = ml_analysis.predict_batch(artifacts, df.head(50), model_name)
+        assert (scores["low_review_pred"] == expected).mean() > 0.9
+
+    # Unchanged table: the snapshot pass finds the saved models, no retraining
+    def no_training(**kwargs):
+        raise AssertionError("retrained on unchanged data")
+
+    monkeypatch.setattr(ml_streaming, "run_streaming_training", no_training)
+    ml_analysis.main()
+    assert ml_analysis.load_artifacts(model_dir=tmp_path)["snapshot"] == artifacts["snapshot"]
+
+    # A changed row gives a new snapshot and trains again
+    calls = []
+
+    def fake_training(**kwargs):
+        calls.append(kwargs)
+        return {"models": artifacts["models"], "features": artifacts["vocabulary"], "snapshot": "changed", "rows": 1}
+
+    monkeypatch.setattr(ml_streaming, "run_streaming_training", fake_training)
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text(f"UPDATE {ml_streaming.SILVER_TABLE} SET review_rating = 5 WHERE rowid = 1"))
+    ml_analysis.main()
+    assert len(calls) == 1
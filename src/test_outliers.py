@@ -0,0 +1,127 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy
+from sqlalchemy.dialects import postgresql
+
+from src import outliers, running_stats
+from src.ml_analysis import detect_outliers
+
+
+def _silver_engine(n=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    items = rng.choice(["Jeans", "Handbag"], n)
+    # Handbags cost ~10x more, so a per-item check flags different rows than a global one
+    amounts = np.where(items == "Handbag", rng.normal(1000, 50, n), rng.normal(100, 5, n))
+    amounts[:3] = [5000.0, 160.0, -900.0]
+    df = pd.DataFrame(
+        {
+            "customer_reference_id": np.arange(n),
+            "item_purchased": items,
+            "date_purchase": pd.Timestamp("2023-01-01") + pd.to_timedelta(np.arange(n) % 90, unit="D"),
+            "purchase_amount_usd": amounts,
+            "review_rating": 3.0,
+            "payment_method": "Cash",
+        }
+    )
+    df.loc[5, "purchase_amount_usd"] = None
+    engine = sqlalchemy.create_engine("sqlite://")
+    df.to_sql(outliers.SILVER_TABLE, engine, index=False)
+    return df, engine
+
+
+def test_sql_zscore_flags_the_same_rows_as_pandas():
+    df, engine = _silver_engine()
+    expected = detect_outliers(df, z_thresh=3.0)
+    flagged = outliers.detect_outliers_sql(z_thresh=3.0, engine=engine)
+
+    assert flagged["customer_reference_id"].tolist() == expected["customer_reference_id"].tolist()
+    np.testing.assert_allclose(flagged["z_score"], expected["z_score"])
+    assert set(flagged["outlier_group"]) == {"all"}
+
+
+def test_zscore_variance_is_stable_for_large_clustered_amounts():
+    rng = np.random.default_rng(2)
+    amounts = 1e9 + rng.normal(0, 0.01, 500)
+    df = pd.DataFrame(
+        {"customer_reference_id": np.arange(500), "item_purchased": "Jeans", "purchase_amount_usd": amounts}
+    )
+    engine = sqlalchemy.create_engine("sqlite://")
+    df.to_sql(outliers.SILVER_TABLE, engine, index=False)
+
+    stats = outliers.zscore_stats(engine).iloc[0]
+    # E[x^2] - E[x]^2 is pure rounding noise here (1e18 vs a variance of 1e-4)
+    assert stats["scale"] == pytest.approx(amounts.std(), rel=1e-3)
+
+
+def test_grouped_statistics_flag_per_item_and_per_month():
+    _, engine = _silver_engine()
+    by_item = outliers.detect_outliers_sql(z_thresh=3.0, group_by="item", engine=engine)
+    # 160 is a normal amount overall but 12 std above the other Jeans
+    assert {0, 1, 2} <= set(by_item["customer_reference_id"])
+    assert set(by_item["outlier_group"]) <= {"Jeans", "Handbag"}
+
+    by_month = outliers.detect_outliers_sql(z_thresh=3.0, group_by="month", engine=engine)
+    assert set(by_month["outlier_group"]) <= {"2023-01", "2023-02", "2023-03"}
+
+    with pytest.raises(ValueError):
+        outliers.detect_outliers_sql(group_by="week", engine=engine)
+
+
+def test_robust_mode_merges_the_stored_sketches_without_scanning_the_table():
+    _, engine = _silver_engine()
+    running_stats._ensured.clear()
+    running_stats.rebuild_amount_sketches(outliers.SILVER_TABLE, engine, batch_size=500)
+
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text(f"ALTER TABLE {outliers.SILVER_TABLE} RENAME TO hidden"))
+        stats = outliers.robust_stats(conn, group_by="item").set_index("grp")
+        whole = outliers.robust_stats(conn)
+        by_month = outliers.robust_stats(conn, group_by="month")
+        conn.execute(sqlalchemy.text(f"ALTER TABLE hidden RENAME TO {outliers.SILVER_TABLE}"))
+
+    assert stats.loc["Jeans", "center"] == pytest.approx(100, abs=1)
+    assert stats.loc["Jeans", "scale"] == pytest.approx(5, rel=0.2)
+    assert whole["grp"].tolist() == ["all"] and whole["n"].iloc[0] == 2999  # one amount is NULL
+    assert sorted(by_month["grp"]) == ["2023-01", "2023-02", "2023-03"]
+
+    flagged = outliers.detect_outliers_sql(z_thresh=3.5, method="robust", group_by="item", engine=engine)
+    assert {0, 1, 2} <= set(flagged["customer_reference_id"])
+    assert flagged["z_score"].abs().is_monotonic_decreasing
+
+
+def test_running_method_reads_the_stats_table_maintained_by_the_load():
+    df, engine = _silver_engine()
+    stats = running_stats.aggregate_rows(df).reset_index()
+    stats["purchase_day"] = pd.to_datetime(stats["purchase_day"])
+    stats.to_sql(outliers.STATS_TABLE, engine, index=False)
+
+    for group_by in (None, "item", "month"):
+        expected = outliers.detect_outliers_sql(z_thresh=3.0, group_by=group_by, engine=engine)
+        flagged = outliers.detect_outliers_sql(z_thresh=3.0, method="running", group_by=group_by, engine=engine)
+        assert flagged["customer_reference_id"].tolist() == expected["customer_reference_id"].tolist()
+        np.testing.assert_allclose(flagged["z_score"], expected["z_score"])
+
+
+def test_ungrouped_statistics_sql_is_valid_on_postgres(monkeypatch):
+    """PostgreSQL rejects GROUP BY <constant>; the whole-table case must aggregate without it."""
+    queries = []
+
+    def capture(query, engine, **kwargs):
+        queries.append(str(query.compile(dialect=postgresql.dialect())))
+        return pd.DataFrame(columns=["grp", "n", "mean", "variance", "total", "total_sq"])
+
+    monkeypatch.setattr(outliers.pd, "read_sql", capture)
+    outliers.zscore_stats(engine=None)
+    outliers.running_zscore_stats(engine=None)
+    outliers.zscore_stats(engine=None, group_by="item")
+
+    whole_table, running, by_item = queries
+    for sql in (whole_table, running):
+        assert "'all' AS grp" in sql
+    assert "GROUP BY" not in running
+    assert "GROUP BY s.item_purchased" in by_item
+    # no GROUP BY on a literal anywhere
+    assert not any(re.search(r"GROUP BY\s+'", sql) for sql in queries)
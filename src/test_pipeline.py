@@ -0,0 +1,47 @@
+import warnings
+
+import pandas as pd
+
+from src.clean import clean_fashion_sales
+from src.pipeline import transform_chunk
+from src.validate import apply_business_rules, apply_schema_casts
+
+SCHEMA = {
+    "customer reference id": "int",
+    "item purchased": "str",
+    "purchase amount (usd)": "float",
+    "date purchase": "datetime",
+    "review rating": "float",
+    "payment method": "str",
+}
+
+
+def _raw_chunk():
+    return pd.DataFrame(
+        {
+            "customer reference id": ["1", "bad", "2", "3", "3"],
+            "item purchased": [" handbag ", "Hat", "Jeans", "tunic", "Tunic "],
+            "purchase amount (usd)": ["10.0", "5.0", "-1.0", "20.0", "25.0"],
+            "date purchase": ["2023-01-01", "2023-01-02", "2023-01-03", "2023-01-04", "2023-01-04"],
+            "review rating": ["4.0", "3.0", "2.0", "5.0", "1.0"],
+            "payment method": ["Cash", "Cash", "Cash", "Credit Card", "Cash"],
+        }
+    )
+
+
+def test_transform_chunk_matches_the_three_step_wrappers():
+    valid_df, cast_rejects = apply_schema_casts(_raw_chunk(), SCHEMA)
+    rule_valid_df, rule_rejects = apply_business_rules(valid_df)
+    expected = clean_fashion_sales(rule_valid_df)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")  # no SettingWithCopy on the in-place steps
+        clean_df, cast_reject_df, rule_reject_df = transform_chunk(_raw_chunk(), SCHEMA)
+
+    pd.testing.assert_frame_equal(clean_df.reset_index(drop=True), expected.reset_index(drop=True))
+    assert len(cast_reject_df) == len(cast_rejects) == 1
+    assert len(rule_reject_df) == len(rule_rejects) == 1
+    assert rule_reject_df["failed_rules"].tolist() == ["purchase amount (usd) >= 0"]
+
+    # Rows keep their position in the source chunk; the "3, Tunic" duplicate keeps the last one
+    assert clean_df.index.tolist() == [0, 4]
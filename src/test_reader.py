@@ -0,0 +1,171 @@
+import gzip
+
+import pandas as pd
+import pytest
+from src.reader import (
+    read_csv,
+    read_csv_chunks,
+    read_csv_parallel,
+    read_parquet,
+    read_parquet_chunks,
+    compression_of,
+    split_byte_ranges,
+)
+
+
+def _write_sample_csv(path, n_rows):
+    df = pd.DataFrame(
+        {
+            " Customer Reference ID ": range(n_rows),
+            "Item Purchased": ["Jeans"] * n_rows,
+        }
+    )
+    df.to_csv(path, index=False)
+
+
+def test_read_csv_chunks_yields_bounded_normalized_chunks(tmp_path):
+    path = tmp_path / "sales.csv"
+    _write_sample_csv(path, 7)
+
+    chunks = list(read_csv_chunks(str(path), chunksize=3))
+
+    # 7 rows in chunks of 3 -> 3 + 3 + 1
+    assert [len(c) for c in chunks] == [3, 3, 1]
+
+    # Every chunk gets the same column normalization as read_csv
+    for chunk in chunks:
+        assert list(chunk.columns) == ["customer reference id", "item purchased"]
+
+    # Concatenated chunks match the full read
+    full = read_csv(str(path))
+    pd.testing.assert_frame_equal(pd.concat(chunks), full)
+
+
+def test_read_csv_chunks_pyarrow_engine_projects_schema_columns(tmp_path):
+    path = tmp_path / "sales.csv"
+    _write_sample_csv(path, 5)
+
+    chunks = list(
+        read_csv_chunks(
+            str(path),
+            chunksize=2,
+            columns=["item purchased"],
+            engine="pyarrow",
+            dtype_backend="pyarrow",
+        )
+    )
+
+    assert [len(c) for c in chunks] == [2, 2, 1]
+    assert list(chunks[0].columns) == ["item purchased"]
+    assert isinstance(chunks[0]["item purchased"].dtype, pd.ArrowDtype)
+    # Running index like pandas' own chunked reader
+    assert chunks[2].index.tolist() == [4]
+
+
+@pytest.mark.parametrize("dtype_backend", [None, "pyarrow"])
+def test_pyarrow_chunks_leave_a_dirty_row_after_the_first_block_to_cast_columns(tmp_path, dtype_backend):
+    from src.validate import cast_columns
+
+    path = tmp_path / "sales.csv"
+    n_rows = 300_000  # several MB: well past pyarrow's first (type-inference) block
+    with open(path, "w") as f:
+        f.write("Customer Reference ID,Item Purchased\n")
+        f.writelines(f"{i},Jeans\n" for i in range(n_rows))
+        f.write("x1,Jeans\n,\n")
+
+    chunks = list(read_csv_chunks(str(path), chunksize=100_000, engine="pyarrow", dtype_backend=dtype_backend))
+    df = pd.concat(chunks)
+
+    assert len(df) == n_rows + 2
+    assert df["customer reference id"].iloc[-2] == "x1"
+    assert df["customer reference id"].isna().iloc[-1]  # empty field is missing, not ""
+
+    schema = {"customer reference id": "int", "item purchased": "str"}
+    clean, dirty = chunks[-2], chunks[-1]
+    assert not cast_columns(clean, schema).any()
+    assert clean["customer reference id"].iloc[-1] == n_rows - 1
+    assert cast_columns(dirty, schema).tolist() == [True, True]
+
+
+def test_read_parquet_chunks_projects_and_normalizes(tmp_path):
+    path = tmp_path / "sales.parquet"
+    pd.DataFrame(
+        {
+            "Customer Reference ID": [1, 2, 3],
+            "Item Purchased": ["Jeans", "Hat", "Tunic"],
+            "Unused Column": ["x", "y", "z"],
+        }
+    ).to_parquet(path)
+
+    chunks = list(
+        read_parquet_chunks(str(path), chunksize=2, columns=["customer reference id", "item purchased"])
+    )
+
+    assert [len(c) for c in chunks] == [2, 1]
+    assert list(chunks[0].columns) == ["customer reference id", "item purchased"]
+    assert read_parquet(str(path), columns=["item purchased"])["item purchased"].tolist() == ["Jeans", "Hat", "Tunic"]
+
+
+def _write_rows(path, n_rows):
+    lines = ["Customer Reference ID , Item Purchased,Review Rating"]
+    lines += [f"{i},Item {i % 7},{i % 5}.0" for i in range(n_rows)]
+    path.write_text("\n".join(lines) + "\n")
+
+
+def test_split_byte_ranges_are_line_aligned_and_cover_the_data(tmp_path):
+    path = tmp_path / "sales.csv"
+    _write_rows(path, 200)
+    data = path.read_bytes()
+    header_end = data.index(b"\n") + 1
+
+    ranges = split_byte_ranges(str(path), range_bytes=300)
+
+    assert len(ranges) > 1
+    assert ranges[0][0] == header_end and ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start and data[start - 1:start] == b"\n"
+
+
+def test_read_csv_parallel_matches_sequential_reader(tmp_path):
+    path = tmp_path / "sales.csv"
+    _write_rows(path, 500)
+    expected = read_csv(str(path))
+
+    ordered = pd.concat(read_csv_parallel(str(path), chunksize=60, workers=2))
+    pd.testing.assert_frame_equal(ordered, expected)
+
+    unordered = list(read_csv_parallel(str(path), chunksize=60, workers=2, ordered=False, columns=["review rating"]))
+    merged = pd.concat(unordered).sort_index()
+    assert list(merged.columns) == ["review rating"]
+    assert merged["review rating"].tolist() == expected["review rating"].tolist()
+    assert merged.index.is_unique and len(unordered) > 1
+
+
+def test_memory_mapped_reads_match_buffered_reads(tmp_path):
+    path = tmp_path / "sales.csv"
+    _write_rows(path, 300)
+    offset = path.read_bytes().index(b"\n100,") + 1
+
+    for start in (0, offset):
+        expected = pd.concat(read_csv_chunks(str(path), chunksize=70, start_offset=start))
+        mapped = pd.concat(read_csv_chunks(str(path), chunksize=70, start_offset=start, memory_map=True))
+        pd.testing.assert_frame_equal(mapped, expected)
+
+    parallel = pd.concat(read_csv_parallel(str(path), chunksize=70, workers=2, memory_map=True))
+    pd.testing.assert_frame_equal(parallel, read_csv(str(path)))
+
+
+def test_gzip_csv_is_decompressed_while_streaming(tmp_path):
+    path = tmp_path / "sales.csv"
+    _write_rows(path, 300)
+    gz_path = tmp_path / "sales.csv.gz"
+    gz_path.write_bytes(gzip.compress(path.read_bytes()))
+
+    assert compression_of(gz_path) == "gzip" and compression_of(path) is None
+    expected = read_csv(str(path))
+    pd.testing.assert_frame_equal(pd.concat(read_csv_chunks(str(gz_path), chunksize=70)), expected)
+    # byte ranges cannot be cut in a compressed stream: falls back to sequential chunks
+    pd.testing.assert_frame_equal(pd.concat(read_csv_parallel(str(gz_path), chunksize=70, workers=2)), expected)
+
+    with pytest.raises(ValueError):
+        next(read_csv_chunks(str(gz_path), chunksize=70, start_offset=10))
@@ -0,0 +1,92 @@
+import pandas as pd
+import pytest
+
+from src.rules import compile_rules, evaluate_rules
+from src.validate import apply_business_rules
+
+
+def test_compile_rules_parses_sources_yml_shapes():
+    rules = compile_rules(
+        [
+            {"rule": "purchase amount (usd) >= 0"},
+            {"rule": "review rating BETWEEN 0 AND 5"},
+            {"rule": "payment method IN ('Cash','Credit Card')"},
+            "item purchased is not blank",
+        ]
+    )
+
+    assert [r.column for r in rules] == [
+        "purchase amount (usd)",
+        "review rating",
+        "payment method",
+        "item purchased",
+    ]
+
+
+def test_compile_rules_rejects_unknown_expressions():
+    with pytest.raises(ValueError):
+        compile_rules(["purchase amount (usd) LIKE '%x%'"])
+
+
+def test_evaluate_rules_null_semantics_and_skips_missing_columns():
+    df = pd.DataFrame(
+        {
+            "review rating": [None, 2.0, 7.0],
+            "payment method": [None, "Cash", "Debit"],
+        }
+    )
+    rules = compile_rules(
+        [
+            "review rating BETWEEN 0 AND 5",
+            "payment method NOT IN ('Debit')",
+            "payment method IN ('Cash')",
+            "purchase amount (usd) > 0",   # column not in df -> skipped
+        ]
+    )
+
+    fail_matrix, rules_used = evaluate_rules(df, rules)
+
+    assert len(rules_used) == 3
+    # NULL rating passes BETWEEN, 7.0 fails
+    assert fail_matrix[:, 0].tolist() == [False, False, True]
+    # NOT IN: NULL is not 'Debit' -> passes
+    assert fail_matrix[:, 1].tolist() == [False, False, True]
+    # IN: NULL is rejected
+    assert fail_matrix[:, 2].tolist() == [True, False, True]
+
+
+def test_apply_business_rules_tags_failed_rules_and_counts():
+    df = pd.DataFrame(
+        {
+            "purchase amount (usd)": [100.0, -1.0, 5.0],
+            "review rating": [4.0, 9.0, 3.0],
+        }
+    )
+    counts = {}
+
+    valid_df, reject_df = apply_business_rules(
+        df,
+        rules=[{"rule": "purchase amount (usd) >= 0"}, {"rule": "review rating BETWEEN 0 AND 5"}],
+        counts=counts,
+    )
+
+    assert len(valid_df) == 2
+    assert reject_df["failed_rules"].tolist() == [
+        "purchase amount (usd) >= 0; review rating BETWEEN 0 AND 5"
+    ]
+    assert counts == {"purchase amount (usd) >= 0": 1, "review rating BETWEEN 0 AND 5": 1}
+
+
+def test_rules_on_categorical_columns_use_the_category_dictionary():
+    df = pd.DataFrame(
+        {
+            "payment method": pd.Categorical(["Cash", "Debit", None, "Credit Card"]),
+            "item purchased": pd.Categorical(["Jeans", "  ", "Hat", None]),
+        }
+    )
+    rules = compile_rules(["payment method IN ('Cash', 'Credit Card')", "item purchased IS NOT BLANK"])
+
+    fail_matrix, _ = evaluate_rules(df, rules)
+
+    assert fail_matrix[:, 0].tolist() == [False, True, True, False]
+    assert fail_matrix[:, 1].tolist() == [False, True, False, True]
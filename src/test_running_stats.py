@@ -0,0 +1,219 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy
+
+from src import running_stats
+from src.sketch import QuantileSketch
+
+
+def _rows(ids, amounts, ratings, payments, item="Jeans", day="2023-03-01"):
+    return pd.DataFrame(
+        {
+            "customer_reference_id": ids,
+            "item_purchased": item,
+            "date_purchase": pd.Timestamp(day),
+            "purchase_amount_usd": amounts,
+            "review_rating": ratings,
+            "payment_method": payments,
+        }
+    )
+
+
+def _apply(table: pd.DataFrame, stats: pd.DataFrame, batch: pd.DataFrame):
+    """What the load does: delta from the stored rows, upsert the rows, add the delta to the stats."""
+    keys = running_stats.KEY_COLS
+    stored = table.merge(batch[keys], on=keys)
+    delta = running_stats.batch_delta(batch, stored).set_index(running_stats.GROUP_COLS)
+    additive = running_stats.ADDITIVE_COLS
+
+    stats = stats.reindex(stats.index.union(delta.index))
+    stats[additive] = stats[additive].fillna(0) + delta[additive].reindex(stats.index).fillna(0)
+    stats["amount_min"] = np.fmin(stats["amount_min"], delta["amount_min"].reindex(stats.index))
+    stats["amount_max"] = np.fmax(stats["amount_max"], delta["amount_max"].reindex(stats.index))
+
+    table = pd.concat([table, batch]).drop_duplicates(subset=keys, keep="last").reset_index(drop=True)
+    return table, stats
+
+
+def test_aggregates_cover_moments_extremes_and_rating_histogram():
+    agg = running_stats.aggregate_rows(_rows([1, 2, 3], [10.0, 30.0, None], [1.5, 5.0, None], "Cash"))
+    row = agg.iloc[0]
+    assert (row["row_count"], row["amount_count"], row["amount_sum"], row["amount_sumsq"]) == (3, 2, 40.0, 1000.0)
+    assert (row["amount_min"], row["amount_max"]) == (10.0, 30.0)
+    assert (row["rating_count"], row["rating_sum"], row["rating_1"], row["rating_5"]) == (2, 6.5, 1, 1)
+
+
+def test_batch_delta_moves_updated_rows_between_groups_and_skips_unchanged_ones():
+    stored = _rows([1, 2], [10.0, 20.0], [4.0, 2.0], "Cash")
+    batch = _rows([1, 2, 3], [10.0, 25.0, 5.0], [4.0, 2.0, 3.0], ["Cash", "Credit Card", "Cash"])
+
+    delta = running_stats.batch_delta(batch, stored).set_index("payment_method")
+    # Row 1 is unchanged; row 2 moved from Cash to Credit Card with a new amount; row 3 is new
+    assert delta.loc["Cash", "row_count"] == 0
+    assert delta.loc["Cash", "amount_sum"] == 5.0 - 20.0
+    assert delta.loc["Cash", "rating_2"] == -1
+    assert delta.loc["Credit Card", "row_count"] == 1
+    assert delta.loc["Credit Card", "amount_sum"] == 25.0
+    # Extremes only come from incoming rows
+    assert delta.loc["Cash", "amount_min"] == 5.0
+
+
+def test_incremental_stats_match_a_full_recompute():
+    rng = np.random.default_rng(0)
+    table = _rows([], [], [], []).astype({"customer_reference_id": int})
+    stats = pd.DataFrame(columns=running_stats.STATS_COLS).set_index(running_stats.GROUP_COLS).astype(float)
+
+    for _ in range(5):
+        ids = rng.choice(40, 15, replace=False)
+        batch = pd.concat(
+            [
+                _rows(ids[:8], rng.uniform(5, 100, 8), rng.integers(0, 6, 8).astype(float), "Cash", item="Hat"),
+                _rows(ids[8:], rng.uniform(5, 100, 7), rng.integers(0, 6, 7).astype(float), "Credit Card"),
+            ],
+            ignore_index=True,
+        )
+        table, stats = _apply(table, stats, batch)
+
+    expected = running_stats.aggregate_rows(table)
+    additive = running_stats.ADDITIVE_COLS
+    got = stats.loc[expected.index, additive].astype(float)
+    np.testing.assert_allclose(got.to_numpy(), expected[additive].astype(float).to_numpy())
+    # min / max are only ever widened: they bound the true extremes
+    assert (stats.loc[expected.index, "amount_min"] <= expected["amount_min"]).all()
+    assert (stats.loc[expected.index, "amount_max"] >= expected["amount_max"]).all()
+    assert (stats.loc[stats["row_count"] == 0, "amount_sum"].abs() < 1e-9).all()
+
+
+class FakeCursor:
+    def __init__(self, stored):
+        self.executed = []
+        self.stored = stored
+
+    def execute(self, sql):
+        self.executed.append(sql)
+
+    def fetchall(self):
+        return self.stored
+
+
+class FakeEngine:
+    def __init__(self, fail=False):
+        self.executed = []
+        self.fail = fail
+
+    @contextmanager
+    def begin(self):
+        conn = SimpleNamespace(execute=lambda stmt: self.executed.append(str(stmt)))
+        yield conn
+        if self.fail:
+            raise RuntimeError("commit failed")
+
+
+def _record_execute_values(monkeypatch, fetched=()):
+    """Replace execute_values; fetch=True calls (the sketch SELECT) return `fetched`."""
+    calls = []
+
+    def fake_execute_values(cur, sql, rows, page_size=None, fetch=False):
+        calls.append((sql, rows, page_size))
+        return list(fetched) if fetch else None
+
+    monkeypatch.setattr(running_stats, "execute_values", fake_execute_values)
+    return calls
+
+
+def test_stats_table_is_remembered_only_after_its_create_committed(monkeypatch):
+    running_stats._ensured.clear()
+    with pytest.raises(RuntimeError):
+        running_stats.ensure_stats_table("stg_fashion_sales", FakeEngine(fail=True))
+    assert not running_stats._ensured
+
+    engine = FakeEngine()
+    running_stats.ensure_stats_table("stg_fashion_sales", engine)
+    running_stats.ensure_stats_table("stg_fashion_sales", engine)
+    assert len(engine.executed) == 2
+    assert engine.executed[0].startswith('CREATE TABLE IF NOT EXISTS "stg_fashion_sales_stats"')
+    assert engine.executed[1].startswith('CREATE TABLE IF NOT EXISTS "stg_fashion_sales_amount_sketch"')
+
+
+def test_apply_batch_reads_stored_rows_from_staging_then_upserts_the_delta(monkeypatch):
+    running_stats._ensured.clear()
+    engine = FakeEngine()
+    monkeypatch.setattr(running_stats, "get_engine", lambda: engine)
+    calls = _record_execute_values(monkeypatch)
+
+    cursor = FakeCursor(stored=[(1, "Jeans", pd.Timestamp("2023-03-01"), 10.0, 4.0, "Cash")])
+    batch = _rows([1, 2], [12.0, 20.0], [4.0, 1.0], "Cash")
+    groups = running_stats.apply_batch(cursor, "stg_fashion_sales", batch, staging_table="tmp_stage")
+    running_stats.apply_batch(cursor, "stg_fashion_sales", batch.iloc[:0], staging_table="tmp_stage")
+
+    assert groups == 1
+    # CREATE went through its own transaction, not the load cursor
+    assert engine.executed[0].startswith('CREATE TABLE IF NOT EXISTS "stg_fashion_sales_stats"')
+    assert len(cursor.executed) == 1
+    assert 'JOIN "tmp_stage" s USING' in cursor.executed[0]
+    sql, rows, page_size = [c for c in calls if '"stg_fashion_sales_stats"' in c[0]][0]
+    assert page_size == running_stats.DEFAULT_PAGE_SIZE
+    assert sql.startswith('INSERT INTO "stg_fashion_sales_stats" AS s')
+    assert "amount_max = GREATEST(s.amount_max, EXCLUDED.amount_max)" in sql
+    row = dict(zip(running_stats.STATS_COLS, rows[0]))
+    # one new row, one replaced 10.0 -> 12.0
+    assert (row["row_count"], row["amount_sum"], row["rating_4"], row["rating_1"]) == (1, 22.0, 0, 1)
+
+
+def test_key_lookup_and_stats_upsert_are_paged_by_the_batch_size(monkeypatch):
+    monkeypatch.setattr(running_stats, "ensure_stats_table", lambda table_name: None)
+    calls = _record_execute_values(monkeypatch)
+
+    days = pd.date_range("2023-03-01", periods=7, freq="D")
+    batch = pd.concat([_rows([i], [10.0], [4.0], "Cash", day=d) for i, d in enumerate(days)], ignore_index=True)
+    groups = running_stats.apply_batch(FakeCursor(stored=[]), "stg_fashion_sales", batch, page_size=3)
+
+    assert groups == 7
+    lookup, *sketch_calls, upsert = calls
+    assert "JOIN (VALUES %s)" in lookup[0] and upsert[0].startswith('INSERT INTO "stg_fashion_sales_stats"')
+    assert (len(lookup[1]), len(upsert[1])) == (7, 7)
+    assert len(sketch_calls) == 3  # one (item, month) sketch: ensure row, lock + read, write back
+    assert {c[2] for c in calls} == {3}
+
+
+def test_amount_sketches_are_locked_merged_and_written_back(monkeypatch):
+    stored = QuantileSketch()
+    stored.update([1.0, 2.0, 3.0])
+    calls = _record_execute_values(monkeypatch, fetched=[("Jeans", "2023-03", stored.to_json())])
+
+    batch = pd.concat(
+        [_rows([1, 2], [10.0, None], [4.0, 1.0], "Cash"), _rows([3], [7.0], [2.0], "Cash", item="Hat", day="2023-04-02")],
+        ignore_index=True,
+    )
+    assert running_stats.apply_sketch_batch(FakeCursor(stored=[]), "stg_fashion_sales", batch) == 2
+
+    ensure, select, write = calls
+    # sorted keys: every loader locks the rows in the same order
+    assert ensure[1] == [("Hat", "2023-04"), ("Jeans", "2023-03")]
+    assert "ON CONFLICT (item_purchased, purchase_month) DO NOTHING" in ensure[0]
+    assert select[0].endswith("FOR UPDATE OF t")
+    written = {(item, month): QuantileSketch.from_json(value) for item, month, value, _ in write[1]}
+    assert written[("Jeans", "2023-03")].n == 4  # 3 stored + the non-null new amount
+    assert written[("Hat", "2023-04")].n == 1
+    assert written[("Jeans", "2023-03")].quantile(1.0) == 10.0
+
+
+def test_rebuilt_sketches_cover_the_table(tmp_path):
+    running_stats._ensured.clear()
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'silver.db'}")
+    table = pd.concat(
+        [_rows(range(100), np.arange(100.0), 4.0, "Cash"), _rows(range(50), np.arange(50.0), 4.0, "Cash", item="Hat")],
+        ignore_index=True,
+    )
+    table.to_sql("stg_fashion_sales", engine, index=False)
+
+    assert running_stats.rebuild_amount_sketches("stg_fashion_sales", engine, batch_size=30) == 2
+    stored = pd.read_sql("SELECT * FROM stg_fashion_sales_amount_sketch ORDER BY item_purchased", engine)
+    assert stored["purchase_month"].tolist() == ["2023-03", "2023-03"]
+    sketches = [QuantileSketch.from_json(v) for v in stored["sketch"]]
+    assert [s.n for s in sketches] == [50, 100]
+    assert sketches[1].quantile(0.5) == pytest.approx(50, abs=3)
@@ -0,0 +1,45 @@
+from src.scheduler import combine_summaries, run_parallel
+
+
+def _fake_run_source(job, write_slots):
+    # same job shape as main.run builds
+    source = job["source"]
+    if source["name"].startswith("broken"):
+        raise ValueError(f"bad file {source['path']}")
+    with write_slots:
+        return {"source": source["name"], "status": "ok", "loaded_raw": source["rows"], "loaded_to_db": source["rows"]}
+
+
+def _job(name, rows):
+    return {"cfg": {"defaults": {}}, "source": {"name": name, "path": f"data/{name}.csv", "rows": rows}}
+
+
+def test_run_parallel_keeps_job_order_and_isolates_failures():
+    jobs = [_job("store_a", 10), _job("broken_1", 0), _job("store_b", 5), _job("broken_2", 0)]
+
+    summaries = run_parallel(_fake_run_source, jobs, max_workers=2, max_db_writers=1)
+
+    assert [s["source"] for s in summaries] == ["store_a", "broken_1", "store_b", "broken_2"]
+    assert summaries[1]["status"] == "failed"
+    assert "bad file data/broken_1.csv" in summaries[1]["error"]
+    assert summaries[2]["loaded_raw"] == 5
+
+    # failures are reported under their own names, not collapsed into one key
+    assert combine_summaries(summaries, wall_seconds=1.0)["failed_sources"] == ["broken_1", "broken_2"]
+
+
+def test_combine_summaries_adds_counters_and_lists_failures():
+    summaries = [
+        {"source": "a", "status": "ok", "loaded_raw": 10, "loaded_to_db": 8, "runtime_seconds": 1.5},
+        {"source": "b", "status": "ok", "loaded_raw": 4, "loaded_to_db": 4, "runtime_seconds": 2.0},
+        {"source": "c", "status": "failed", "error": "boom"},
+    ]
+
+    combined = combine_summaries(summaries, wall_seconds=2.1)
+
+    assert combined["sources"] == 3
+    assert combined["failed_sources"] == ["c"]
+    assert combined["loaded_raw"] == 14
+    assert combined["loaded_to_db"] == 12
+    assert combined["runtime_seconds"] == 3.5
+    assert combined["wall_seconds"] == 2.1
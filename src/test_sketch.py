@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from src.sketch import QuantileSketch
+
+
+def test_quantile_sketch_stays_small_and_accurate():
+    values = np.random.default_rng(1).lognormal(3, 1, 200_000)
+    sketch = QuantileSketch(k=200)
+    for batch in np.array_split(values, 40):
+        sketch.update(batch)
+
+    assert sketch.n == len(values)
+    assert sum(len(level) for level in sketch.levels) < 1000
+    for q in (0.1, 0.5, 0.9):
+        # rank error, not value error
+        assert abs((values <= sketch.quantile(q)).mean() - q) < 0.02
+
+    median, mad = sketch.median_mad()
+    true_median = np.median(values)
+    assert median == pytest.approx(true_median, rel=0.05)
+    assert mad == pytest.approx(np.median(np.abs(values - true_median)), rel=0.1)
+
+
+def test_merged_sketches_match_one_sketch_of_everything():
+    values = np.random.default_rng(3).normal(100, 15, 100_000)
+    merged = QuantileSketch(k=200)
+    for part in np.array_split(values, 25):
+        piece = QuantileSketch(k=200)
+        piece.update(part)
+        # round trip through the stored form on the way
+        merged.merge(QuantileSketch.from_json(piece.to_json()))
+
+    assert merged.n == len(values)
+    assert sum(len(level) for level in merged.levels) < 1000
+    for q in (0.05, 0.5, 0.95):
+        assert abs((values <= merged.quantile(q)).mean() - q) < 0.02
+    assert QuantileSketch.from_json(None).n == 0
@@ -0,0 +1,56 @@
+import os
+
+from src.reader import read_csv
+from src.state import fingerprint_file, load_state, plan_ingest, save_state
+
+HEADER = "Customer Reference ID,Item Purchased\n"
+
+
+def _write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def test_plan_ingest_full_then_skip_when_unchanged(tmp_path):
+    path = tmp_path / "sales.csv"
+    _write(path, HEADER + "1,Jeans\n")
+
+    first = plan_ingest(str(path), None)
+    assert first["mode"] == "full"
+
+    save_state("sales", {"fingerprint": first["fingerprint"]}, state_dir=tmp_path / "state")
+    previous = load_state("sales", state_dir=tmp_path / "state")
+
+    assert plan_ingest(str(path), previous)["mode"] == "skip"
+
+    # Touching the file (new mtime, same bytes) is still a skip
+    os.utime(path, (1, 1))
+    assert plan_ingest(str(path), previous)["mode"] == "skip"
+
+
+def test_plan_ingest_append_resumes_from_old_end(tmp_path):
+    path = tmp_path / "sales.csv"
+    _write(path, HEADER + "1,Jeans\n")
+    previous = {"fingerprint": fingerprint_file(str(path))}
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("2,Hat\n3,Tunic\n")
+
+    plan = plan_ingest(str(path), previous)
+    assert plan["mode"] == "append"
+    assert plan["offset"] == previous["fingerprint"]["size"]
+
+    # Reading from the offset only returns the new rows, with the original header
+    new_rows = read_csv(str(path), start_offset=plan["offset"])
+    assert list(new_rows.columns) == ["customer reference id", "item purchased"]
+    assert new_rows["item purchased"].tolist() == ["Hat", "Tunic"]
+
+
+def test_plan_ingest_full_when_old_content_changed(tmp_path):
+    path = tmp_path / "sales.csv"
+    _write(path, HEADER + "1,Jeans\n")
+    previous = {"fingerprint": fingerprint_file(str(path))}
+
+    _write(path, HEADER + "1,Shirt\n2,Hat\n")
+
+    assert plan_ingest(str(path), previous)["mode"] == "full"
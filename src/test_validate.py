@@ -3,6 +3,9 @@ from src.validate import (
     check_missing_columns,
     apply_schema_casts,
     apply_business_rules,
+    cast_columns,
+    parse_datetimes,
+    parse_type_spec,
 )
 
 
@@ -87,3 +90,30 @@ def test_apply_business_rules_flags_invalid_rows_and_keeps_valid():
     # And 3 rejected rows
     assert len(reject_df) == 3
 
+
+
+def test_datetime_schema_accepts_explicit_format():
+    assert parse_type_spec("datetime") == ("datetime", None)
+    assert parse_type_spec("datetime:%d/%m/%Y") == ("datetime", "%d/%m/%Y")
+    assert parse_type_spec({"type": "datetime", "format": "%Y-%m-%d"}) == ("datetime", "%Y-%m-%d")
+
+    df = pd.DataFrame({"date purchase": ["05/02/2023", "31/12/2023", "nope", None]})
+    bad_mask = cast_columns(df, {"date purchase": {"type": "datetime", "format": "%d/%m/%Y"}})
+
+    assert df["date purchase"].tolist()[:2] == [pd.Timestamp("2023-02-05"), pd.Timestamp("2023-12-31")]
+    assert bad_mask.tolist() == [False, False, True, True]
+
+
+def test_parse_datetimes_matches_to_datetime_and_falls_back_for_odd_rows():
+    series = pd.Series(["2023-02-05", "2023-07-11", "2023-02-05", None, "", "not_a_date"])
+    parsed = parse_datetimes(series)
+
+    expected = pd.to_datetime(series, errors="coerce")
+    assert parsed.equals(expected)
+    assert parsed.dtype == "datetime64[ns]"
+
+    # a row in another layout misses the guessed format but the slow path still reads it
+    mixed = parse_datetimes(pd.Series(["2023-02-05", " 2023-07-11", "July 4 2023"]))
+    assert mixed.tolist() == [
+        pd.Timestamp("2023-02-05"), pd.Timestamp("2023-07-11"), pd.Timestamp("2023-07-04"),
+    ]
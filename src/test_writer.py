@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+from src.writer import BackgroundWriter
+
+
+def test_writes_run_in_submit_order_off_the_main_thread():
+    seen = []
+    with BackgroundWriter(max_pending=2) as writer:
+        for i in range(5):
+            writer.submit(lambda i=i: seen.append((i, threading.current_thread().name)))
+
+    assert [i for i, _ in seen] == [0, 1, 2, 3, 4]
+    assert all(name == "db-writer" for _, name in seen)
+
+
+def test_submit_blocks_when_queue_is_full():
+    release = threading.Event()
+    writer = BackgroundWriter(max_pending=1)
+    writer.submit(release.wait)   # picked up by the writer, blocks it
+    writer.submit(lambda: None)   # fills the queue
+
+    submitted = threading.Event()
+    blocked = threading.Thread(target=lambda: (writer.submit(lambda: None), submitted.set()))
+    blocked.start()
+    assert not submitted.wait(0.2)
+
+    release.set()
+    assert submitted.wait(2)
+    blocked.join()
+    writer.close()
+
+
+def test_first_failure_is_raised_in_the_caller():
+    ran = []
+
+    def fail():
+        raise RuntimeError("db down")
+
+    writer = BackgroundWriter()
+    writer.submit(fail)
+    writer.submit(lambda: ran.append(1))  # skipped after the failure
+
+    with pytest.raises(RuntimeError, match="db down"):
+        writer.close()
+    assert ran == []
@@ -1,4 +1,14 @@
+import warnings
+
+import numpy as np
 import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+
+from src.logs.logging_config import get_logger
+from src.rules import compile_rules, evaluate_rules, failed_rule_labels
+
+logger = get_logger(__name__)
+
 """"Validate will look at the data that is load 
 to see if the is valid (follow the schema rules) """ 
 
@@ -14,23 +24,134 @@ def check_missing_columns(df, schema):
     #    return "None"
     return missing
 
-import pandas as pd
+
+def string_dtype_for(series) -> str:
+    """
+    String dtype to cast a column to: "string[pyarrow]" if the column is
+    already Arrow-backed (keeps it in Arrow memory), else "string".
+    """
+    dtype = series.dtype
+    if isinstance(dtype, pd.ArrowDtype) or getattr(dtype, "storage", None) == "pyarrow":
+        return "string[pyarrow]"
+    return "string"
 
 
-def apply_schema_casts(df, schema: dict):
+def parse_type_spec(spec):
     """
-    Cast columns in df to the types defined in schema.
-    Returns (valid_df, reject_df):
-      - valid_df: rows where all non-string columns cast successfully
-      - reject_df: rows where at least one non-string column failed casting
+    Split a schema entry into (type_name, format). Accepted forms:
+      - "datetime"
+      - "datetime:%Y-%m-%d"
+      - {"type": "datetime", "format": "%Y-%m-%d"}
+    """
+    if isinstance(spec, dict):
+        return spec.get("type"), spec.get("format")
+    if isinstance(spec, str) and ":" in spec:
+        type_name, fmt = spec.split(":", 1)
+        return type_name.strip(), fmt.strip() or None
+    return spec, None
+
+
+def _format_hits(text: pd.Index, fmt: str) -> int:
+    """How many of the (non-empty) strings fmt can read."""
+    return int(pd.to_datetime(text, format=fmt, errors="coerce").notna().sum())
+
+
+def _guess_format(text: pd.Index, current: str | None = None) -> str | None:
+    """
+    Best datetime format for these distinct, stripped, non-empty strings.
+    Candidates are the month-first and day-first guesses for the first few
+    values (plus the current format); the one that reads the most strings
+    wins, ties keep the earlier candidate (current, then month-first).
+    """
+    candidates = [current] if current else []
+    for value in text[:20]:
+        for dayfirst in (False, True):
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")  # "dayfirst was specified" noise, we try both on purpose
+                fmt = guess_datetime_format(value, dayfirst=dayfirst)
+            if fmt is not None and fmt not in candidates:
+                candidates.append(fmt)
+    if not candidates:
+        return None
+    sample = text[:1000]
+    hits = [_format_hits(sample, fmt) for fmt in candidates]
+    return candidates[int(np.argmax(hits))]
+
+
+def parse_datetimes(series, fmt: str | None = None, col=None, format_cache: dict | None = None) -> pd.Series:
+    """
+    Fast pd.to_datetime(series, errors="coerce") for string columns.
+
+    - every distinct string is parsed once (purchase dates repeat a lot) and
+      the result is broadcast back through the factorize codes
+    - with an explicit or guessed format the vectorized parser runs without
+      per-element inference
+    - format_cache: {column: guessed format} owned by ONE source file (see
+      run_source), so later chunks start from the guess of earlier ones; the
+      guess is re-checked on every chunk and replaced when another format
+      reads more of its values (e.g. "25/12/2023" shows up in a feed whose
+      first chunk only had ambiguous day/month dates)
+    - only the values that fail that fast path go through the slow, mixed-format
+      parser; anything still unparseable becomes NaT
+    """
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return series
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+    elif pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype):
+        codes, uniques = pd.factorize(series)
+    else:
+        return pd.to_datetime(series, errors="coerce")
+
+    uniques = pd.Index(np.asarray(uniques, dtype=object))
+    if len(uniques) == 0:
+        return pd.Series(pd.NaT, index=series.index, name=series.name, dtype="datetime64[ns]")
+    text = uniques.astype(str).str.strip()
+    non_empty = text[text != ""]
+
+    if fmt is None and len(non_empty):
+        cached = (format_cache or {}).get(col)
+        fmt = cached
+        if fmt is None or _format_hits(non_empty, fmt) < len(non_empty):
+            fmt = _guess_format(non_empty, current=cached)
+            if cached is not None and fmt != cached:
+                logger.warning(
+                    f"   Column {col!r}: datetime format {cached!r} does not fit this chunk, "
+                    f"switching to {fmt!r} (earlier chunks were parsed with {cached!r})"
+                )
+        if format_cache is not None and col is not None:
+            format_cache[col] = fmt
+    if fmt is not None:
+        parsed = pd.to_datetime(text, format=fmt, errors="coerce")
+        failed = parsed.isna() & (text != "")
+    else:
+        parsed = pd.DatetimeIndex([pd.NaT] * len(text), dtype="datetime64[ns]")
+        failed = text != ""
+
+    if failed.any():
+        # slow path, only for the distinct values the fast path could not read
+        slow = pd.to_datetime(text[failed], errors="coerce", format="mixed")
+        values = parsed.as_unit("ns").to_numpy(copy=True)
+        values[failed] = slow.as_unit("ns").to_numpy()
+        parsed = pd.DatetimeIndex(values)
+
+    # code -1 (missing) picks the trailing NaT
+    lookup = parsed.as_unit("ns").append(pd.DatetimeIndex([pd.NaT]).as_unit("ns"))
+    return pd.Series(lookup.take(codes), index=series.index, name=series.name)
+
+
+def cast_columns(df, schema: dict, format_cache: dict | None = None) -> np.ndarray:
+    """
+    Cast the schema columns of df IN PLACE (no copy of the frame).
+    format_cache: per-file datetime format guesses (see parse_datetimes).
+    Returns a bool array: True = at least one non-string column failed casting.
     """
-    df = df.copy()
-    
     # 1. Try to cast each column based on schema
-    for col, type_name in schema.items():
+    for col, spec in schema.items():
         if col not in df.columns:
             continue  # missing columns already handled elsewhere
         
+        type_name, fmt = parse_type_spec(spec)
         series = df[col]
 
         if type_name == "int":
@@ -38,9 +159,13 @@ def apply_schema_casts(df, schema: dict):
         elif type_name == "float":
             casted = pd.to_numeric(series, errors="coerce")
         elif type_name == "datetime":
-            casted = pd.to_datetime(series, errors="coerce")
+            casted = parse_datetimes(series, fmt, col=col, format_cache=format_cache)
         elif type_name == "str":
-            casted = series.astype("string")
+            # keep Arrow-backed columns in Arrow memory (no Python string objects)
+            casted = series.astype(string_dtype_for(series))
+        elif type_name == "category":
+            # low-cardinality strings: small codes array + one dictionary of values
+            casted = series if isinstance(series.dtype, pd.CategoricalDtype) else series.astype("category")
         else:
             # unknown type, leave as is
             casted = series
@@ -49,11 +174,22 @@ def apply_schema_casts(df, schema: dict):
 
     # 2. Build a mask of bad rows:
     # any row where a non-string column is NaN after casting = invalid
-    non_str_cols = [c for c, t in schema.items() if t in ("int", "float", "datetime")]
-    if non_str_cols:
-        bad_mask = df[non_str_cols].isna().any(axis=1)
-    else:
-        bad_mask = pd.Series(False, index=df.index)
+    bad_mask = np.zeros(len(df), dtype=bool)
+    for col, spec in schema.items():
+        if parse_type_spec(spec)[0] in ("int", "float", "datetime") and col in df.columns:
+            bad_mask |= df[col].isna().to_numpy()
+    return bad_mask
+
+
+def apply_schema_casts(df, schema: dict):
+    """
+    Cast columns in df to the types defined in schema.
+    Returns (valid_df, reject_df):
+      - valid_df: rows where all non-string columns cast successfully
+      - reject_df: rows where at least one non-string column failed casting
+    """
+    df = df.copy()
+    bad_mask = cast_columns(df, schema)
 
     reject_df = df[bad_mask].reset_index(drop=True)
     valid_df = df[~bad_mask].reset_index(drop=True)
@@ -61,35 +197,48 @@ def apply_schema_casts(df, schema: dict):
     return valid_df, reject_df
 
 
-def apply_business_rules(df):
-    df = df.copy()
-    # Start with all rows marked as good (False = not bad)
-    bad_mask = pd.Series(False, index=df.index)
-
-    # 1) purchase amount (usd) must be >= 0
-    if "purchase amount (usd)" in df.columns:
-        bad_mask |= df["purchase amount (usd)"] < 0
-
-    # 2) review rating must be between 0 and 5, but allow nulls
-    if "review rating" in df.columns:
-        rating = df["review rating"]
-        invalid_rating = rating.notna() & ((rating < 0) | (rating > 5))
-        bad_mask |= invalid_rating
-
-    # 3) payment method must be either 'Cash' or 'Credit Card'
-    if "payment method" in df.columns:
-        allowed = ["Cash", "Credit Card"]
-        bad_mask |= ~df["payment method"].isin(allowed)
-        
-    # 4) item purchased cannot be empty/blank
-    if "item purchased" in df.columns:
-        empty_item = (
-            df["item purchased"].isna()
-            | (df["item purchased"].astype("string").str.strip() == "")
-        )
-        bad_mask |= empty_item
+# Rules used when a source does not define `rules:` in sources.yml
+DEFAULT_RULES = [
+    "purchase amount (usd) >= 0",                   # 1) amount must be >= 0
+    "review rating BETWEEN 0 AND 5",                # 2) rating 0..5, nulls allowed
+    "payment method IN ('Cash', 'Credit Card')",    # 3) only Cash / Credit Card
+    "item purchased IS NOT BLANK",                  # 4) item cannot be empty/blank
+]
+
+
+def business_rule_failures(df, rules=None, counts: dict | None = None, skip_mask=None):
+    """
+    Evaluate the rules over df without copying it.
+    Returns (fail_matrix, rules_used) as in rules.evaluate_rules.
+    - skip_mask: rows to ignore (e.g. already rejected by casting); they never fail
+    - counts: optional dict; per-rule reject counts are added into it
+    """
+    compiled = compile_rules(DEFAULT_RULES if rules is None else rules)
+    fail_matrix, rules_used = evaluate_rules(df, compiled)
+    if skip_mask is not None:
+        fail_matrix[skip_mask] = False
+
+    if counts is not None:
+        for rule, n_failed in zip(rules_used, fail_matrix.sum(axis=0)):
+            counts[rule.text] = counts.get(rule.text, 0) + int(n_failed)
+
+    return fail_matrix, rules_used
+
+
+def apply_business_rules(df, rules=None, counts: dict | None = None):
+    """
+    Split df into (valid_df, reject_df) using the business rules.
+
+    - rules: the source's `rules:` list from sources.yml (DEFAULT_RULES if None);
+      they are compiled once into vectorized checks (see rules.py)
+    - reject_df gets a `failed_rules` column naming every rule the row broke
+    - counts: optional dict; per-rule reject counts are added into it
+    """
+    fail_matrix, rules_used = business_rule_failures(df, rules, counts)
+    bad_mask = fail_matrix.any(axis=1)
 
     reject_df = df[bad_mask].reset_index(drop=True)
+    reject_df["failed_rules"] = failed_rule_labels(fail_matrix[bad_mask], rules_used)
     valid_df = df[~bad_mask].reset_index(drop=True)
 
-    return valid_df, reject_df
\ No newline at end of file
+    return valid_df, reject_df
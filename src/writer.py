@@ -0,0 +1,82 @@
+"""
+writer.py
+
+Background DB writer used by the pipelined mode of main.run_source().
+
+The main thread parses / validates / cleans chunk N+1 while this thread is
+still loading chunk N (rejects + upsert), so CPU work and DB round trips
+overlap instead of alternating.
+
+- Work items are plain callables pushed onto a bounded queue: when the
+  writer falls behind, submit() blocks (backpressure), so at most
+  max_pending chunks are ever waiting in memory
+- Items run strictly in submit order on one thread, so chunk N is always
+  written before chunk N+1 (last-wins upserts stay correct)
+- The first failure stops the writer; it is re-raised in the main thread by
+  the next submit() or by close()
+"""
+
+import queue
+import threading
+
+from src.logs.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_MAX_PENDING = 2
+
+_STOP = object()
+
+
+class BackgroundWriter:
+    """One writer thread + bounded queue. Use as a context manager."""
+
+    def __init__(self, max_pending: int = DEFAULT_MAX_PENDING, name: str = "db-writer"):
+        self._queue = queue.Queue(maxsize=max(int(max_pending), 1))
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                if self._error is None:  # after a failure, just drain
+                    fn, args, kwargs = item
+                    fn(*args, **kwargs)
+            except BaseException as exc:
+                self._error = exc
+                logger.error(f"Background write failed: {exc}")
+            finally:
+                self._queue.task_done()
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, fn, *args, **kwargs) -> None:
+        """Queue fn(*args, **kwargs); blocks while max_pending items are already waiting."""
+        self._raise_if_failed()
+        self._queue.put((fn, args, kwargs))
+
+    def close(self) -> None:
+        """Wait for every queued write to finish; re-raise the first failure."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        self._raise_if_failed()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        # Already failing: stop the writer but keep the original exception
+        try:
+            self.close()
+        except BaseException as write_exc:
+            logger.error(f"Background writer also failed: {write_exc}")